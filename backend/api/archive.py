@@ -0,0 +1,172 @@
+import gzip
+import heapq
+import json
+import os
+import re
+from collections import deque
+from datetime import datetime, timedelta, timezone as dt_timezone
+from pathlib import Path
+
+from django.conf import settings
+
+# Архив логов: gzip-файлы JSONL, по одному на выгруженный диапазон времени.
+# Диапазон [start, end) в UTC записан в имени файла, поэтому чтение архива
+# открывает только файлы, пересекающиеся с запрошенным окном. Строки в файле
+# упорядочены по (logged_at, id); записи самодостаточны - в них есть имена
+# мастера, операции и заказа на момент выгрузки.
+
+ARCHIVE_VALUES = (
+    'id', 'logged_at', 'master_id', 'master__username', 'info', 'type',
+    'operation_id', 'operation__name', 'operation__order_id', 'operation__order__name', 'search_text',
+)
+ARCHIVE_KEYS = (
+    'id', 'logged_at', 'master', 'master_name', 'info', 'type',
+    'operation', 'operation_name', 'order', 'order_name', 'search_text',
+)
+FILE_RE = re.compile(r'^tehlog-(\d{8}T\d{6})-(\d{8}T\d{6})(?:-\d+)?\.jsonl\.gz$')
+STAMP = '%Y%m%dT%H%M%S'
+EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+
+
+def archive_dir():
+    return Path(getattr(settings, 'TEHLOG_ARCHIVE_DIR', settings.BASE_DIR / 'archive' / 'tehlog'))
+
+
+def _stamp(value):
+    return value.astimezone(dt_timezone.utc).strftime(STAMP)
+
+
+def _parse_stamp(value):
+    return datetime.strptime(value, STAMP).replace(tzinfo=dt_timezone.utc)
+
+
+def write_archive(rows, start, end, directory=None):
+    """
+    Пишет строки (кортежи в порядке ARCHIVE_VALUES, обычно из
+    values_list().iterator()) в файл диапазона [start, end). Память не
+    зависит от числа строк. Файл появляется под своим именем только после
+    fsync - недописанный архив не будет прочитан.
+    Возвращает (путь или None, если строк не было, число строк).
+    """
+    directory = Path(directory or archive_dir())
+    directory.mkdir(parents=True, exist_ok=True)
+    name = f"tehlog-{_stamp(start)}-{_stamp(end)}.jsonl.gz"
+    tmp = directory / f".{name}.tmp"
+
+    count = 0
+    with open(tmp, 'wb') as raw:
+        with gzip.GzipFile(fileobj=raw, mode='wb', mtime=0) as gz:
+            for row in rows:
+                record = dict(zip(ARCHIVE_KEYS, row))
+                record['logged_at'] = record['logged_at'].astimezone(dt_timezone.utc).isoformat()
+                gz.write(json.dumps(record, ensure_ascii=False).encode('utf-8'))
+                gz.write(b'\n')
+                count += 1
+        raw.flush()
+        os.fsync(raw.fileno())
+
+    if not count:
+        tmp.unlink()
+        return None, 0
+    # Повторная выгрузка того же диапазона (например, остатки из секции по умолчанию)
+    # не перезаписывает прежний файл
+    path, suffix = directory / name, 0
+    while path.exists():
+        suffix += 1
+        path = directory / name.replace('.jsonl.gz', f'-{suffix}.jsonl.gz')
+    os.replace(tmp, path)
+    return path, count
+
+
+def archive_files(date_from=None, date_to=None, directory=None):
+    """Файлы архива [(start, end, path)], пересекающиеся с окном, по возрастанию start."""
+    directory = Path(directory or archive_dir())
+    if not directory.is_dir():
+        return []
+    files = []
+    for path in directory.iterdir():
+        match = FILE_RE.match(path.name)
+        if not match:
+            continue
+        start, end = _parse_stamp(match.group(1)), _parse_stamp(match.group(2))
+        if date_from and end <= date_from:
+            continue
+        if date_to and start > date_to:
+            continue
+        files.append((start, end, path))
+    files.sort(key=lambda item: (item[0], item[1], item[2].name))
+    return files
+
+
+def encode_cursor(record):
+    """Курсор "мкс:id" записи - следующая страница начинается строго старше неё."""
+    delta = record['logged_at'] - EPOCH
+    micros = (delta.days * 86400 + delta.seconds) * 1_000_000 + delta.microseconds
+    return f"{micros}:{record['id']}"
+
+
+def decode_cursor(value):
+    micros, pk = value.split(':')
+    return EPOCH + timedelta(microseconds=int(micros)), int(pk)
+
+
+def _read(path):
+    with gzip.open(path, 'rt', encoding='utf-8') as lines:
+        for line in lines:
+            record = json.loads(line)
+            record['logged_at'] = datetime.fromisoformat(record['logged_at'])
+            yield record
+
+
+def _overlapping_groups(files):
+    """
+    Файлы [(start, end, path)] по возрастанию start, сгруппированные так, что
+    диапазоны групп не пересекаются. Пересекаются, например, файл месяца и
+    его дозапись с суффиксом -N (остатки из секции по умолчанию).
+    """
+    groups = []
+    group_end = None
+    for start, end, path in files:
+        if groups and start < group_end:
+            groups[-1].append(path)
+            group_end = max(group_end, end)
+        else:
+            groups.append([path])
+            group_end = end
+    return groups
+
+
+def _sort_key(record):
+    return record['logged_at'], record['id']
+
+
+def latest_archived_logs(limit, date_from=None, date_to=None, search=None, before=None, directory=None):
+    """
+    До limit записей архива от новых к старым. Файлы читаются потоково от
+    самого нового; пересекающиеся по времени сливаются heapq.merge по
+    (logged_at, id), поэтому порядок общий и курсор ничего не пропускает.
+    Из каждой группы файлов в памяти остаются только последние подходящие
+    записи (deque с maxlen), поэтому память ограничена limit.
+    before - курсор (logged_at, id): только записи строго старше него.
+    search - подстроки через пробел, все должны входить в search_text.
+    """
+    terms = [term for term in (search or '').lower().split() if term]
+    result = []
+    for paths in reversed(_overlapping_groups(archive_files(date_from, date_to, directory))):
+        needed = limit - len(result)
+        if needed <= 0:
+            break
+        tail = deque(maxlen=needed)
+        for record in heapq.merge(*(_read(path) for path in paths), key=_sort_key):
+            logged_at = record['logged_at']
+            if date_from and logged_at < date_from:
+                continue
+            if date_to and logged_at > date_to:
+                break
+            if before and (logged_at, record['id']) >= before:
+                break
+            if terms and not all(term in record['search_text'] for term in terms):
+                continue
+            tail.append(record)
+        result.extend(reversed(tail))
+    return result
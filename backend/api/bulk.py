@@ -0,0 +1,267 @@
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from rest_framework import exceptions, serializers
+
+from api.events import publish_events, publish_forecast, operation_event_payload, Kind
+from api.graph import bump_graph_version, deferred_graph_bumps
+from api.models import AssemblyShop, Executor, Operation, Order, TehLogOutbox
+from api.outbox import enqueue_logs
+from api.reforecast import enqueue_forecast
+from api.utils import topological_order
+
+User = get_user_model()
+
+# Поля операции, которые пакетное сохранение пишет через bulk_update
+BULK_OPERATION_FIELDS = [
+    'name', 'description', 'assembly_shop', 'master', 'previous_operation',
+    'planned_start', 'planned_end', 'predict_start', 'predict_end', 'updated_at',
+]
+
+
+def _check_references(data):
+    """Цехи, мастера и исполнители из запроса проверяются тремя запросами на весь заказ."""
+    operations = data['operations']
+    checks = (
+        ('assembly_shop', AssemblyShop.objects, {op['assembly_shop'] for op in operations if op.get('assembly_shop')}),
+        ('master', User.objects, {op['master'] for op in operations if op.get('master')} | (
+            {data['default_master']} if data.get('default_master') else set()
+        )),
+        ('executors', Executor.objects, {pk for op in operations for pk in op.get('executors', ())}),
+    )
+    for field, manager, ids in checks:
+        if not ids:
+            continue
+        missing = ids - set(manager.filter(pk__in=ids).values_list('pk', flat=True))
+        if missing:
+            raise serializers.ValidationError({field: f"Не найдены id: {sorted(missing)}"})
+
+
+def save_order_bulk(data, user, order=None):
+    """
+    Создаёт (order=None) или обновляет заказ вместе с полным списком операций
+    в одной транзакции. data - validated_data OrderBulkSerializer.
+
+    Новые операции создаются одним bulk_create, существующие и связи с новыми
+    родителями пишутся одним bulk_update, исполнители - через промежуточную
+    таблицу. Прогнозы считаются за один проход в топологическом порядке,
+    граф заказа сбрасывается один раз. Сигналы Operation отправляет только
+    удаление убранных операций, их сбросы графа собирает deferred_graph_bumps.
+
+    Возвращает (order, {ссылка из запроса: id операции}).
+    """
+    items = data['operations']
+    now = timezone.now()
+
+    with transaction.atomic(), deferred_graph_bumps():
+        _check_references(data)
+
+        if order is None:
+            order = Order(created_by=user)
+            existing = {}
+        else:
+            order = Order.objects.select_for_update().get(pk=order.pk)
+            existing = Operation.objects.select_for_update().filter(order=order).in_bulk()
+
+        old_master_id = order.default_master_id
+        order.name = data['name']
+        order.deadline = data['deadline']
+        if 'description' in data:
+            order.description = data['description']
+        if 'default_master' in data:
+            order.default_master_id = data['default_master']
+        order.save()
+        master_changed = order.default_master_id != old_master_id
+
+        unknown = [item['id'] for item in items if isinstance(item['id'], int) and item['id'] not in existing]
+        if unknown:
+            raise serializers.ValidationError({'operations': f"Операции {unknown} не принадлежат заказу"})
+
+        # Операции заказа, которых нет в списке, удаляются
+        kept = {item['id'] for item in items}
+        removed = [pk for pk in existing if pk not in kept]
+        if removed:
+            Operation.objects.filter(pk__in=removed).delete()
+
+        operations = {}
+        old_forecasts = {}
+        for item in items:
+            ref = item['id']
+            if isinstance(ref, int):
+                op = existing[ref]
+                old_forecasts[ref] = (op.predict_start, op.predict_end)
+                # Смена мастера по умолчанию переносится на операции, как в OrderDetail
+                if master_changed:
+                    op.master_id = order.default_master_id
+            else:
+                op = Operation(order=order)
+            op.name = item['name']
+            if 'description' in item:
+                op.description = item['description']
+            if 'assembly_shop' in item:
+                op.assembly_shop_id = item['assembly_shop']
+            if 'master' in item:
+                op.master_id = item['master']
+            if op.pk is None and not op.master_id:
+                op.master_id = order.default_master_id
+            op.planned_start = item['planned_start']
+            op.planned_end = item['planned_end']
+            op.updated_at = now
+            operations[ref] = op
+
+        # Прогнозы: корни - как у Operation.save()/без изменений, потомки - от родителя
+        parents = {item['id']: item.get('previous_operation') for item in items}
+        for ref in topological_order(parents):
+            op = operations[ref]
+            parent = operations.get(parents[ref])
+            if parent is None:
+                if op.pk is None:
+                    op.predict_start = op.planned_start
+                    op.predict_end = op.planned_end
+                continue
+            reference_end = parent.predict_end or parent.actual_end or parent.planned_end
+            op.predict_start = reference_end
+            op.predict_end = reference_end + op.duration
+
+        # Новые операции: родитель известен сразу, только если он уже существует
+        new_refs = [ref for ref, op in operations.items() if op.pk is None]
+        for ref in new_refs:
+            parent = parents[ref]
+            operations[ref].previous_operation_id = parent if isinstance(parent, int) else None
+        Operation.objects.bulk_create([operations[ref] for ref in new_refs], batch_size=500)
+
+        to_update = []
+        for ref, op in operations.items():
+            parent = operations.get(parents[ref])
+            parent_id = parent.pk if parent is not None else None
+            if ref in existing or op.previous_operation_id != parent_id:
+                op.previous_operation_id = parent_id
+                to_update.append(op)
+        if to_update:
+            Operation.objects.bulk_update(to_update, BULK_OPERATION_FIELDS, batch_size=500)
+
+        _save_executors(items, operations, existing)
+
+        bump_graph_version([order.pk])
+        publish_forecast([
+            op for ref, op in operations.items()
+            if ref in old_forecasts and old_forecasts[ref] != (op.predict_start, op.predict_end)
+        ])
+
+    return order, {ref: op.pk for ref, op in operations.items()}
+
+
+def _save_executors(items, operations, existing):
+    """Исполнители операций: удаляются и добавляются только изменившиеся наборы."""
+    through = Operation.executors.through
+    wanted = {operations[item['id']].pk: set(item['executors']) for item in items if 'executors' in item}
+    if not wanted:
+        return
+
+    # У только что созданных операций исполнителей ещё нет
+    current = {}
+    existing_ids = [pk for pk in wanted if pk in existing]
+    if existing_ids:
+        rows = through.objects.filter(operation_id__in=existing_ids).values_list('operation_id', 'executor_id')
+        for operation_id, executor_id in rows:
+            current.setdefault(operation_id, set()).add(executor_id)
+
+    changed = [pk for pk, executor_ids in wanted.items() if current.get(pk, set()) != executor_ids]
+    if not changed:
+        return
+    stale = [pk for pk in changed if pk in current]
+    if stale:
+        through.objects.filter(operation_id__in=stale).delete()
+    through.objects.bulk_create([
+        through(operation_id=pk, executor_id=executor_id)
+        for pk in changed for executor_id in sorted(wanted[pk])
+    ], batch_size=500)
+
+
+def _lock_operations(ids, user):
+    """
+    Блокирует операции пакета одним SELECT ... FOR UPDATE и проверяет права:
+    мастер может менять только свои операции.
+    """
+    operations = Operation.objects.select_for_update().filter(pk__in=ids).in_bulk()
+    missing = [pk for pk in ids if pk not in operations]
+    if missing:
+        raise exceptions.NotFound(f"Операции не найдены: {missing}")
+    if user.role == 'master':
+        foreign = [pk for pk in ids if operations[pk].master_id != user.pk]
+        if foreign:
+            raise exceptions.PermissionDenied(f"Not assigned master: {foreign}")
+    return [operations[pk] for pk in ids]
+
+
+def _finish_batch(operations, kind, user, log_kind):
+    """Потомки и логи мастера - в очереди фоновых воркеров, события одной вставкой."""
+    # bulk_update не шлёт сигналов - в очередь прогнозов ставим сами
+    enqueue_forecast(operations)
+
+    publish_events([(kind, operation_event_payload(op), op.order_id) for op in operations])
+    if user.role == 'master':
+        enqueue_logs(log_kind, operations)
+
+
+def start_operations(items, user):
+    """
+    Старт нескольких операций в одной транзакции. items - validated_data
+    OperationBatchStartSerializer: id, assembly_shop_id, executor_ids.
+    Всё или ничего: при любой ошибке ни одна операция не стартует.
+    """
+    ids = [item['id'] for item in items]
+    with transaction.atomic():
+        operations = _lock_operations(ids, user)
+        started = [op.pk for op in operations if op.actual_start]
+        if started:
+            raise exceptions.ValidationError({'detail': f"Operation already started: {started}"})
+
+        shop_ids = {item['assembly_shop_id'] for item in items}
+        shops = AssemblyShop.objects.in_bulk(shop_ids)
+        if len(shops) != len(shop_ids):
+            raise exceptions.NotFound(f"Цехи не найдены: {sorted(shop_ids - shops.keys())}")
+        executor_ids = {pk for item in items for pk in item['executor_ids']}
+        found = set(Executor.objects.filter(pk__in=executor_ids).values_list('pk', flat=True))
+        if found != executor_ids:
+            raise exceptions.ValidationError({'detail': "Some executors not found"})
+
+        now = timezone.now()
+        for op, item in zip(operations, items):
+            op.assembly_shop = shops[item['assembly_shop_id']]
+            op.actual_start = now
+            op.predict_start = now
+            op.predict_end = now + op.duration
+            op.updated_at = now
+        Operation.objects.bulk_update(
+            operations, ['assembly_shop', 'actual_start', 'predict_start', 'predict_end', 'updated_at'],
+        )
+
+        # executors.set() для всех операций сразу
+        through = Operation.executors.through
+        through.objects.filter(operation_id__in=ids).delete()
+        through.objects.bulk_create([
+            through(operation_id=item['id'], executor_id=pk)
+            for item in items for pk in dict.fromkeys(item['executor_ids'])
+        ])
+
+        _finish_batch(operations, Kind.OPERATION_STARTED, user, TehLogOutbox.Kind.START)
+    return operations
+
+
+def end_operations(ids, user):
+    """Завершение нескольких операций в одной транзакции, всё или ничего."""
+    with transaction.atomic():
+        operations = _lock_operations(ids, user)
+        not_started = [op.pk for op in operations if not op.actual_start]
+        if not_started:
+            raise exceptions.ValidationError({'detail': f"Operation has not been started: {not_started}"})
+
+        now = timezone.now()
+        for op in operations:
+            op.actual_end = now
+            op.updated_at = now
+        Operation.objects.bulk_update(operations, ['actual_end', 'updated_at'])
+
+        _finish_batch(operations, Kind.OPERATION_ENDED, user, TehLogOutbox.Kind.END)
+    return operations
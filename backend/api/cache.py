@@ -0,0 +1,181 @@
+import secrets
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.db.models import F
+from rest_framework.response import Response
+
+from api.models import ReferenceCacheCounter
+
+# Справочники (цехи, исполнители, мастера) кэшируются в общем для всех
+# воркеров бэкенде (по умолчанию DatabaseCache). У каждого справочника есть
+# ключ версии; запись кэша хранит версию, с которой она была построена, и
+# отбрасывается, если версия с тех пор сменилась. Версию меняют сигналы
+# save/delete/m2m_changed (api.signals) после коммита транзакции.
+# queryset.update() и bulk_* сигналов не шлют - после них нужен bump_reference_version.
+
+WORKSHOPS = 'workshops'
+EXECUTORS = 'executors'
+MASTERS = 'masters'
+NAMESPACES = (WORKSHOPS, EXECUTORS, MASTERS)
+
+STATS_FLUSH_INTERVAL = 10  # секунд
+
+
+def reference_cache():
+    return caches[getattr(settings, 'REFERENCE_CACHE_ALIAS', 'reference')]
+
+
+def _version_key(namespace):
+    return f'{namespace}:version'
+
+
+def _entry_key(namespace, path):
+    return f'{namespace}:entry:{path}'
+
+
+def bump_reference_version(*namespaces):
+    """
+    Новая версия справочников - после коммита текущей транзакции, чтобы
+    другой воркер не закэшировал под новой версией ещё не видные ему данные.
+    Версия случайная: после вытеснения ключа старые записи не оживут.
+    """
+    def bump():
+        reference_cache().set_many(
+            {_version_key(namespace): secrets.randbits(62) for namespace in namespaces},
+            timeout=None,
+        )
+
+    transaction.on_commit(bump)
+
+
+def reference_versions(*namespaces):
+    """Текущие версии справочников одним get_many - для ETag ответов с их именами."""
+    keys = [_version_key(namespace) for namespace in namespaces]
+    values = reference_cache().get_many(keys)
+    return tuple(values.get(key) for key in keys)
+
+
+def add_counters(namespace, counts):
+    """
+    Прибавляет {имя: n} к общим счётчикам ReferenceCacheCounter: недостающие
+    строки создаются, значения меняются атомарным UPDATE count = count + n.
+    """
+    if not counts:
+        return
+    ReferenceCacheCounter.objects.bulk_create(
+        [ReferenceCacheCounter(namespace=namespace, name=name) for name in counts],
+        ignore_conflicts=True,
+    )
+    for name, count in counts.items():
+        ReferenceCacheCounter.objects.filter(namespace=namespace, name=name).update(count=F('count') + count)
+
+
+class CacheStats:
+    """
+    Счётчики попаданий и промахов. Копятся в памяти процесса и раз в
+    STATS_FLUSH_INTERVAL секунд добавляются к общим счётчикам в таблице
+    ReferenceCacheCounter атомарным UPDATE - без записи на каждый запрос и
+    без потерь при одновременном сбросе из нескольких воркеров.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._flushed_at = time.monotonic()
+
+    def record(self, namespace, name):
+        with self._lock:
+            key = (namespace, name)
+            self._pending[key] = self._pending.get(key, 0) + 1
+            if time.monotonic() - self._flushed_at < STATS_FLUSH_INTERVAL:
+                return
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        self._flush(pending)
+
+    def _flush(self, pending):
+        by_namespace = {}
+        for (namespace, name), count in pending.items():
+            by_namespace.setdefault(namespace, {})[name] = count
+        for namespace, counts in by_namespace.items():
+            add_counters(namespace, counts)
+
+    def snapshot(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+        self._flush(pending)
+
+        # Только что сброшенное читаем с основной базы, а не с реплики
+        counts = {
+            (namespace, name): count
+            for namespace, name, count in ReferenceCacheCounter.objects.using('default')
+            .values_list('namespace', 'name', 'count')
+        }
+        versions = reference_cache().get_many([_version_key(namespace) for namespace in NAMESPACES])
+        return {
+            namespace: {
+                'hits': counts.get((namespace, 'hits'), 0),
+                'misses': counts.get((namespace, 'misses'), 0),
+                'version': versions.get(_version_key(namespace)),
+            }
+            for namespace in NAMESPACES
+        }
+
+
+stats = CacheStats()
+
+
+def cached_response(request, namespace, build):
+    """
+    Ответ справочника из кэша. build() возвращает (status, data); в кэш
+    попадают только ответы 200. Проверка попадания - один get_many
+    (версия + запись). Заголовок X-Cache: HIT/MISS.
+
+    Промах строится по основной базе: версия меняется после коммита записи,
+    и отстающая реплика сохранила бы под новой версией старые строки на
+    весь REFERENCE_CACHE_TIMEOUT - для всех пользователей, а не только для
+    закреплённого автора изменения.
+    """
+    from api.replicas import read_from_primary
+
+    cache = reference_cache()
+    version_key = _version_key(namespace)
+    entry_key = _entry_key(namespace, request.get_full_path())
+
+    values = cache.get_many([version_key, entry_key])
+    version = values.get(version_key)
+    entry = values.get(entry_key)
+    if version is not None and entry is not None and entry[0] == version:
+        stats.record(namespace, 'hits')
+        response = Response(entry[1])
+        response['X-Cache'] = 'HIT'
+        return response
+
+    stats.record(namespace, 'misses')
+    if version is None:
+        cache.add(version_key, secrets.randbits(62), timeout=None)
+        version = cache.get(version_key)
+    with read_from_primary():
+        status, data = build()
+    if status == 200:
+        cache.set(entry_key, (version, data), timeout=getattr(settings, 'REFERENCE_CACHE_TIMEOUT', 86400))
+    response = Response(data, status=status)
+    response['X-Cache'] = 'MISS'
+    return response
+
+
+class ReferenceCacheMixin:
+    """Кэширует list() списочного представления в пространстве cache_namespace."""
+    cache_namespace = None
+
+    def list(self, request, *args, **kwargs):
+        def build():
+            response = super(ReferenceCacheMixin, self).list(request, *args, **kwargs)
+            return response.status_code, response.data
+
+        return cached_response(request, self.cache_namespace, build)
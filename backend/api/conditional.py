@@ -0,0 +1,98 @@
+import hashlib
+
+from django.db.models import Count, Max
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+
+from api.cache import MASTERS, WORKSHOPS, reference_versions
+from api.models import Order, Operation
+
+# Ответ заказа зависит от заказа и его операций. Order.updated_at сдвигается и
+# при изменении структуры цепочки (api.graph.bump_graph_version), в том числе
+# при удалении операции, а Operation.updated_at - при любом сохранении,
+# bulk_update прогнозов и массовой смене мастера. Сериализатор и
+# sort_operations_chain для проверки не нужны.
+# В операциях есть assembly_shop_name и master_name: переименование цеха или
+# мастера меняет версию справочника (api.cache), она тоже входит в ETag.
+REFERENCES = (WORKSHOPS, MASTERS)
+
+
+def _etag(*parts):
+    return hashlib.md5("|".join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _reference_state(request):
+    if not hasattr(request, '_reference_state'):
+        request._reference_state = reference_versions(*REFERENCES)
+    return request._reference_state
+
+
+def _order_state(request, order_pk):
+    cache = request.__dict__.setdefault('_order_state', {})
+    if order_pk not in cache:
+        cache[order_pk] = Order.objects.filter(pk=order_pk)\
+            .values('updated_at', 'graph_version')\
+            .annotate(
+                operations_updated=Max('operations__updated_at'),
+                operations_count=Count('operations'),
+            ).order_by('updated_at').first()
+    return cache[order_pk]
+
+
+def order_graph_version(request, order_pk):
+    """
+    graph_version заказа из того же запроса состояния, что и ETag: ответ
+    собирается по той же версии графа, что попала в заголовок. None - заказа нет.
+    """
+    state = _order_state(request, order_pk)
+    return state['graph_version'] if state is not None else None
+
+
+def order_etag(request, pk=None, order_pk=None, **kwargs):
+    state = _order_state(request, pk or order_pk)
+    if state is None:
+        return None
+    return _etag(
+        pk or order_pk, state['updated_at'], state['graph_version'],
+        state['operations_updated'], state['operations_count'], *_reference_state(request),
+    )
+
+
+def order_last_modified(request, pk=None, order_pk=None, **kwargs):
+    state = _order_state(request, pk or order_pk)
+    if state is None:
+        return None
+    return max(filter(None, [state['updated_at'], state['operations_updated']]))
+
+
+def _order_list_state(request):
+    if not hasattr(request, '_order_list_state'):
+        orders = Order.objects.order_by().aggregate(updated=Max('updated_at'), count=Count('id'))
+        operations = Operation.objects.order_by().aggregate(updated=Max('updated_at'))
+        request._order_list_state = (orders['updated'], orders['count'], operations['updated'])
+    return request._order_list_state
+
+
+def order_list_etag(request, *args, **kwargs):
+    # Страница зависит от курсора и размера - они входят в ETag
+    return _etag(request.get_full_path(), *_order_list_state(request), *_reference_state(request))
+
+
+def order_list_last_modified(request, *args, **kwargs):
+    orders_updated, _, operations_updated = _order_list_state(request)
+    stamps = [stamp for stamp in (orders_updated, operations_updated) if stamp]
+    return max(stamps) if stamps else None
+
+
+def conditional_get(etag_func, last_modified_func):
+    """
+    Декоратор метода get DRF-представления: ETag/Last-Modified и 304 Not Modified.
+    Вешается на get, а не на dispatch, чтобы аутентификация и права
+    проверялись до ответа 304.
+    """
+    return method_decorator(condition(etag_func=etag_func, last_modified_func=last_modified_func), name='get')
+
+
+order_conditional = conditional_get(order_etag, order_last_modified)
+order_list_conditional = conditional_get(order_list_etag, order_list_last_modified)
+
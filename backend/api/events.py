@@ -0,0 +1,182 @@
+import asyncio
+import json
+import logging
+from collections import deque
+from datetime import timedelta
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from api.models import LiveEvent
+
+Kind = LiveEvent.Kind
+
+logger = logging.getLogger(__name__)
+
+
+def publish_event(kind, payload, order_id=None):
+    """
+    Публикует событие после коммита текущей транзакции: подписчики
+    никогда не увидят изменения, которые потом откатятся.
+    """
+    def create():
+        LiveEvent.objects.create(kind=kind, payload=payload, order_id=order_id)
+
+    transaction.on_commit(create)
+
+
+def publish_events(events):
+    """Несколько событий [(kind, payload, order_id)] одной вставкой после коммита."""
+    events = [LiveEvent(kind=kind, payload=payload, order_id=order_id) for kind, payload, order_id in events]
+    if events:
+        transaction.on_commit(lambda: LiveEvent.objects.bulk_create(events))
+
+
+def operation_event_payload(operation):
+    return {
+        'id': operation.pk,
+        'order': operation.order_id,
+        'status': operation.status,
+        'assembly_shop': operation.assembly_shop_id,
+        'predict_start': operation.predict_start,
+        'predict_end': operation.predict_end,
+        'actual_start': operation.actual_start,
+        'actual_end': operation.actual_end,
+    }
+
+
+def publish_forecast(operations):
+    """Одно событие operation.forecast на заказ со списком [id, predict_start, predict_end]."""
+    by_order = {}
+    for op in operations:
+        by_order.setdefault(op.order_id, []).append([op.pk, op.predict_start, op.predict_end])
+    for order_id, rows in by_order.items():
+        publish_event(Kind.OPERATION_FORECAST, {'order': order_id, 'operations': rows}, order_id=order_id)
+
+
+def format_sse(event):
+    data = json.dumps(event.payload, cls=DjangoJSONEncoder, ensure_ascii=False)
+    return f"id: {event.pk}\nevent: {event.kind}\ndata: {data}\n\n"
+
+
+class EventHub:
+    """
+    Раздача событий внутри процесса: таблицу LiveEvent опрашивает одна задача
+    на процесс, подключения ждут новых событий на asyncio.Condition и берут
+    их из кольцевого буфера. Redis и внешние брокеры не нужны - общий канал
+    между воркерами это сама таблица.
+    """
+
+    def __init__(self, poll_interval, buffer_size, retention):
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.buffer = deque(maxlen=buffer_size)
+        self.last_id = None
+        self._loop = None
+        self._condition = None
+        self._task = None
+        self._last_prune = None
+
+    def _ensure_started(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop or self._task is None or self._task.done():
+            self._loop = loop
+            self._condition = asyncio.Condition()
+            self.buffer.clear()
+            self.last_id = None
+            self._task = loop.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            try:
+                await self.poll()
+            except Exception:
+                # Ошибка БД не должна останавливать раздачу - пробуем на следующем тике
+                logger.exception("Live events poll failed")
+            await asyncio.sleep(self.poll_interval)
+
+    async def poll(self):
+        if self.last_id is None:
+            self.last_id = await sync_to_async(latest_event_id)()
+        events = await sync_to_async(events_after)(self.last_id)
+        if events:
+            self.buffer.extend(events)
+            self.last_id = events[-1].pk
+            async with self._condition:
+                self._condition.notify_all()
+        await self.prune()
+
+    async def prune(self):
+        now = timezone.now()
+        if self._last_prune and now - self._last_prune < timedelta(minutes=10):
+            return
+        self._last_prune = now
+        await sync_to_async(
+            LiveEvent.objects.filter(created_at__lt=now - self.retention).delete
+        )()
+
+    async def current_id(self):
+        self._ensure_started()
+        if self.last_id is None:
+            self.last_id = await sync_to_async(latest_event_id)()
+        return self.last_id
+
+    async def wait_events(self, after_id, timeout):
+        """События с id > after_id; если их нет - ждёт до timeout секунд."""
+        self._ensure_started()
+        events = await self._events_after(after_id)
+        if events:
+            return events
+        try:
+            async with self._condition:
+                # Предикат проверяется под блокировкой - уведомление не потеряется
+                await asyncio.wait_for(
+                    self._condition.wait_for(lambda: self.last_id is not None and self.last_id > after_id),
+                    timeout,
+                )
+        except asyncio.TimeoutError:
+            return []
+        return await self._events_after(after_id)
+
+    async def _events_after(self, after_id):
+        # Буфер покрывает after_id - отдаём из памяти, иначе (давний Last-Event-ID) - из БД
+        if self.buffer and self.buffer[0].pk <= after_id + 1:
+            return [event for event in self.buffer if event.pk > after_id]
+        if self.last_id is not None and after_id >= self.last_id:
+            return []
+        return await sync_to_async(events_after)(after_id)
+
+
+def latest_event_id():
+    """Начальная позиция: последнее событие, перед которым дыры уже не заполнятся."""
+    settled = timezone.now() - timedelta(seconds=getattr(settings, 'LIVE_EVENTS_GAP_WAIT', 5))
+    return LiveEvent.objects.filter(created_at__lte=settled).order_by('-pk').values_list('pk', flat=True).first() or 0
+
+
+def events_after(after_id, limit=500):
+    """
+    События с id > after_id в порядке id, без пропусков. Id выдаются при
+    вставке, а видны строки после коммита, поэтому событие с меньшим id
+    может появиться позже соседнего. На первой дыре выдача
+    останавливается: курсор за неё не уходит, и событие отдадут следующим
+    опросом. Дыру, за которой строка старше LIVE_EVENTS_GAP_WAIT секунд,
+    считаем навсегда пустой (откат, пропуск в последовательности, очистка).
+    """
+    events = list(LiveEvent.objects.filter(pk__gt=after_id).order_by('pk')[:limit])
+    settled = timezone.now() - timedelta(seconds=getattr(settings, 'LIVE_EVENTS_GAP_WAIT', 5))
+    expected = after_id + 1
+    for i, event in enumerate(events):
+        if event.pk != expected and event.created_at > settled:
+            return events[:i]
+        expected = event.pk + 1
+    return events
+
+
+hub = EventHub(
+    poll_interval=getattr(settings, 'LIVE_EVENTS_POLL_INTERVAL', 1.0),
+    buffer_size=getattr(settings, 'LIVE_EVENTS_BUFFER_SIZE', 1000),
+    retention=timedelta(hours=getattr(settings, 'LIVE_EVENTS_RETENTION_HOURS', 24)),
+)
@@ -0,0 +1,330 @@
+import codecs
+import csv
+import io
+import re
+import zipfile
+from datetime import datetime
+from itertools import islice
+from xml.sax.saxutils import escape
+
+from django.conf import settings
+from django.db.models import Count, Q
+from django.http import Http404, StreamingHttpResponse
+from django.utils import timezone
+
+from api.models import Operation, TehLog
+
+# Выгрузки для отчётности. Строки читаются из БД курсором (iterator) пачками
+# по EXPORT_CHUNK_SIZE, связанные данные (исполнители, число операций)
+# догружаются одним запросом на пачку. Файл отдаётся по мере формирования,
+# поэтому память не зависит от числа строк, а прокси получает данные сразу.
+
+EXPORT_FORMATS = ('csv', 'xlsx')
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# Сколько байт копить перед отдачей очередного куска ответа
+FLUSH_SIZE = 64 * 1024
+
+
+def chunk_size():
+    return getattr(settings, 'EXPORT_CHUNK_SIZE', 2000)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+OPERATION_HEADER = (
+    "ID", "ID заказа", "Заказ", "Операция", "Описание", "Цех", "Мастер", "Исполнители",
+    "Предыдущая операция", "Статус",
+    "Плановое начало", "Плановое окончание", "Прогноз начала", "Прогноз окончания",
+    "Фактическое начало", "Фактическое окончание",
+)
+OPERATION_VALUES = (
+    'id', 'order_id', 'order__name', 'name', 'description', 'assembly_shop__name', 'master__username',
+    'previous_operation_id', 'planned_start', 'planned_end', 'predict_start', 'predict_end',
+    'actual_start', 'actual_end',
+)
+
+
+def operation_rows(queryset, size=None):
+    size = size or chunk_size()
+    through = Operation.executors.through
+    rows = queryset.values_list(*OPERATION_VALUES).iterator(chunk_size=size)
+    for chunk in _chunks(rows, size):
+        executors = {}
+        names = through.objects.filter(operation_id__in=[row[0] for row in chunk])\
+            .order_by('operation_id', 'executor_id')\
+            .values_list('operation_id', 'executor__full_name')
+        for operation_id, full_name in names:
+            executors.setdefault(operation_id, []).append(full_name)
+        for row in chunk:
+            actual_start, actual_end = row[12], row[13]
+            status = "completed" if actual_end else "in_progress" if actual_start else "planned"
+            yield row[:7] + ("; ".join(executors.get(row[0], ())), row[7], status) + row[8:]
+
+
+ORDER_HEADER = (
+    "ID", "Заказ", "Описание", "Мастер по умолчанию", "Создал", "Срок", "Создан",
+    "Операций", "Завершено операций",
+)
+ORDER_VALUES = (
+    'id', 'name', 'description', 'default_master__username', 'created_by__username', 'deadline', 'created_at',
+)
+
+
+def order_rows(queryset, size=None):
+    size = size or chunk_size()
+    rows = queryset.values_list(*ORDER_VALUES).iterator(chunk_size=size)
+    for chunk in _chunks(rows, size):
+        counts = Operation.objects.filter(order_id__in=[row[0] for row in chunk])\
+            .order_by()\
+            .values('order_id')\
+            .annotate(total=Count('id'), completed=Count('id', filter=Q(actual_end__isnull=False)))
+        counts = {item['order_id']: (item['total'], item['completed']) for item in counts}
+        for row in chunk:
+            yield row + counts.get(row[0], (0, 0))
+
+
+TEHLOG_HEADER = ("ID", "Дата", "Тип", "Информация", "Мастер", "Операция", "Заказ")
+TEHLOG_VALUES = ('id', 'logged_at', 'type', 'info', 'master__username', 'operation__name', 'operation__order__name')
+
+
+def tehlog_rows(queryset, size=None):
+    size = size or chunk_size()
+    labels = dict(TehLog.LogType.choices)
+    for row in queryset.values_list(*TEHLOG_VALUES).iterator(chunk_size=size):
+        yield row[:2] + (labels.get(row[2], row[2]),) + row[3:]
+
+
+# Вид выгрузки: заголовок, строки и порядок по умолчанию (по индексам списков)
+EXPORTS = {
+    'operations': (OPERATION_HEADER, operation_rows, ('predict_start', 'id')),
+    'orders': (ORDER_HEADER, order_rows, ('created_at', 'id')),
+    'logs': (TEHLOG_HEADER, tehlog_rows, ('-logged_at', '-id')),
+}
+
+
+def export_rows(kind, queryset, size=None):
+    """Заголовок и генератор строк выгрузки kind. Без ?ordering= - порядок списка."""
+    header, rows, ordering = EXPORTS[kind]
+    if not queryset.query.order_by:
+        queryset = queryset.order_by(*ordering)
+    return header, rows(queryset, size)
+
+
+def _text(value, tz):
+    if value is None:
+        return ''
+    if isinstance(value, datetime):
+        return timezone.localtime(value, tz).strftime('%Y-%m-%d %H:%M:%S')
+    return value
+
+
+def stream_csv(header, rows):
+    """CSV в UTF-8 с BOM (иначе Excel не узнает кодировку), кусками по FLUSH_SIZE."""
+    tz = timezone.get_current_timezone()
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    yield codecs.BOM_UTF8
+    writer.writerow(header)
+    for row in rows:
+        writer.writerow([_text(value, tz) for value in row])
+        if buffer.tell() >= FLUSH_SIZE:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode('utf-8')
+
+
+class _Sink(io.RawIOBase):
+    """Поток без seek для ZipFile: записанное забирается кусками через take()."""
+
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self.size = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        self.size += len(data)
+        return len(data)
+
+    def take(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        self.size = 0
+        return data
+
+
+# Ограничение строк на лист в Excel; строки сверх него уходят на следующий лист
+XLSX_MAX_ROWS = 1_048_576
+EXCEL_EPOCH = datetime(1899, 12, 30)
+# Управляющие символы недопустимы в XML
+XML_INVALID = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+XLSX_CONTENT_TYPES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+    '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+    '<Default Extension="xml" ContentType="application/xml"/>'
+    '<Override PartName="/xl/workbook.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+    '<Override PartName="/xl/styles.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+    '{sheets}</Types>'
+)
+XLSX_SHEET_CONTENT_TYPE = (
+    '<Override PartName="/xl/worksheets/sheet{n}.xml" '
+    'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+)
+XLSX_ROOT_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '<Relationship Id="rId1" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+    'Target="xl/workbook.xml"/></Relationships>'
+)
+XLSX_WORKBOOK = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+    'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships">'
+    '<sheets>{sheets}</sheets></workbook>'
+)
+XLSX_WORKBOOK_RELS = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+    '{sheets}<Relationship Id="rIdStyles" '
+    'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" '
+    'Target="styles.xml"/></Relationships>'
+)
+# Стиль 1 - дата и время, стиль 2 - жирный заголовок
+XLSX_STYLES = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<styleSheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main">'
+    '<numFmts count="1"><numFmt numFmtId="164" formatCode="yyyy-mm-dd hh:mm:ss"/></numFmts>'
+    '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font>'
+    '<font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+    '<fill><patternFill patternType="gray125"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="3"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/>'
+    '<xf numFmtId="0" fontId="1" fillId="0" borderId="0" xfId="0" applyFont="1"/></cellXfs>'
+    '</styleSheet>'
+)
+XLSX_SHEET_START = (
+    '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+    '<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>'
+)
+XLSX_SHEET_END = '</sheetData></worksheet>'
+
+
+def _xlsx_cell(value, tz):
+    if value is None:
+        return '<c/>'
+    if isinstance(value, bool):
+        return f'<c t="b"><v>{int(value)}</v></c>'
+    if isinstance(value, (int, float)):
+        return f'<c><v>{value}</v></c>'
+    if isinstance(value, datetime):
+        delta = timezone.localtime(value, tz).replace(tzinfo=None) - EXCEL_EPOCH
+        return f'<c s="1"><v>{delta.days + delta.seconds / 86400 + delta.microseconds / 86400e6:.10f}</v></c>'
+    text = escape(XML_INVALID.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def _xlsx_header(header):
+    cells = ''.join(
+        f'<c t="inlineStr" s="2"><is><t>{escape(title)}</t></is></c>' for title in header
+    )
+    return f'<row>{cells}</row>'
+
+
+def stream_xlsx(header, rows, title="Данные"):
+    """
+    Книга XLSX, собираемая на лету: zip пишется в поток без seek (размеры
+    записей - в дескрипторах данных), ячейки - inline-строки без общей
+    таблицы строк. Список листов известен только в конце, поэтому
+    workbook.xml записывается последним.
+    """
+    tz = timezone.get_current_timezone()
+    sink = _Sink()
+    book = zipfile.ZipFile(sink, 'w', compression=zipfile.ZIP_DEFLATED)
+    header_xml = _xlsx_header(header).encode('utf-8')
+    sheets = 0
+    rows = iter(rows)
+    row = next(rows, None)
+
+    while sheets == 0 or row is not None:
+        sheets += 1
+        with book.open(f'xl/worksheets/sheet{sheets}.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(XLSX_SHEET_START.encode('utf-8'))
+            sheet.write(header_xml)
+            written = 1
+            parts = []
+            while row is not None and written < XLSX_MAX_ROWS:
+                parts.append('<row>' + ''.join(_xlsx_cell(value, tz) for value in row) + '</row>')
+                written += 1
+                row = next(rows, None)
+                if len(parts) >= 500:
+                    sheet.write(''.join(parts).encode('utf-8'))
+                    parts = []
+                    if sink.size >= FLUSH_SIZE:
+                        yield sink.take()
+            sheet.write(''.join(parts).encode('utf-8'))
+            sheet.write(XLSX_SHEET_END.encode('utf-8'))
+        yield sink.take()
+
+    numbers = range(1, sheets + 1)
+    name = escape(title[:25])
+    book.writestr('[Content_Types].xml', XLSX_CONTENT_TYPES.format(
+        sheets=''.join(XLSX_SHEET_CONTENT_TYPE.format(n=n) for n in numbers),
+    ))
+    book.writestr('_rels/.rels', XLSX_ROOT_RELS)
+    book.writestr('xl/styles.xml', XLSX_STYLES)
+    book.writestr('xl/workbook.xml', XLSX_WORKBOOK.format(sheets=''.join(
+        f'<sheet name="{name}{f" {n}" if n > 1 else ""}" sheetId="{n}" r:id="rId{n}"/>' for n in numbers
+    )))
+    book.writestr('xl/_rels/workbook.xml.rels', XLSX_WORKBOOK_RELS.format(sheets=''.join(
+        f'<Relationship Id="rId{n}" '
+        f'Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+        f'Target="worksheets/sheet{n}.xml"/>' for n in numbers
+    )))
+    book.close()
+    yield sink.take()
+
+
+TITLES = {'operations': "Операции", 'orders': "Заказы", 'logs': "Логи"}
+
+
+def write_export(kind, file_format, queryset, size=None):
+    """Генератор байтов файла выгрузки kind в формате file_format."""
+    header, rows = export_rows(kind, queryset, size)
+    if file_format == 'xlsx':
+        return stream_xlsx(header, rows, TITLES[kind])
+    return stream_csv(header, rows)
+
+
+def export_response(kind, file_format, queryset):
+    """
+    Потоковый ответ с файлом выгрузки. X-Accel-Buffering: no - nginx отдаёт
+    куски клиенту сразу, и proxy_read_timeout считается между кусками,
+    а не на весь файл.
+    """
+    if file_format not in EXPORT_FORMATS:
+        raise Http404
+    response = StreamingHttpResponse(write_export(kind, file_format, queryset), content_type=CONTENT_TYPES[file_format])
+    filename = f"{kind}-{timezone.localtime():%Y%m%d-%H%M%S}.{file_format}"
+    response['Content-Disposition'] = f'attachment; filename="{filename}"'
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -0,0 +1,59 @@
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import F, Q
+from rest_framework import filters
+from rest_framework.exceptions import ValidationError
+
+
+class TehLogSearchFilter(filters.SearchFilter):
+    """
+    Поиск логов по предрассчитанному TehLog.search_text вместо icontains
+    по шести полям через JOIN-ы.
+
+    PostgreSQL: полнотекстовый поиск (russian) по search_vector с ранжированием
+    (аннотация search_rank) плюс поиск по части слова через LIKE, который
+    обслуживается триграммным GIN-индексом. Остальные СУБД: только LIKE.
+    """
+
+    def filter_queryset(self, request, queryset, view):
+        terms = [term.lower() for term in self.get_search_terms(request)]
+        if not terms:
+            return queryset
+
+        partial = Q()
+        for term in terms:
+            partial &= Q(search_text__contains=term)
+
+        if connection.vendor != 'postgresql':
+            return queryset.filter(partial)
+
+        query = SearchQuery(" ".join(terms), config='russian')
+        return queryset\
+            .filter(Q(search_vector=query) | partial)\
+            .annotate(search_rank=SearchRank(F('search_vector'), query))
+
+
+class KeysetOrderingFilter(filters.OrderingFilter):
+    """
+    ?ordering= для списков с курсорной пагинацией. Курсор запоминает значение
+    первого поля сортировки, поэтому допустимы только собственные столбцы
+    модели из ordering_fields представления, поля связанных моделей и прочее
+    - 400. Сортировка дополняется id в том же направлении, чтобы порядок
+    строк был однозначным.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        params = request.query_params.get(self.ordering_param)
+        if not params:
+            return self.get_default_ordering(view)
+
+        fields = [param.strip() for param in params.split(',') if param.strip()]
+        allowed = view.ordering_fields
+        invalid = [field for field in fields if field.lstrip('-') not in allowed]
+        if invalid:
+            raise ValidationError({
+                self.ordering_param: f"Недопустимая сортировка {invalid}, доступны: {list(allowed)}",
+            })
+        if 'id' not in [field.lstrip('-') for field in fields]:
+            fields.append('-id' if fields[-1].startswith('-') else 'id')
+        return fields
@@ -0,0 +1,163 @@
+import threading
+from collections import OrderedDict, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+
+from api.utils import sort_operations_chain
+
+# Поля операции, от которых зависит структура графа и порядок цепочки
+GRAPH_FIELDS = frozenset({
+    'order', 'order_id', 'previous_operation', 'previous_operation_id', 'planned_start',
+})
+
+
+class OperationGraph:
+    """
+    Граф зависимостей операций одного заказа.
+    chain - упорядоченная цепочка (как в sort_operations_chain), она же
+    топологический порядок; children - дети каждой операции по planned_start.
+    """
+    __slots__ = ('order_id', 'version', 'parent', 'children', 'chain')
+
+    def __init__(self, order_id, version, operations):
+        self.order_id = order_id
+        self.version = version
+
+        ordered = sort_operations_chain(operations)
+        self.chain = tuple(op.id for op in ordered)
+        self.parent = {op.id: op.previous_operation_id for op in ordered}
+
+        children = defaultdict(list)
+        # Дети попадают в список в порядке цепочки, т.е. уже отсортированными
+        for op in ordered:
+            if op.previous_operation_id in self.parent:
+                children[op.previous_operation_id].append(op.id)
+        self.children = {op_id: tuple(ids) for op_id, ids in children.items()}
+
+    def descendants(self, op_ids):
+        """Все потомки переданных операций в топологическом порядке (без них самих)."""
+        result = []
+        seen = set(op_ids)
+        stack = [op_id for op_id in op_ids if op_id in self.parent]
+        pos = 0
+        while pos < len(stack):
+            for child in self.children.get(stack[pos], ()):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+                    result.append(child)
+            pos += 1
+        return result
+
+    def order_operations(self, operations):
+        """Упорядочивает переданные операции заказа по цепочке графа."""
+        by_id = {op.id: op for op in operations}
+        if by_id.keys() != self.parent.keys():
+            return sort_operations_chain(operations)
+        return [by_id[op_id] for op_id in self.chain]
+
+
+class OperationGraphIndex:
+    """Кэш графов заказов внутри процесса с вытеснением по LRU."""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._graphs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, order_id, version):
+        with self._lock:
+            graph = self._graphs.get(order_id)
+            if graph is None or graph.version != version:
+                return None
+            self._graphs.move_to_end(order_id)
+            return graph
+
+    def put(self, graph):
+        with self._lock:
+            self._graphs[graph.order_id] = graph
+            self._graphs.move_to_end(graph.order_id)
+            while len(self._graphs) > self.max_size:
+                self._graphs.popitem(last=False)
+
+    def invalidate(self, order_id):
+        with self._lock:
+            self._graphs.pop(order_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._graphs.clear()
+
+
+graph_index = OperationGraphIndex(getattr(settings, 'OPERATION_GRAPH_CACHE_SIZE', 512))
+
+
+def get_operation_graph(order_id, version, operations=None):
+    """
+    Возвращает граф заказа для указанной версии.
+    При промахе граф строится из operations, если они переданы (все операции
+    заказа), иначе загружается из базы одним запросом.
+    """
+    graph = graph_index.get(order_id, version)
+    if graph is not None:
+        return graph
+
+    if operations is None:
+        from api.models import Operation
+        operations = Operation.objects.filter(order_id=order_id).order_by()\
+            .only('id', 'previous_operation_id', 'planned_start')
+
+    graph = OperationGraph(order_id, version, operations)
+    graph_index.put(graph)
+    return graph
+
+
+def get_operation_graphs(order_ids):
+    """Графы нескольких заказов; версии читаются одним запросом."""
+    from api.models import Order
+
+    versions = Order.objects.filter(pk__in=order_ids).values_list('pk', 'graph_version')
+    return {pk: get_operation_graph(pk, version) for pk, version in versions}
+
+
+# Заказы, чьи графы сбрасываются на выходе из deferred_graph_bumps()
+_deferred_bumps = ContextVar('deferred_graph_bumps', default=None)
+
+
+@contextmanager
+def deferred_graph_bumps():
+    """
+    Сбросы графов внутри блока копятся и выполняются одним UPDATE на выходе.
+    Нужен для queryset.delete(): post_delete приходит на каждую операцию.
+    При исключении транзакция всё равно откатывается - сброс не нужен.
+    """
+    pending = set()
+    token = _deferred_bumps.set(pending)
+    try:
+        yield
+    finally:
+        _deferred_bumps.reset(token)
+    bump_graph_version(pending)
+
+
+def bump_graph_version(order_ids):
+    """
+    Помечает графы заказов устаревшими во всех процессах.
+    Вызывать после изменений структуры в обход Operation.save()/delete().
+    Заодно сдвигает Order.updated_at: от него зависят ETag заказа (api.conditional).
+    """
+    from django.utils import timezone
+    from api.models import Order, new_graph_version
+
+    order_ids = {pk for pk in order_ids if pk}
+    pending = _deferred_bumps.get()
+    if pending is not None:
+        pending.update(order_ids)
+        return
+    if not order_ids:
+        return
+    for order_id in order_ids:
+        graph_index.invalidate(order_id)
+    Order.objects.filter(pk__in=order_ids).update(graph_version=new_graph_version(), updated_at=timezone.now())
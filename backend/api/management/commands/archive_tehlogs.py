@@ -0,0 +1,92 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from api.archive import ARCHIVE_VALUES, archive_dir, write_archive
+from api.models import TehLog
+from api.partitions import (
+    drop_partition, ensure_tehlog_partitions, month_start, next_month, tehlog_partitions,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Выгружает логи старше срока хранения в сжатые архивы JSONL и удаляет их "
+        "из TehLog. На PostgreSQL месячные секции удаляются целиком."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--retention-days', type=int, default=getattr(settings, 'TEHLOG_RETENTION_DAYS', 180),
+            help="Сколько дней логи хранятся в таблице (граница округляется до начала месяца)",
+        )
+        parser.add_argument('--dir', default=None, help="Каталог архивов, по умолчанию TEHLOG_ARCHIVE_DIR")
+        parser.add_argument('--chunk-size', type=int, default=2000, help="Строк за одно чтение курсора")
+        parser.add_argument('--dry-run', action='store_true', help="Только показать, что будет выгружено")
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        self.directory = options['dir'] or archive_dir()
+        self.chunk_size = max(options['chunk_size'], 1)
+        self.dry_run = options['dry_run']
+        # В таблице остаются целые месяцы: всё раньше начала месяца границы уходит в архив
+        cutoff = month_start(now - timedelta(days=options['retention_days']))
+
+        if not self.dry_run:
+            for name in ensure_tehlog_partitions(now):
+                self.stdout.write(f"Создана секция {name}")
+
+        total = 0
+        archived = set()
+        for name, start, end in tehlog_partitions():
+            if end > cutoff:
+                continue
+            total += self.archive_range(start, end, partition=name)
+            archived.add(start)
+
+        # Без секционирования (SQLite) и для строк из секции по умолчанию - помесячно с удалением
+        oldest = TehLog.objects.filter(logged_at__lt=cutoff).order_by('logged_at').values_list('logged_at', flat=True).first()
+        start = month_start(oldest) if oldest else cutoff
+        while start < cutoff:
+            end = min(next_month(start), cutoff)
+            # При --dry-run строки месячных секций ещё в таблице и уже посчитаны
+            if start not in archived:
+                total += self.archive_range(start, end)
+            start = end
+
+        verb = "Будет выгружено" if self.dry_run else "Выгружено в архив"
+        self.stdout.write(self.style.SUCCESS(f"{verb} логов: {total}"))
+
+    def archive_range(self, start, end, partition=None):
+        rows = TehLog.objects.filter(logged_at__gte=start, logged_at__lt=end)
+        if self.dry_run:
+            count = rows.count()
+            if count:
+                self.stdout.write(f"{start:%Y-%m}: {count} {partition or ''}".rstrip())
+            return count
+
+        if partition is None:
+            # Удаляется ровно выгруженное: строки, вставленные после чтения, останутся до следующего запуска
+            rows = rows.filter(pk__lte=rows.aggregate(last=Max('pk'))['last'] or 0)
+        with transaction.atomic():
+            path, count = write_archive(
+                rows.order_by('logged_at', 'id').values_list(*ARCHIVE_VALUES).iterator(chunk_size=self.chunk_size),
+                start, end, self.directory,
+            )
+            try:
+                if partition is not None:
+                    drop_partition(partition)
+                elif count:
+                    rows.delete()
+            except Exception:
+                # Строки остались в таблице - архив с ними не должен появиться дважды
+                if path is not None:
+                    path.unlink()
+                raise
+        if path is not None:
+            self.stdout.write(f"{path.name}: {count}")
+        return count
@@ -0,0 +1,53 @@
+import random
+import time
+from datetime import timedelta
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api.schedule import critical_path
+from api.utils import sort_operations_chain
+
+
+class Command(BaseCommand):
+    help = (
+        "Замер алгоритмов планирования на синтетических данных в памяти "
+        "(база не нужна): сортировка цепочек операций и критический путь заказа."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=100000, help="Сколько операций")
+        parser.add_argument('--chain', type=int, default=50, help="Длина одной цепочки")
+        parser.add_argument('--repeat', type=int, default=3, help="Повторов замера, берётся лучший")
+
+    def handle(self, *args, **options):
+        self.repeat = max(options['repeat'], 1)
+        total, chain = options['operations'], max(options['chain'], 1)
+        base = timezone.now()
+        ops = [
+            SimpleNamespace(
+                id=i, previous_operation_id=(i - 1 if i % chain else None),
+                planned_start=base + timedelta(hours=i),
+            )
+            for i in range(1, total + 1)
+        ]
+        random.shuffle(ops)
+        self.report(f"sort_operations_chain ({total})", lambda: sort_operations_chain(ops))
+
+        # Строки CPM_FIELDS: id, родитель, плановые даты, факты
+        rows = [
+            (op.id, op.previous_operation_id, op.planned_start, op.planned_start + timedelta(hours=1), None, None)
+            for op in ops
+        ]
+        deadline = base + timedelta(hours=total + 1)
+        self.report(f"critical_path ({total})", lambda: critical_path(rows, deadline, base))
+
+    def report(self, label, run):
+        best = None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            run()
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        self.stdout.write(f"{label}: {best:.3f} c")
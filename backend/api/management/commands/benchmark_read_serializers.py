@@ -0,0 +1,117 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Prefetch
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+
+from api.models import AssemblyShop, CustomUser, Executor, Operation, Order
+from api.serializers import OperationSerializer, OperationReadSerializer, OrderSerializer, OrderReadSerializer
+from api.views.order_views import orders_with_operations
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Сравнивает OperationSerializer/OrderSerializer с быстрым путём чтения "
+        "на синтетических данных. Данные создаются в транзакции и откатываются."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--operations', type=int, default=10000, help="Сколько операций создать")
+        parser.add_argument('--per-order', type=int, default=50, help="Операций в одном заказе")
+        parser.add_argument('--repeat', type=int, default=3, help="Повторов замера, берётся лучший")
+
+    def handle(self, *args, **options):
+        self.repeat = max(options['repeat'], 1)
+        try:
+            with transaction.atomic():
+                self.seed(options['operations'], max(options['per_order'], 1))
+                self.run()
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, total, per_order):
+        user = CustomUser.objects.create(username=f'benchmark-{time.time_ns()}', role='master')
+        shops = AssemblyShop.objects.bulk_create([AssemblyShop(name=f"Цех {i}") for i in range(5)])
+        executors = Executor.objects.bulk_create([Executor(full_name=f"Исполнитель {i}") for i in range(20)])
+        start = timezone.now().replace(microsecond=0)
+
+        orders = Order.objects.bulk_create([
+            Order(name=f"Заказ {i}", deadline=start + timedelta(days=60), created_by=user, default_master=user)
+            for i in range((total + per_order - 1) // per_order)
+        ])
+        operations = []
+        for i in range(total):
+            op_start = start + timedelta(hours=2 * (i % per_order))
+            operations.append(Operation(
+                order=orders[i // per_order],
+                name=f"Операция {i}",
+                assembly_shop=shops[i % len(shops)] if i % 3 else None,
+                master=user if i % 2 else None,
+                planned_start=op_start,
+                planned_end=op_start + timedelta(hours=2),
+                predict_start=op_start,
+                predict_end=op_start + timedelta(hours=2),
+                actual_start=op_start if i % 4 == 0 else None,
+            ))
+        operations = Operation.objects.bulk_create(operations, batch_size=1000)
+        # Цепочки внутри заказов
+        for i, op in enumerate(operations):
+            if i % per_order:
+                op.previous_operation_id = operations[i - 1].pk
+        Operation.objects.bulk_update(operations, ['previous_operation'], batch_size=1000)
+
+        through = Operation.executors.through
+        through.objects.bulk_create([
+            through(operation_id=op.pk, executor_id=executors[(i + k) % len(executors)].pk)
+            for i, op in enumerate(operations) for k in range(2)
+        ], batch_size=1000)
+        self.operation_ids = [op.pk for op in operations]
+        self.order_ids = [order.pk for order in orders]
+
+    def measure(self, build):
+        best, content = None, None
+        for _ in range(self.repeat):
+            started = time.perf_counter()
+            content = JSONRenderer().render(build())
+            elapsed = time.perf_counter() - started
+            best = elapsed if best is None else min(best, elapsed)
+        return best, content
+
+    def compare(self, label, slow, fast):
+        slow_time, slow_content = self.measure(slow)
+        fast_time, fast_content = self.measure(fast)
+        if slow_content != fast_content:
+            raise CommandError(f"{label}: вывод быстрого пути отличается от сериализатора")
+        self.stdout.write(
+            f"{label}: сериализатор {slow_time:.3f} c, быстрый путь {fast_time:.3f} c, "
+            f"ускорение x{slow_time / fast_time:.1f}, {len(fast_content)} байт"
+        )
+
+    def run(self):
+        operations = Operation.objects.filter(pk__in=self.operation_ids).order_by('predict_start', 'id')
+        reader = OperationReadSerializer()
+        self.compare(
+            f"Операции ({len(self.operation_ids)})",
+            lambda: OperationSerializer(
+                operations.select_related('assembly_shop', 'master')
+                .prefetch_related(Prefetch('executors', queryset=Executor.objects.order_by('id'))),
+                many=True,
+            ).data,
+            lambda: reader.serialize(reader.values_queryset(operations)),
+        )
+
+        orders = Order.objects.filter(pk__in=self.order_ids).order_by('created_at', 'id')
+        order_reader = OrderReadSerializer()
+        self.compare(
+            f"Заказы ({len(self.order_ids)})",
+            lambda: OrderSerializer(orders_with_operations().filter(pk__in=self.order_ids).order_by('created_at', 'id'), many=True).data,
+            lambda: order_reader.serialize(order_reader.values_queryset(orders)),
+        )
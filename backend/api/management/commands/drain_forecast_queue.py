@@ -0,0 +1,68 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.reforecast import drain_forecast_queue
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = "Фоновый пересчёт прогнозов потомков изменённых операций (очередь ForecastQueue)"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Разобрать очередь до конца и завершиться",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'FORECAST_QUEUE_BATCH_SIZE', 500),
+            help="Записей очереди за один пересчёт",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=getattr(settings, 'FORECAST_QUEUE_INTERVAL', 0.5),
+            help="Пауза между опросами пустой очереди, секунд",
+        )
+        parser.add_argument(
+            '--overdue-interval', type=float, default=getattr(settings, 'FORECAST_OVERDUE_INTERVAL', 3600.0),
+            help="Как часто сдвигать просроченные неначатые корни (update_predict_operations), секунд; 0 - никогда",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        totals = [0, 0, 0]
+        overdue_at = None
+        while True:
+            if not options['once'] and options['overdue_interval'] > 0 and (
+                overdue_at is None or time.monotonic() - overdue_at > options['overdue_interval']
+            ):
+                overdue_at = time.monotonic()
+                try:
+                    call_command('update_predict_operations', stdout=self.stdout, stderr=self.stderr)
+                except Exception:
+                    logger.exception("Overdue roots update failed")
+                    close_old_connections()
+            try:
+                result = drain_forecast_queue(batch_size)
+            except Exception:
+                if options['once']:
+                    raise
+                # Записи останутся в очереди до следующей попытки
+                logger.exception("Forecast queue drain failed")
+                close_old_connections()
+                result = (0, 0, 0)
+            totals = [total + value for total, value in zip(totals, result)]
+            if result[0] == batch_size:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        entries, roots, changed = totals
+        self.stdout.write(self.style.SUCCESS(
+            f"Записей очереди: {entries}, корней: {roots}, прогнозов изменено: {changed}"
+        ))
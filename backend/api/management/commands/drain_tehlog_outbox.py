@@ -0,0 +1,65 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from api.outbox import drain_outbox
+from api.partitions import ensure_tehlog_partitions
+
+logger = logging.getLogger(__name__)
+
+# Как часто воркер проверяет, что секции TehLog на ближайшие месяцы созданы
+PARTITIONS_CHECK_INTERVAL = 3600
+
+
+class Command(BaseCommand):
+    help = "Фоновый перенос очереди логов мастера (TehLogOutbox) в TehLog пачками"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--once', action='store_true',
+            help="Разобрать очередь до конца и завершиться",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=getattr(settings, 'TEHLOG_OUTBOX_BATCH_SIZE', 500),
+            help="Размер пачки bulk_create",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=getattr(settings, 'TEHLOG_OUTBOX_INTERVAL', 1.0),
+            help="Пауза между опросами пустой очереди, секунд",
+        )
+
+    def handle(self, *args, **options):
+        batch_size = max(options['batch_size'], 1)
+        total = 0
+        partitions_checked = None
+        while True:
+            if not options['once'] and (
+                partitions_checked is None or time.monotonic() - partitions_checked > PARTITIONS_CHECK_INTERVAL
+            ):
+                partitions_checked = time.monotonic()
+                try:
+                    ensure_tehlog_partitions(timezone.now())
+                except Exception:
+                    logger.exception("TehLog partitions check failed")
+                    close_old_connections()
+            try:
+                drained = drain_outbox(batch_size)
+            except Exception:
+                if options['once']:
+                    raise
+                # Ошибка БД не останавливает воркер: записи останутся в очереди до следующей попытки
+                logger.exception("TehLog outbox drain failed")
+                close_old_connections()
+                drained = 0
+            total += drained
+            if drained == batch_size:
+                continue
+            if options['once']:
+                break
+            time.sleep(options['interval'])
+
+        self.stdout.write(self.style.SUCCESS(f"Логов перенесено из очереди: {total}"))
@@ -0,0 +1,45 @@
+import sys
+
+from django.core.management.base import BaseCommand
+
+from api.export import EXPORT_FORMATS, EXPORTS, write_export
+from api.models import Operation, Order, TehLog
+from api.replicas import read_from_replica
+
+QUERYSETS = {
+    'operations': Operation.objects.all,
+    'orders': Order.objects.all,
+    'logs': TehLog.objects.all,
+}
+
+
+class Command(BaseCommand):
+    help = "Выгрузка операций, заказов или логов в CSV/XLSX потоком, без загрузки всех строк в память"
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS), help="Что выгружать")
+        parser.add_argument('--format', dest='file_format', choices=EXPORT_FORMATS, default='csv')
+        parser.add_argument('--output', '-o', default='-', help="Файл; по умолчанию stdout")
+        parser.add_argument('--chunk-size', type=int, default=None, help="Строк за одно чтение курсора")
+
+    def handle(self, *args, **options):
+        # Выгрузка - отчётное чтение, при настроенных репликах идёт с них
+        with read_from_replica():
+            self._export(options)
+
+    def _export(self, options):
+        chunks = write_export(
+            options['kind'], options['file_format'], QUERYSETS[options['kind']](), options['chunk_size'],
+        )
+        if options['output'] == '-':
+            out = sys.stdout.buffer
+            for chunk in chunks:
+                out.write(chunk)
+            out.flush()
+            return
+        size = 0
+        with open(options['output'], 'wb') as out:
+            for chunk in chunks:
+                out.write(chunk)
+                size += len(chunk)
+        self.stderr.write(f"{options['output']}: {size} байт")
@@ -0,0 +1,72 @@
+import logging
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from api.events import Kind, latest_event_id
+from api.models import LiveEvent
+from api.schedule import run_capacity_forecast
+
+logger = logging.getLogger(__name__)
+
+# События, после которых загрузка цехов и исполнителей меняется
+TRIGGER_KINDS = (Kind.OPERATION_STARTED, Kind.OPERATION_ENDED)
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогноз predict_start/predict_end всех незавершённых операций с учётом "
+        "занятости исполнителей и цехов (api.schedule.capacity_forecast)"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Посчитать, но не записывать")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Размер пачки чтения и bulk_update")
+        parser.add_argument(
+            '--follow', action='store_true',
+            help="Работать постоянно: пересчитывать после стартов/завершений операций",
+        )
+        parser.add_argument(
+            '--interval', type=float, default=getattr(settings, 'CAPACITY_FORECAST_INTERVAL', 2.0),
+            help="Пауза между проверками новых событий, секунд",
+        )
+        parser.add_argument(
+            '--max-age', type=float, default=getattr(settings, 'CAPACITY_FORECAST_MAX_AGE', 300.0),
+            help="Полный пересчёт не реже, чем раз в столько секунд, даже без событий",
+        )
+
+    def handle(self, *args, **options):
+        self.options = options
+        if not options['follow']:
+            self.run()
+            return
+
+        last_event = latest_event_id()
+        self.run()
+        last_run = time.monotonic()
+        while True:
+            time.sleep(options['interval'])
+            try:
+                # Все события с прошлого пересчёта обрабатываются одним пересчётом
+                newest = LiveEvent.objects.filter(pk__gt=last_event, kind__in=TRIGGER_KINDS)\
+                    .order_by('-pk').values_list('pk', flat=True).first()
+                if newest is None and time.monotonic() - last_run < options['max_age']:
+                    continue
+                last_event = newest or last_event
+                self.run()
+                last_run = time.monotonic()
+            except Exception:
+                logger.exception("Capacity forecast failed")
+                close_old_connections()
+
+    def run(self):
+        started = time.monotonic()
+        total, changed = run_capacity_forecast(
+            dry_run=self.options['dry_run'], batch_size=max(self.options['batch_size'], 1),
+        )
+        prefix = "[dry-run] " if self.options['dry_run'] else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Операций: {total}, прогнозов изменено: {changed}, время: {time.monotonic() - started:.2f} c"
+        ))
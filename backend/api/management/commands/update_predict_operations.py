@@ -1,25 +1,111 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.db import connection, transaction
 from django.utils import timezone
-from datetime import datetime
+from api.events import publish_forecast
 from api.models import Operation
-from api.utils import recalculate_predict_chain
+from api.utils import overdue_root_orders, roll_forward_predictions, ROLL_FORWARD_FIELDS, PREDICT_FIELDS
 
 
 class Command(BaseCommand):
     help = "Ежедневное обновление predict_start/predict_end операций"
 
-    def handle(self, *args, **kwargs):
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run', action='store_true',
+            help="Посчитать изменения, но не записывать их в базу",
+        )
+        parser.add_argument(
+            '--workers', type=int, default=1,
+            help="Количество потоков, обрабатывающих пачки заказов параллельно",
+        )
+        parser.add_argument(
+            '--chunk-size', type=int, default=200,
+            help="Количество заказов в одной пачке",
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help="Размер пачки для bulk_update",
+        )
+
+    def handle(self, *args, **options):
+        # Прогноз с учётом загрузки сам сдвигает просроченные операции на текущий момент
+        if getattr(settings, 'FORECAST_ENGINE', 'chain') == 'capacity':
+            call_command(
+                'forecast_capacity', dry_run=options['dry_run'], batch_size=options['batch_size'],
+                stdout=self.stdout, stderr=self.stderr,
+            )
+            return
+
+        started = time.monotonic()
+        tz = timezone.get_current_timezone()
         today = timezone.localdate()  # только дата, без времени
-        # Все операции без previous_operation, не начавшиеся (actual_start = None)
-        root_operations = Operation.objects.filter(previous_operation__isnull=True, actual_start__isnull=True)
-        
-        for op in root_operations:
-            if op.predict_start and op.predict_start.date() < today:
-                # Сдвигаем predict_start на сегодня
-                op.predict_start = timezone.make_aware(
-                    datetime.combine(today, op.predict_start.time())
+        day_start = timezone.make_aware(datetime.combine(today, datetime.min.time()))
+
+        # Заказы, в которых есть неначатые корневые операции с прогнозом в прошлом
+        order_ids = list(overdue_root_orders(day_start))
+        chunk_size = max(options['chunk_size'], 1)
+        chunks = [order_ids[i:i + chunk_size] for i in range(0, len(order_ids), chunk_size)]
+
+        self.dry_run = options['dry_run']
+        self.batch_size = options['batch_size']
+        self.today = today
+        self.tz = tz
+
+        workers = max(options['workers'], 1)
+        if workers > 1 and len(chunks) > 1:
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                results = list(pool.map(self._process_chunk_in_thread, chunks))
+        else:
+            results = [self._process_chunk(chunk) for chunk in chunks]
+
+        scanned = sum(r[0] for r in results)
+        shifted = sum(r[1] for r in results)
+        updated = sum(r[2] for r in results)
+        elapsed = time.monotonic() - started
+
+        prefix = "[dry-run] " if self.dry_run else ""
+        self.stdout.write(self.style.SUCCESS(
+            f"{prefix}Заказов: {len(order_ids)}, пачек: {len(chunks)}, "
+            f"операций просмотрено: {scanned}, корней сдвинуто: {shifted}, "
+            f"операций обновлено: {updated}, время: {elapsed:.2f} c"
+        ))
+
+    def _process_chunk_in_thread(self, order_ids):
+        # Каждый поток работает со своим соединением и закрывает его сам
+        try:
+            return self._process_chunk(order_ids)
+        finally:
+            connection.close()
+
+    def _process_chunk(self, order_ids):
+        rows = list(
+            Operation.objects
+            .filter(order_id__in=order_ids)
+            .order_by()
+            .values_list(*ROLL_FORWARD_FIELDS)
+            .iterator(chunk_size=self.batch_size)
+        )
+        shifted, changes = roll_forward_predictions(rows, self.today, self.tz)
+
+        if changes and not self.dry_run:
+            now = timezone.now()
+            order_of = {row[0]: row[7] for row in rows}
+            objs = [
+                Operation(
+                    id=op_id, order_id=order_of[op_id],
+                    predict_start=predict_start, predict_end=predict_end, updated_at=now,
                 )
-                op.predict_end = op.predict_start + op.duration
-                op.save(update_fields=['predict_start', 'predict_end'])
-                # Обновляем всех потомков рекурсивно
-                recalculate_predict_chain(op)
\ No newline at end of file
+                for op_id, predict_start, predict_end in changes
+            ]
+            with transaction.atomic():
+                Operation.objects.bulk_update(objs, PREDICT_FIELDS + ['updated_at'], batch_size=self.batch_size)
+                # bulk_update не шлёт сигналов - подписчики узнают о новых прогнозах отсюда
+                publish_forecast(objs)
+
+        return len(rows), shifted, len(changes)
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:56
+
+import api.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0006_alter_operation_executors'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='graph_version',
+            field=models.BigIntegerField(default=api.models.new_graph_version, editable=False, verbose_name='Версия графа операций'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 5.2.6 on 2026-10-18 14:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0007_order_graph_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['predict_start', 'id'], name='operation_predict_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['order', 'predict_start'], name='operation_order_predict_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(condition=models.Q(('actual_end__isnull', True)), fields=['order'], name='operation_open_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(condition=models.Q(('actual_start__isnull', True), ('previous_operation__isnull', True)), fields=['predict_start', 'order'], name='operation_unstarted_root_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tehlog',
+            index=models.Index(fields=['-logged_at', '-id'], name='tehlog_logged_idx'),
+        ),
+    ]
@@ -0,0 +1,76 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:00
+
+import django.contrib.postgres.search
+from django.db import migrations, models
+
+
+POSTGRES_FORWARD = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    """
+    CREATE TRIGGER tehlog_search_vector_update
+    BEFORE INSERT OR UPDATE OF search_text ON api_tehlog
+    FOR EACH ROW EXECUTE FUNCTION
+    tsvector_update_trigger(search_vector, 'pg_catalog.russian', search_text)
+    """,
+    "CREATE INDEX tehlog_search_vector_idx ON api_tehlog USING gin (search_vector)",
+    "CREATE INDEX tehlog_search_trgm_idx ON api_tehlog USING gin (search_text gin_trgm_ops)",
+]
+
+POSTGRES_BACKWARD = [
+    "DROP INDEX IF EXISTS tehlog_search_trgm_idx",
+    "DROP INDEX IF EXISTS tehlog_search_vector_idx",
+    "DROP TRIGGER IF EXISTS tehlog_search_vector_update ON api_tehlog",
+]
+
+
+def postgres_forward(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRES_FORWARD:
+            schema_editor.execute(sql)
+
+
+def postgres_backward(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        for sql in POSTGRES_BACKWARD:
+            schema_editor.execute(sql)
+
+
+def fill_search_text(apps, schema_editor):
+    TehLog = apps.get_model('api', 'TehLog')
+    logs = TehLog.objects.select_related('master', 'operation__order').order_by('pk')
+    batch = []
+    for log in logs.iterator(chunk_size=2000):
+        parts = [
+            log.info,
+            log.master.username, log.master.first_name, log.master.last_name,
+            log.operation.name, log.operation.order.name,
+        ]
+        log.search_text = " ".join(part for part in parts if part).lower()
+        batch.append(log)
+        if len(batch) >= 2000:
+            TehLog.objects.bulk_update(batch, ['search_text'])
+            batch = []
+    if batch:
+        TehLog.objects.bulk_update(batch, ['search_text'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0008_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tehlog',
+            name='search_text',
+            field=models.TextField(blank=True, default='', editable=False, verbose_name='Поисковый текст'),
+        ),
+        migrations.AddField(
+            model_name='tehlog',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunPython(postgres_forward, postgres_backward),
+        migrations.RunPython(fill_search_text, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:03
+
+import django.core.serializers.json
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0009_tehlog_search'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LiveEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')),
+                ('kind', models.CharField(choices=[('operation.started', 'Operation Started'), ('operation.ended', 'Operation Ended'), ('operation.forecast', 'Operation Forecast'), ('log.created', 'Log Created')], max_length=32, verbose_name='Тип события')),
+                ('order_id', models.BigIntegerField(blank=True, null=True, verbose_name='Заказ')),
+                ('payload', models.JSONField(encoder=django.core.serializers.json.DjangoJSONEncoder, verbose_name='Данные')),
+            ],
+            options={
+                'verbose_name': 'Событие',
+                'verbose_name_plural': 'События',
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:20
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0010_liveevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='operation',
+            name='updated_at',
+            field=models.DateTimeField(auto_now=True, default=django.utils.timezone.now, verbose_name='Дата обновления'),
+            preserve_default=False,
+        ),
+        migrations.AddIndex(
+            model_name='operation',
+            index=models.Index(fields=['updated_at'], name='operation_updated_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['updated_at'], name='order_updated_idx'),
+        ),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:19
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0011_operation_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tehlog',
+            name='outbox_key',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=64, null=True),
+        ),
+        migrations.CreateModel(
+            name='TehLogOutbox',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('kind', models.CharField(choices=[('start', 'Start'), ('end', 'End')], max_length=8, verbose_name='Событие')),
+                ('actual_at', models.DateTimeField(verbose_name='Фактическое время')),
+                ('planned_at', models.DateTimeField(verbose_name='Плановое время')),
+                ('master', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Мастер')),
+                ('operation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.operation', verbose_name='Операция')),
+            ],
+            options={
+                'verbose_name': 'Лог в очереди',
+                'verbose_name_plural': 'Очередь логов',
+            },
+        ),
+    ]
@@ -0,0 +1,85 @@
+from django.db import migrations
+from django.utils import timezone
+
+
+def partition_tehlog(apps, schema_editor):
+    """
+    PostgreSQL: api_tehlog становится секционированной по месяцам logged_at.
+    Первичный ключ секционированной таблицы обязан включать ключ секции,
+    поэтому он (id, logged_at). Identity-столбец у секционированной таблицы
+    не наследуется секциями (в PostgreSQL до 17), поэтому id выдаёт обычная
+    последовательность api_tehlog_id_seq через DEFAULT nextval(): секции
+    получают этот DEFAULT вместе с остальными.
+    Индексы, внешние ключи и поисковый триггер пересоздаются с прежними именами.
+    """
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    from api.partitions import TEHLOG_DEFAULT_PARTITION, create_partition, month_start, next_month
+
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT indexdef FROM pg_indexes WHERE tablename = 'api_tehlog' AND indexname <> 'api_tehlog_pkey'"
+        )
+        indexes = [row[0] for row in cursor.fetchall()]
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = 'api_tehlog'::regclass AND contype = 'f'"
+        )
+        foreign_keys = cursor.fetchall()
+        cursor.execute("SELECT min(logged_at) FROM api_tehlog")
+        oldest = cursor.fetchone()[0]
+        cursor.execute("SELECT pg_get_serial_sequence('api_tehlog', 'id')")
+        old_sequence = cursor.fetchone()[0]
+
+        cursor.execute("ALTER TABLE api_tehlog RENAME TO api_tehlog_plain")
+        # Старая последовательность (identity или serial) уходит вместе со
+        # старой таблицей, её имя освобождается для новой
+        cursor.execute("ALTER TABLE api_tehlog_plain ALTER COLUMN id DROP IDENTITY IF EXISTS")
+        cursor.execute("ALTER TABLE api_tehlog_plain ALTER COLUMN id DROP DEFAULT")
+        if old_sequence:
+            cursor.execute(f"DROP SEQUENCE IF EXISTS {old_sequence}")
+        cursor.execute(
+            "CREATE TABLE api_tehlog (LIKE api_tehlog_plain INCLUDING DEFAULTS) "
+            "PARTITION BY RANGE (logged_at)"
+        )
+        cursor.execute("CREATE SEQUENCE api_tehlog_id_seq")
+        cursor.execute("ALTER TABLE api_tehlog ALTER COLUMN id SET DEFAULT nextval('api_tehlog_id_seq')")
+        cursor.execute("ALTER SEQUENCE api_tehlog_id_seq OWNED BY api_tehlog.id")
+        cursor.execute(f"CREATE TABLE {TEHLOG_DEFAULT_PARTITION} PARTITION OF api_tehlog DEFAULT")
+
+        now = timezone.now()
+        start = month_start(oldest or now)
+        last = next_month(next_month(month_start(now)))
+        while start <= last:
+            create_partition(cursor, start)
+            start = next_month(start)
+
+        cursor.execute("INSERT INTO api_tehlog SELECT * FROM api_tehlog_plain")
+        cursor.execute("DROP TABLE api_tehlog_plain")
+
+        cursor.execute("ALTER TABLE api_tehlog ADD CONSTRAINT api_tehlog_pkey PRIMARY KEY (id, logged_at)")
+        for name, definition in foreign_keys:
+            cursor.execute(f"ALTER TABLE api_tehlog ADD CONSTRAINT {name} {definition}")
+        # Определения сняты до переименования и ссылаются на api_tehlog
+        for definition in indexes:
+            cursor.execute(definition)
+        cursor.execute(
+            "CREATE TRIGGER tehlog_search_vector_update "
+            "BEFORE INSERT OR UPDATE OF search_text ON api_tehlog "
+            "FOR EACH ROW EXECUTE FUNCTION "
+            "tsvector_update_trigger(search_vector, 'pg_catalog.russian', search_text)"
+        )
+        cursor.execute(
+            "SELECT setval(pg_get_serial_sequence('api_tehlog', 'id'), coalesce(max(id), 0) + 1, false) FROM api_tehlog"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0012_tehlog_outbox'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_tehlog, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.6 on 2026-10-18 15:34
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0013_tehlog_partitioning'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ForecastQueue',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')),
+                ('operation', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='api.operation', verbose_name='Операция')),
+            ],
+            options={
+                'verbose_name': 'Пересчёт прогноза в очереди',
+                'verbose_name_plural': 'Очередь пересчёта прогнозов',
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.6 on 2026-10-18 16:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api', '0014_forecast_queue'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReferenceCacheCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=32, verbose_name='Справочник')),
+                ('name', models.CharField(max_length=16, verbose_name='Счётчик')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'Счётчик кэша справочников',
+                'verbose_name_plural': 'Счётчики кэша справочников',
+                'constraints': [models.UniqueConstraint(fields=('namespace', 'name'), name='reference_cache_counter_unique')],
+            },
+        ),
+    ]
@@ -1,9 +1,21 @@
 # models.py
-from django.db import models
+from django.db import models, connections, transaction
+from django.db.models.expressions import RawSQL
+from django.contrib.postgres.search import SearchVectorField
 from django.contrib.auth.models import User, AbstractUser
 from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
 from django.utils import timezone
 from datetime import timedelta
+import secrets
+
+
+CYCLE_ERROR = "Цепочка операций не может быть циклической"
+
+
+def new_graph_version():
+    # Случайная метка, а не счётчик: после отката транзакции значение не повторится
+    return secrets.randbits(62)
 
 class CustomUser(AbstractUser):
     ROLE_CHOICES = (
@@ -59,14 +71,85 @@ class Order(models.Model):
     created_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Создатель")
     created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
     updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+    # Меняется при любом изменении структуры цепочки операций заказа,
+    # по нему процессы сверяют свой кэш графа (api.graph)
+    graph_version = models.BigIntegerField(default=new_graph_version, editable=False, verbose_name="Версия графа операций")
     
     def __str__(self):
         return f"{self.name}"
+
+    def save(self, *args, **kwargs):
+        # graph_version меняет только bump_graph_version через .update(): полное
+        # сохранение экземпляра, прочитанного до чужого сброса (view, админка),
+        # вернуло бы старую метку, и кэш графа остался бы устаревшим
+        if not self._state.adding and not kwargs.get('force_insert') and kwargs.get('update_fields') is None:
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key and field.name != 'graph_version'
+            ]
+        super().save(*args, **kwargs)
     
     class Meta:
         verbose_name = "Заказ"
         verbose_name_plural = "Заказы"
         ordering = ['created_at']
+        indexes = [
+            # Список заказов: ORDER BY created_at с пагинацией
+            models.Index(fields=['created_at', 'id'], name='order_created_idx'),
+            # MAX(updated_at) для ETag списка заказов
+            models.Index(fields=['updated_at'], name='order_updated_idx'),
+        ]
+
+class OperationQuerySet(models.QuerySet):
+    """
+    Обход цепочек previous_operation рекурсивным CTE: все потомки или предки
+    возвращаются одним запросом (работает и на PostgreSQL, и на SQLite).
+    UNION вместо UNION ALL не даёт зациклиться на уже существующих циклах.
+    """
+
+    def _chain_sql(self, ids, direction):
+        table = self.model._meta.db_table
+        placeholders = ", ".join(["%s"] * len(ids))
+        if direction == 'down':
+            seed = f"SELECT id FROM {table} WHERE previous_operation_id IN ({placeholders})"
+            step = f"SELECT o.id FROM {table} o JOIN chain c ON o.previous_operation_id = c.id"
+        else:
+            seed = (
+                f"SELECT previous_operation_id FROM {table} "
+                f"WHERE id IN ({placeholders}) AND previous_operation_id IS NOT NULL"
+            )
+            step = (
+                f"SELECT o.previous_operation_id FROM {table} o JOIN chain c ON o.id = c.id "
+                f"WHERE o.previous_operation_id IS NOT NULL"
+            )
+        return f"WITH RECURSIVE chain(id) AS ({seed} UNION {step}) SELECT id FROM chain", list(ids)
+
+    def _linked(self, ids, direction):
+        ids = [ids] if isinstance(ids, int) else list(ids)
+        if not ids:
+            return self.none()
+        sql, params = self._chain_sql(ids, direction)
+        return self.filter(id__in=RawSQL(sql, params))
+
+    def descendants_of(self, ids):
+        """Все операции ниже по цепочке от переданных (без них самих)."""
+        return self._linked(ids, 'down')
+
+    def ancestors_of(self, ids):
+        """Все операции выше по цепочке от переданных (без них самих)."""
+        return self._linked(ids, 'up')
+
+    def creates_cycle(self, operation_id, previous_operation_id):
+        """Появится ли цикл, если сделать previous_operation_id родителем operation_id. O(глубины)."""
+        if not operation_id or not previous_operation_id:
+            return False
+        if operation_id == previous_operation_id:
+            return True
+        sql, params = self._chain_sql([previous_operation_id], 'up')
+        with connections[self.db].cursor() as cursor:
+            cursor.execute(f"SELECT 1 FROM ({sql}) ancestors WHERE id = %s", params + [operation_id])
+            return cursor.fetchone() is not None
+
 
 class Operation(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, verbose_name="Заказ", related_name='operations')
@@ -107,10 +190,17 @@ class Operation(models.Model):
 
     actual_start = models.DateTimeField(null=True, blank=True, verbose_name="Фактическая дата начала")
     actual_end = models.DateTimeField(null=True, blank=True, verbose_name="Фактическая дата окончания")
+
+    # Обновляется и при массовых изменениях (bulk_update/update), по нему считаются ETag
+    updated_at = models.DateTimeField(auto_now=True, verbose_name="Дата обновления")
+
+    objects = OperationQuerySet.as_manager()
     
     def clean(self):
         if self.planned_start and self.planned_end and self.planned_start >= self.planned_end:
             raise ValidationError("Дата окончания должна быть позже даты начала")
+        if self.pk != self.previous_operation_id and Operation.objects.creates_cycle(self.pk, self.previous_operation_id):
+            raise ValidationError({"previous_operation": CYCLE_ERROR})
     
     def save(self, *args, **kwargs):
         if not self.pk:
@@ -122,11 +212,35 @@ class Operation(models.Model):
             if not self.master and self.order.default_master:
                 self.master = self.order.default_master
                 
-        # Проверка на цикличность (самого себя)
-        if self.pk and self.previous_operation and self.pk == self.previous_operation.pk:
+        # Проверка на цикличность: ссылку на саму себя сбрасываем, более длинные циклы запрещаем
+        update_fields = kwargs.get('update_fields')
+        checks_parent = update_fields is None or bool({'previous_operation', 'previous_operation_id'} & set(update_fields))
+        if self.pk and self.pk == self.previous_operation_id and checks_parent:
             self.previous_operation = None
-        
-        super().save(*args, **kwargs)
+        if not (self.pk and self.previous_operation_id and checks_parent):
+            super().save(*args, **kwargs)
+            return
+
+        # Проверка и запись - в одной транзакции под блокировкой цепочек:
+        # две одновременные перепривязки иначе обе не видят цикла друг друга
+        with transaction.atomic():
+            self._lock_chains()
+            if Operation.objects.creates_cycle(self.pk, self.previous_operation_id):
+                raise ValidationError({"previous_operation": CYCLE_ERROR})
+            super().save(*args, **kwargs)
+
+    def _lock_chains(self):
+        """
+        Блокирует заказы операции и нового родителя, затем их операции - в
+        том же порядке, что и пакетное сохранение заказа (api.bulk).
+        """
+        if Operation.previous_operation.is_cached(self):
+            order_ids = {self.order_id, self.previous_operation.order_id}
+        else:
+            parent_orders = Operation.objects.filter(pk=self.previous_operation_id).values_list('order_id', flat=True)
+            order_ids = {self.order_id, *parent_orders}
+        list(Order.objects.select_for_update().filter(pk__in=order_ids).order_by('pk').values_list('pk', flat=True))
+        list(Operation.objects.select_for_update().filter(order_id__in=order_ids).order_by('pk').values_list('pk', flat=True))
     
     @property
     def duration(self):
@@ -150,6 +264,26 @@ class Operation(models.Model):
         verbose_name = "Операция"
         verbose_name_plural = "Операции"
         ordering = ['predict_start']
+        indexes = [
+            # Список операций: ORDER BY predict_start с пагинацией
+            models.Index(fields=['predict_start', 'id'], name='operation_predict_idx'),
+            # MAX(updated_at) для ETag списка заказов
+            models.Index(fields=['updated_at'], name='operation_updated_idx'),
+            # Операции заказа (by_order, prefetch в заказах) в порядке predict_start
+            models.Index(fields=['order', 'predict_start'], name='operation_order_predict_idx'),
+            # Незавершённые операции (агрегация по исполнителям, active_only)
+            models.Index(
+                fields=['order'],
+                condition=models.Q(actual_end__isnull=True),
+                name='operation_open_idx',
+            ),
+            # Неначатые корни с прогнозом в прошлом (update_predict_operations)
+            models.Index(
+                fields=['predict_start', 'order'],
+                condition=models.Q(previous_operation__isnull=True, actual_start__isnull=True),
+                name='operation_unstarted_root_idx',
+            ),
+        ]
         
 class TehLog(models.Model):
     class LogType(models.IntegerChoices):
@@ -163,10 +297,151 @@ class TehLog(models.Model):
     info = models.CharField(max_length=256, verbose_name="Информация")
     type = models.IntegerField(choices=LogType, verbose_name="Тип лога")
     operation = models.ForeignKey(Operation, on_delete=models.CASCADE, verbose_name="Операция")
+
+    # Поисковый документ: текст лога, мастер, операция и заказ в нижнем регистре.
+    # На PostgreSQL по нему триггер поддерживает search_vector (конфигурация russian),
+    # а GIN-индекс pg_trgm ускоряет поиск по части слова (см. миграцию 0009).
+    search_text = models.TextField(blank=True, default='', editable=False, verbose_name="Поисковый текст")
+    search_vector = SearchVectorField(null=True, editable=False)
+    # Ключ записи TehLogOutbox, из которой создан лог: повторная доставка не создаст дубль
+    outbox_key = models.CharField(max_length=64, null=True, blank=True, editable=False, db_index=True)
     
     def __str__(self):
         return str(TehLog.LogType.choices[self.type][1]) + " " +str(self.operation)
+
+    def build_search_text(self):
+        parts = [self.info]
+        if self.master_id:
+            parts += [self.master.username, self.master.first_name, self.master.last_name]
+        if self.operation_id:
+            parts += [self.operation.name, self.operation.order.name]
+        return " ".join(part for part in parts if part).lower()
+
+    def save(self, *args, **kwargs):
+        if not self.search_text:
+            self.search_text = self.build_search_text()
+        super().save(*args, **kwargs)
+
+    @staticmethod
+    def _shift_text(diff):
+        return f"{diff.days} день(я) {round(diff.seconds/60/60, 1)} часа(ов)"
+
+    @classmethod
+    def for_shift(cls, operation, master, started, actual, planned):
+        """
+        Несохранённый лог о начале (started=True) или завершении операции
+        раньше/позже плана. actual и planned - моменты на время события.
+        """
+        log = cls(master=master, operation=operation)
+        if started:
+            late, ahead, verb = cls.LogType.LATE_START, cls.LogType.AHEAD_START, "начата"
+        else:
+            late, ahead, verb = cls.LogType.LATE_STOP, cls.LogType.AHEAD_STOP, "завершена"
+        if actual > planned:
+            log.type = late
+            when = f"{cls._shift_text(actual - planned)} позже"
+        else:
+            log.type = ahead
+            when = f"{cls._shift_text(planned - actual)} раньше"
+        log.info = f"Операция '{operation.name}' в заказе '{operation.order.name}' была {verb} на {when} плана мастером {master.username}"
+        return log
     
     class Meta:
         verbose_name = "Логи"
-        verbose_name_plural = "Логи"
\ No newline at end of file
+        verbose_name_plural = "Логи"
+        indexes = [
+            # Лента логов: ORDER BY logged_at DESC, id DESC
+            models.Index(fields=['-logged_at', '-id'], name='tehlog_logged_idx'),
+        ]
+
+class TehLogOutbox(models.Model):
+    """
+    Очередь логов мастера. Старт/завершение операции пишут сюда короткую
+    строку в своей транзакции, а текст лога и сам TehLog создаёт фоновый
+    воркер (manage.py drain_tehlog_outbox, api.outbox) пачками.
+    """
+    class Kind(models.TextChoices):
+        START = 'start'
+        END = 'end'
+
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Дата создания")
+    kind = models.CharField(max_length=8, choices=Kind, verbose_name="Событие")
+    operation = models.ForeignKey(Operation, on_delete=models.CASCADE, verbose_name="Операция")
+    master = models.ForeignKey(CustomUser, on_delete=models.CASCADE, verbose_name="Мастер")
+    # Факт и план на момент события: к разбору очереди операцию могли изменить
+    actual_at = models.DateTimeField(verbose_name="Фактическое время")
+    planned_at = models.DateTimeField(verbose_name="Плановое время")
+
+    @property
+    def key(self):
+        return f"{self.kind}:{self.operation_id}:{int(self.actual_at.timestamp() * 1_000_000)}"
+
+    def __str__(self):
+        return f"{self.kind} {self.operation_id}"
+
+    class Meta:
+        verbose_name = "Лог в очереди"
+        verbose_name_plural = "Очередь логов"
+
+
+class ForecastQueue(models.Model):
+    """
+    Очередь пересчёта прогнозов ("грязные" корни). Изменение операции,
+    влияющее на прогнозы потомков, пишет сюда строку в своей транзакции,
+    а сами потомки пересчитывает фоновый воркер (manage.py drain_forecast_queue,
+    api.reforecast): несколько записей одного поддерева - один пересчёт.
+    """
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Дата создания")
+    operation = models.ForeignKey(Operation, on_delete=models.CASCADE, verbose_name="Операция")
+
+    def __str__(self):
+        return f"{self.operation_id}"
+
+    class Meta:
+        verbose_name = "Пересчёт прогноза в очереди"
+        verbose_name_plural = "Очередь пересчёта прогнозов"
+
+
+class LiveEvent(models.Model):
+    """
+    Событие для потока /events/stream/: старт/завершение операции,
+    изменение прогнозов, новый лог. id служит Last-Event-ID при переподключении.
+    """
+    class Kind(models.TextChoices):
+        OPERATION_STARTED = 'operation.started'
+        OPERATION_ENDED = 'operation.ended'
+        OPERATION_FORECAST = 'operation.forecast'
+        LOG_CREATED = 'log.created'
+
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name="Дата создания")
+    kind = models.CharField(max_length=32, choices=Kind, verbose_name="Тип события")
+    order_id = models.BigIntegerField(null=True, blank=True, verbose_name="Заказ")
+    payload = models.JSONField(encoder=DjangoJSONEncoder, verbose_name="Данные")
+
+    def __str__(self):
+        return f"{self.pk} {self.kind}"
+
+    class Meta:
+        verbose_name = "Событие"
+        verbose_name_plural = "События"
+
+
+class ReferenceCacheCounter(models.Model):
+    """
+    Счётчики попаданий и промахов кэша справочников (api.cache.CacheStats)
+    и разобранной очереди прогнозов (api.reforecast). Воркеры прибавляют к ним атомарным UPDATE count = count + n - инкремент
+    DatabaseCache читает и перезаписывает значение и теряет одновременные.
+    """
+    namespace = models.CharField(max_length=32, verbose_name="Справочник")
+    name = models.CharField(max_length=16, verbose_name="Счётчик")
+    count = models.BigIntegerField(default=0, verbose_name="Значение")
+
+    def __str__(self):
+        return f"{self.namespace}:{self.name}={self.count}"
+
+    class Meta:
+        verbose_name = "Счётчик кэша справочников"
+        verbose_name_plural = "Счётчики кэша справочников"
+        constraints = [
+            models.UniqueConstraint(fields=['namespace', 'name'], name='reference_cache_counter_unique'),
+        ]
@@ -0,0 +1,67 @@
+from django.db import connection, transaction
+
+from api.events import publish_events, Kind
+from api.models import TehLog, TehLogOutbox
+
+
+def enqueue_logs(kind, operations):
+    """
+    Ставит в очередь логи мастера о старте/завершении операций. Вызывается в
+    транзакции действия: отменённый старт не оставит лога. Заказ и мастер
+    здесь не загружаются - текст лога собирает воркер.
+    """
+    started = kind == TehLogOutbox.Kind.START
+    TehLogOutbox.objects.bulk_create([
+        TehLogOutbox(
+            kind=kind,
+            operation_id=op.pk,
+            master_id=op.master_id,
+            actual_at=op.actual_start if started else op.actual_end,
+            planned_at=op.planned_start if started else op.planned_end,
+        )
+        for op in operations
+    ])
+
+
+def drain_outbox(batch_size=500):
+    """
+    Переносит одну пачку очереди в TehLog. Пачка блокируется с SKIP LOCKED
+    (несколько воркеров не мешают друг другу), логи создаются одним
+    bulk_create, записи очереди удаляются в той же транзакции.
+    Доставка идемпотентна: логи с уже существующим outbox_key пропускаются,
+    поэтому повторная обработка записи не создаст дубль.
+    Возвращает число разобранных записей очереди.
+    """
+    from api.serializers import TehLogSerializer
+
+    with transaction.atomic():
+        queue = TehLogOutbox.objects.order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            queue = queue.select_for_update(skip_locked=True, of=('self',))
+        entries = list(queue.select_related('operation__order', 'master')[:batch_size])
+        if not entries:
+            return 0
+
+        keys = {entry.key for entry in entries}
+        delivered = set(TehLog.objects.filter(outbox_key__in=keys).values_list('outbox_key', flat=True))
+
+        logs = []
+        for entry in entries:
+            if entry.key in delivered:
+                continue
+            delivered.add(entry.key)
+            log = TehLog.for_shift(
+                entry.operation, entry.master, entry.kind == TehLogOutbox.Kind.START,
+                entry.actual_at, entry.planned_at,
+            )
+            log.outbox_key = entry.key
+            # bulk_create не вызывает save() - поисковый текст заполняем сами
+            log.search_text = log.build_search_text()
+            logs.append(log)
+
+        TehLog.objects.bulk_create(logs)
+        TehLogOutbox.objects.filter(pk__in=[entry.pk for entry in entries]).delete()
+        publish_events([
+            (Kind.LOG_CREATED, TehLogSerializer(log).data, log.operation.order_id) for log in logs
+        ])
+    return len(entries)
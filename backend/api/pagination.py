@@ -0,0 +1,36 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """
+    Курсорная (keyset) пагинация: следующая страница выбирается условием
+    по индексированному ключу вместо OFFSET, общее количество не считается.
+    Курсор непрозрачный - клиент просто переходит по ссылкам next/previous.
+    """
+    page_size = 20
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class OperationCursorPagination(KeysetPagination):
+    ordering = ('predict_start', 'id')
+
+
+class OrderCursorPagination(KeysetPagination):
+    ordering = ('created_at', 'id')
+
+
+class ExecutorCursorPagination(KeysetPagination):
+    ordering = ('full_name', 'id')
+
+
+class TehLogCursorPagination(KeysetPagination):
+    ordering = ('-logged_at', '-id')
+    # Фронтенд запрашивает ленту логов параметром ?limit=
+    page_size_query_param = 'limit'
+
+    def get_ordering(self, request, queryset, view):
+        # Результаты полнотекстового поиска отдаются по релевантности
+        if 'search_rank' in queryset.query.annotations:
+            return ('-search_rank', '-logged_at', '-id')
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,114 @@
+import logging
+from datetime import datetime, timezone as dt_timezone
+
+from django.db import connection, transaction
+
+logger = logging.getLogger(__name__)
+
+# Таблица TehLog на PostgreSQL секционирована по месяцам logged_at (миграция
+# 0013): секции api_tehlog_pYYYYMM и api_tehlog_default для строк вне них.
+# На других СУБД таблица обычная, функции модуля ничего не делают.
+TEHLOG_TABLE = 'api_tehlog'
+TEHLOG_DEFAULT_PARTITION = 'api_tehlog_default'
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def next_month(value):
+    return datetime(value.year + value.month // 12, value.month % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(start):
+    return f"{TEHLOG_TABLE}_p{start:%Y%m}"
+
+
+def _literal(value):
+    # Границы секций - литералы DDL, параметры в CREATE/ATTACH PARTITION не передаются
+    return f"'{value.isoformat()}'"
+
+
+def tehlog_is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_partitioned_table WHERE partrelid = %s::regclass", [TEHLOG_TABLE])
+        return cursor.fetchone() is not None
+
+
+def tehlog_partitions():
+    """Месячные секции [(name, start, end)] по возрастанию, без секции по умолчанию."""
+    if not tehlog_is_partitioned():
+        return []
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+            "WHERE i.inhparent = %s::regclass",
+            [TEHLOG_TABLE],
+        )
+        names = sorted(row[0] for row in cursor.fetchall())
+    partitions = []
+    for name in names:
+        suffix = name[len(TEHLOG_TABLE) + 2:]
+        if not name.startswith(f"{TEHLOG_TABLE}_p") or not suffix.isdigit():
+            continue
+        start = datetime(int(suffix[:4]), int(suffix[4:]), 1, tzinfo=dt_timezone.utc)
+        partitions.append((name, start, next_month(start)))
+    return partitions
+
+
+def create_partition(cursor, start):
+    """
+    Создаёт секцию месяца start. Строки этого месяца, попавшие в секцию по
+    умолчанию, переносятся в новую секцию в той же транзакции.
+    """
+    end = next_month(start)
+    name = partition_name(start)
+    cursor.execute(
+        f"SELECT 1 FROM {TEHLOG_DEFAULT_PARTITION} WHERE logged_at >= %s AND logged_at < %s LIMIT 1",
+        [start, end],
+    )
+    if cursor.fetchone() is None:
+        cursor.execute(
+            f"CREATE TABLE {name} PARTITION OF {TEHLOG_TABLE} "
+            f"FOR VALUES FROM ({_literal(start)}) TO ({_literal(end)})"
+        )
+        return
+    cursor.execute(f"CREATE TABLE {name} (LIKE {TEHLOG_TABLE} INCLUDING DEFAULTS)")
+    cursor.execute(
+        f"WITH moved AS (DELETE FROM {TEHLOG_DEFAULT_PARTITION} "
+        f"WHERE logged_at >= %s AND logged_at < %s RETURNING *) "
+        f"INSERT INTO {name} SELECT * FROM moved",
+        [start, end],
+    )
+    cursor.execute(
+        f"ALTER TABLE {TEHLOG_TABLE} ATTACH PARTITION {name} "
+        f"FOR VALUES FROM ({_literal(start)}) TO ({_literal(end)})"
+    )
+
+
+def ensure_tehlog_partitions(now, months_ahead=2):
+    """Секции на текущий и months_ahead следующих месяцев. Возвращает имена созданных."""
+    if not tehlog_is_partitioned():
+        return []
+    existing = {name for name, _, _ in tehlog_partitions()}
+    created = []
+    start = month_start(now)
+    for _ in range(months_ahead + 1):
+        name = partition_name(start)
+        if name not in existing:
+            with transaction.atomic(), connection.cursor() as cursor:
+                create_partition(cursor, start)
+            created.append(name)
+            logger.info("Created TehLog partition %s", name)
+        start = next_month(start)
+    return created
+
+
+def drop_partition(name):
+    """Отсоединяет и удаляет секцию (после того как её строки ушли в архив)."""
+    with transaction.atomic(), connection.cursor() as cursor:
+        cursor.execute(f"ALTER TABLE {TEHLOG_TABLE} DETACH PARTITION {name}")
+        cursor.execute(f"DROP TABLE {name}")
@@ -0,0 +1,96 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from api.cache import add_counters, reference_cache
+from api.models import ForecastQueue, Operation, ReferenceCacheCounter
+from api.utils import recalculate_predict_chains
+
+# Поля операции, изменение которых сдвигает прогнозы её потомков
+FORECAST_FIELDS = frozenset({
+    'previous_operation', 'previous_operation_id', 'planned_start', 'planned_end',
+    'predict_start', 'predict_end', 'actual_start', 'actual_end',
+})
+
+STATS_PREFIX = 'forecast-queue'
+COUNTERS = ('entries', 'roots', 'changed')
+
+
+def enqueue_forecast(operations):
+    """
+    Ставит операции в очередь пересчёта потомков. Вызывается в транзакции
+    изменения: откат изменения откатит и запись очереди.
+    """
+    ForecastQueue.objects.bulk_create([ForecastQueue(operation_id=op.pk) for op in operations if op.pk])
+
+
+def drain_forecast_queue(batch_size=500):
+    """
+    Разбирает одну пачку очереди. Записи блокируются с SKIP LOCKED.
+    Повторы одной операции схлопываются, а потомки всех корней пачки
+    пересчитываются одним recalculate_predict_chains: общее поддерево
+    нескольких корней обходится один раз. Корни, как и при синхронном
+    пересчёте, остаются опорными - меняются только их потомки.
+    При FORECAST_ENGINE=capacity записи только удаляются: прогноз по цепочке
+    затёр бы результат прогноза с учётом загрузки, а полный пересчёт завода
+    на каждую пачку держал бы блокировки очереди и спорил с воркером
+    forecast_capacity --follow, который и пересчитывает прогнозы в этом режиме.
+    Записи удаляются в той же транзакции.
+    Возвращает (записей, различных корней, изменённых операций).
+    """
+    with transaction.atomic():
+        queue = ForecastQueue.objects.order_by('id')
+        if connection.features.has_select_for_update_skip_locked:
+            queue = queue.select_for_update(skip_locked=True, of=('self',))
+        entries = list(queue.values_list('id', 'operation_id', 'created_at')[:batch_size])
+        if not entries:
+            return 0, 0, 0
+
+        root_ids = {entry[1] for entry in entries}
+        if getattr(settings, 'FORECAST_ENGINE', 'chain') == 'capacity':
+            roots, changed = root_ids, 0
+        else:
+            roots = list(Operation.objects.filter(pk__in=root_ids).order_by().only(
+                'id', 'order_id', 'previous_operation_id', 'planned_start', 'planned_end',
+                'predict_start', 'predict_end', 'actual_end',
+            ))
+            changed = len(recalculate_predict_chains(roots))
+        ForecastQueue.objects.filter(pk__in=[entry[0] for entry in entries]).delete()
+
+    now = timezone.now()
+    lags = [(now - entry[2]).total_seconds() for entry in entries]
+    _record(len(entries), len(roots), changed, lags)
+    return len(entries), len(roots), changed
+
+
+def _key(name):
+    return f'{STATS_PREFIX}:{name}'
+
+
+def _record(entries, roots, changed, lags):
+    # Счётчики - в общей таблице, как статистика справочников (api.cache):
+    # инкремент кэша теряет одновременные прибавления нескольких воркеров
+    add_counters(STATS_PREFIX, dict(zip(COUNTERS, (entries, roots, changed))))
+    reference_cache().set(_key('last'), {
+        'at': timezone.now(),
+        'entries': entries,
+        'roots': roots,
+        'changed': changed,
+        'lag_max_seconds': round(max(lags), 3),
+        'lag_avg_seconds': round(sum(lags) / len(lags), 3),
+    }, timeout=None)
+
+
+def queue_stats():
+    """Глубина очереди и возраст старейшей записи плюс накопленные счётчики воркеров."""
+    oldest = ForecastQueue.objects.order_by('created_at').values_list('created_at', flat=True).first()
+    # Только что прибавленное читаем с основной базы, а не с реплики
+    counts = dict(
+        ReferenceCacheCounter.objects.using('default').filter(namespace=STATS_PREFIX).values_list('name', 'count')
+    )
+    return {
+        'depth': ForecastQueue.objects.count(),
+        'oldest_age_seconds': round((timezone.now() - oldest).total_seconds(), 3) if oldest else None,
+        'processed': {name: counts.get(name, 0) for name in COUNTERS},
+        'last_batch': reference_cache().get(_key('last')),
+    }
@@ -0,0 +1,192 @@
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from rest_framework_simplejwt.authentication import AUTH_HEADER_TYPES
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings as jwt_settings
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.cache import reference_cache
+
+# Чтение с реплик PostgreSQL. Реплики перечислены в DATABASE_REPLICAS
+# (mez/settings.py, переменная окружения DB_REPLICA_HOSTS); без них всё
+# идёт в default. ReplicaMiddleware выбирает реплику для GET/HEAD/OPTIONS
+# запросов к API, ReplicaRouter отправляет на неё чтения запроса, запись
+# всегда идёт в default. После успешного изменяющего запроса пользователь на
+# REPLICA_PIN_SECONDS закрепляется за основной базой - он сразу видит свои
+# изменения, даже если реплика отстаёт. Промахи общего кэша справочников
+# строятся по default (api.cache.cached_response).
+
+_read_alias = ContextVar('read_alias', default=None)
+
+SAFE_METHODS = frozenset({'GET', 'HEAD', 'OPTIONS'})
+# Служебные таблицы, которые читаются только с основной базы: кэш в БД
+# (в т.ч. метки закрепления, api.cache) должен сразу видеть свои записи
+PRIMARY_APPS = frozenset({'django_cache'})
+
+
+def replica_aliases():
+    return getattr(settings, 'DATABASE_REPLICAS', ())
+
+
+def choose_replica():
+    aliases = replica_aliases()
+    return random.choice(aliases) if aliases else None
+
+
+@contextmanager
+def read_from_replica(alias=None):
+    """
+    Чтения внутри блока идут на реплику (отчёты, выгрузки, команды).
+    Без настроенных реплик ничего не меняет.
+    """
+    token = _read_alias.set(alias or choose_replica())
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+@contextmanager
+def read_from_primary():
+    """
+    Чтения внутри блока идут в default даже внутри запроса на реплике -
+    для данных, которые попадут в общий кэш под новой версией.
+    """
+    token = _read_alias.set('default')
+    try:
+        yield
+    finally:
+        _read_alias.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        if model._meta.app_label in PRIMARY_APPS:
+            return 'default'
+        return _read_alias.get() or 'default'
+
+    def db_for_write(self, model, **hints):
+        return 'default'
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Реплики - копии default, объекты с любой из них связаны
+        return True
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        return db not in replica_aliases()
+
+
+def _jwt_user_id(request):
+    """Id пользователя из claim проверенного access-токена в Authorization."""
+    header = request.headers.get('Authorization', '').split()
+    if len(header) != 2 or header[0] not in AUTH_HEADER_TYPES:
+        return None
+    try:
+        return AccessToken(header[1]).get(jwt_settings.USER_ID_CLAIM)
+    except TokenError:
+        return None
+
+
+def _session_user_id(user):
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def _pin_key(user_id):
+    """
+    Метка закрепления - по пользователю: новый токен после refresh и другие
+    вкладки видят ту же метку. Адрес клиента не годится - за nginx он общий.
+    Анонимные запросы не закрепляются.
+    """
+    return None if user_id is None else f'replica-pin:{user_id}'
+
+
+class ReplicaMiddleware:
+    """
+    Безопасные запросы к API читают с реплики, если клиент не закреплён за
+    основной базой недавней записью. Изменяющие запросы (в т.ч. старт и
+    завершение операций) работают с default и после успешного ответа
+    закрепляют клиента. Работает и в ASGI без перехода в поток: реплика
+    хранится в contextvar, который sync_to_async передаёт async ORM.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not replica_aliases() or not request.path.startswith('/api/'):
+            return self.get_response(request)
+        key = _pin_key(_jwt_user_id(request) or _session_user_id(getattr(request, 'user', None)))
+
+        if request.method not in SAFE_METHODS:
+            response = self.get_response(request)
+            if key and response.status_code < 400:
+                reference_cache().set(key, *_pin())
+            return response
+
+        if key and _pinned(reference_cache().get(key)):
+            return self.get_response(request)
+        with read_from_replica():
+            response = self.get_response(request)
+            # Потоковый ответ (выгрузки) читает базу уже после выхода из view
+            if response.streaming:
+                response.streaming_content = _with_replica(response.streaming_content, _read_alias.get())
+            return response
+
+    async def __acall__(self, request):
+        if not replica_aliases() or not request.path.startswith('/api/'):
+            return await self.get_response(request)
+        user_id = _jwt_user_id(request)
+        if user_id is None and hasattr(request, 'auser'):
+            user_id = _session_user_id(await request.auser())
+        key = _pin_key(user_id)
+
+        if request.method not in SAFE_METHODS:
+            response = await self.get_response(request)
+            if key and response.status_code < 400:
+                await reference_cache().aset(key, *_pin())
+            return response
+
+        if key and _pinned(await reference_cache().aget(key)):
+            return await self.get_response(request)
+        with read_from_replica():
+            response = await self.get_response(request)
+            if response.streaming:
+                alias = _read_alias.get()
+                if response.is_async:
+                    response.streaming_content = _awith_replica(response.streaming_content, alias)
+                else:
+                    response.streaming_content = _with_replica(response.streaming_content, alias)
+            return response
+
+
+def _pin():
+    """Значение и время жизни метки закрепления."""
+    pin = getattr(settings, 'REPLICA_PIN_SECONDS', 5)
+    return time.time() + pin, pin
+
+
+def _pinned(pinned_until):
+    return pinned_until is not None and pinned_until > time.time()
+
+
+def _with_replica(content, alias):
+    with read_from_replica(alias):
+        yield from content
+
+
+async def _awith_replica(content, alias):
+    with read_from_replica(alias):
+        async for chunk in content:
+            yield chunk
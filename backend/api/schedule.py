@@ -0,0 +1,316 @@
+import heapq
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Max
+from django.utils import timezone
+
+from api.conditional import _etag
+from api.events import publish_forecast
+from api.models import Operation, Order
+from api.serializers import datetime_formatter
+from api.utils import PREDICT_FIELDS, _from_us, _to_us
+
+# Метод критического пути (CPM) по графу previous_operation заказа.
+# Раннее начало/окончание - прямой проход от корней, позднее - обратный от
+# срока заказа, резерв (total slack) - разность позднего и раннего окончания.
+# Граф хранится в параллельных массивах, время - в микросекундах epoch,
+# оба прохода линейные: O(V+E).
+
+CPM_FIELDS = ('id', 'previous_operation_id', 'planned_start', 'planned_end', 'actual_start', 'actual_end')
+
+
+class CriticalPath:
+    """
+    Результат расчёта: массивы по индексам строк (ids[i] - id операции),
+    order - топологический порядок индексов.
+    """
+    __slots__ = (
+        'ids', 'order', 'earliest_start', 'earliest_finish', 'latest_start', 'latest_finish',
+        'slack', 'done', 'finish', 'deadline',
+    )
+
+    def critical_ids(self):
+        """Незавершённые операции с минимальным резервом в топологическом порядке."""
+        open_slack = [self.slack[i] for i in self.order if not self.done[i]]
+        if not open_slack:
+            return []
+        least = min(open_slack)
+        return [self.ids[i] for i in self.order if not self.done[i] and self.slack[i] == least]
+
+
+def _topological(parent):
+    """Корни, затем дети в порядке BFS. Цикл разрывается на первой недостижимой операции."""
+    n = len(parent)
+    head = [-1] * n
+    sibling = [-1] * n
+    for i in range(n - 1, -1, -1):
+        p = parent[i]
+        if p >= 0:
+            sibling[i] = head[p]
+            head[p] = i
+
+    visited = bytearray(n)
+    order = []
+    roots = [i for i in range(n) if parent[i] < 0] + list(range(n))
+    for root in roots:
+        if visited[root]:
+            continue
+        visited[root] = 1
+        pos = len(order)
+        order.append(root)
+        while pos < len(order):
+            child = head[order[pos]]
+            while child >= 0:
+                if not visited[child]:
+                    visited[child] = 1
+                    order.append(child)
+                child = sibling[child]
+            pos += 1
+    return order
+
+
+def critical_path(rows, deadline, now):
+    """
+    rows - кортежи в порядке CPM_FIELDS для всех операций заказа.
+
+    Раннее начало: у завершённых и начатых - фактическое, у остальных - не
+    раньше окончания родителя (у корня - планового начала) и не раньше now.
+    Начатая операция заканчивается не раньше now. Длительность - плановая.
+    Позднее окончание: срок заказа для листьев, иначе минимальное позднее
+    начало детей.
+    """
+    n = len(rows)
+    result = CriticalPath()
+    result.ids = [row[0] for row in rows]
+    result.deadline = deadline
+    index = {row[0]: i for i, row in enumerate(rows)}
+    parent = [index.get(row[1], -1) for row in rows]
+    duration = [_to_us(row[3]) - _to_us(row[2]) for row in rows]
+    order = _topological(parent)
+    now_us = _to_us(now)
+
+    es = [0] * n
+    ef = [0] * n
+    done = bytearray(n)
+    for i in order:
+        row = rows[i]
+        if row[5] is not None:
+            ef[i] = _to_us(row[5])
+            es[i] = _to_us(row[4]) if row[4] is not None else ef[i] - duration[i]
+            done[i] = 1
+        elif row[4] is not None:
+            es[i] = _to_us(row[4])
+            ef[i] = max(es[i] + duration[i], now_us)
+        else:
+            p = parent[i]
+            release = ef[p] if p >= 0 else _to_us(row[2])
+            es[i] = max(release, now_us)
+            ef[i] = es[i] + duration[i]
+
+    deadline_us = _to_us(deadline)
+    lf = [deadline_us] * n
+    ls = [0] * n
+    for i in reversed(order):
+        ls[i] = lf[i] - duration[i]
+        p = parent[i]
+        if p >= 0 and ls[i] < lf[p]:
+            lf[p] = ls[i]
+
+    result.order = order
+    result.earliest_start = es
+    result.earliest_finish = ef
+    result.latest_start = ls
+    result.latest_finish = lf
+    result.slack = [lf[i] - ef[i] for i in range(n)]
+    result.done = done
+    result.finish = _from_us(max(ef)) if n else None
+    return result
+
+
+def _minutes(us):
+    # Округление вниз, как у duration_minutes
+    return us // 60_000_000
+
+
+def order_schedule(order_id, now=None):
+    """
+    Расчёт CPM заказа для API, None - заказа нет. Результат кэшируется по
+    состоянию заказа (как ETag заказа: updated_at, версия графа, последнее
+    изменение и число операций) на SCHEDULE_CACHE_TIMEOUT секунд - ранние
+    даты незавершённых операций зависят от текущего времени.
+    """
+    state = Order.objects.filter(pk=order_id)\
+        .values('deadline', 'updated_at', 'graph_version')\
+        .annotate(operations_updated=Max('operations__updated_at'), operations_count=Count('operations'))\
+        .order_by('updated_at').first()
+    if state is None:
+        return None
+
+    key = 'schedule:' + _etag(
+        order_id, state['deadline'], state['updated_at'], state['graph_version'],
+        state['operations_updated'], state['operations_count'],
+    )
+    # С явным now (пересчёт на другой момент) кэш не используется
+    cached = now is None
+    if cached:
+        data = cache.get(key)
+        if data is not None:
+            return data
+        now = timezone.now()
+
+    rows = list(Operation.objects.filter(order_id=order_id).order_by('planned_start', 'id').values_list(*CPM_FIELDS))
+    cpm = critical_path(rows, state['deadline'], now)
+
+    fmt = datetime_formatter()
+    path = cpm.critical_ids()
+    critical = set(path)
+    operations = []
+    for i in cpm.order:
+        op_id = cpm.ids[i]
+        operations.append({
+            'id': op_id,
+            'earliest_start': fmt(_from_us(cpm.earliest_start[i])),
+            'earliest_finish': fmt(_from_us(cpm.earliest_finish[i])),
+            'latest_start': fmt(_from_us(cpm.latest_start[i])),
+            'latest_finish': fmt(_from_us(cpm.latest_finish[i])),
+            'slack_minutes': _minutes(cpm.slack[i]),
+            'completed': bool(cpm.done[i]),
+            'critical': op_id in critical,
+        })
+
+    data = {
+        'order': order_id,
+        'deadline': fmt(state['deadline']),
+        'finish': fmt(cpm.finish) if cpm.finish else None,
+        'slack_minutes': _minutes(_to_us(state['deadline']) - _to_us(cpm.finish)) if cpm.finish else None,
+        'critical_path': path,
+        'computed_at': fmt(now),
+        'operations': operations,
+    }
+    if cached:
+        cache.set(key, data, getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 60))
+    return data
+
+
+# Прогноз с учётом загрузки: исполнитель и цех одновременно ведут только одну
+# операцию. Незавершённые операции всех заказов планируются списочным
+# планировщиком: операция становится готовой, когда спланирован её родитель,
+# из очереди готовых (куча) берётся самая рано освободившаяся, и она
+# начинается, когда свободны все её ресурсы. Занятость ресурса - момент его
+# освобождения, окна между операциями не заполняются.
+
+CAPACITY_FIELDS = (
+    'id', 'order_id', 'previous_operation_id', 'previous_operation__actual_end', 'assembly_shop_id',
+    'planned_start', 'planned_end', 'predict_start', 'predict_end', 'actual_start',
+)
+
+
+def capacity_forecast(rows, executors, now):
+    """
+    rows - кортежи в порядке CAPACITY_FIELDS для незавершённых операций,
+    executors - {id операции: [id исполнителей]}.
+
+    Начатые операции занимают свои ресурсы с фактического начала и
+    заканчиваются не раньше now. Неначатая операция готова с окончания
+    родителя (завершённого - фактического), корень - с планового начала,
+    и не раньше now. Среди готовых первой планируется та, что готова
+    раньше, при равенстве - с более ранним плановым началом, затем по id.
+    Сложность O((V+E) log V).
+    Возвращает [(id, predict_start, predict_end)] в микросекундах epoch.
+    """
+    n = len(rows)
+    index = {row[0]: i for i, row in enumerate(rows)}
+    now_us = _to_us(now)
+    duration = [_to_us(row[6]) - _to_us(row[5]) for row in rows]
+    shop_free = {}
+    executor_free = {}
+
+    head = [-1] * n
+    sibling = [-1] * n
+    ready = []
+    start = [0] * n
+    end = [0] * n
+    scheduled = bytearray(n)
+    started = []
+    for i in range(n - 1, -1, -1):
+        row = rows[i]
+        p = index.get(row[2], -1)
+        if row[9] is not None:
+            started.append(i)
+        elif p >= 0:
+            sibling[i] = head[p]
+            head[p] = i
+        else:
+            # Родитель завершён или его нет
+            release = _to_us(row[3]) if row[3] is not None else _to_us(row[5])
+            ready.append((max(release, now_us), _to_us(row[5]), row[0], i))
+
+    def occupy(i, begin, finish, push):
+        start[i] = begin
+        end[i] = finish
+        scheduled[i] = 1
+        shop = rows[i][4]
+        if shop is not None and shop_free.get(shop, 0) < finish:
+            shop_free[shop] = finish
+        for executor in executors.get(rows[i][0], ()):
+            if executor_free.get(executor, 0) < finish:
+                executor_free[executor] = finish
+        child = head[i]
+        while child >= 0:
+            push(ready, (max(finish, now_us), _to_us(rows[child][5]), rows[child][0], child))
+            child = sibling[child]
+
+    # Начатые операции уже держат ресурсы
+    for i in started:
+        begin = _to_us(rows[i][9])
+        occupy(i, begin, max(begin + duration[i], now_us), list.append)
+
+    heapq.heapify(ready)
+    while ready:
+        release, _, op_id, i = heapq.heappop(ready)
+        begin = release
+        shop = rows[i][4]
+        if shop is not None:
+            begin = max(begin, shop_free.get(shop, 0))
+        for executor in executors.get(op_id, ()):
+            begin = max(begin, executor_free.get(executor, 0))
+        occupy(i, begin, begin + duration[i], heapq.heappush)
+
+    # Операции в цикле недостижимы и остаются без прогноза
+    return [(rows[i][0], start[i], end[i]) for i in range(n) if scheduled[i]]
+
+
+def run_capacity_forecast(now=None, dry_run=False, batch_size=1000):
+    """
+    Пересчитывает прогнозы всех незавершённых операций завода с учётом
+    загрузки и записывает изменившиеся predict_start/predict_end.
+    Возвращает (число операций, число изменённых).
+    """
+    now = now or timezone.now()
+    open_operations = Operation.objects.filter(actual_end__isnull=True)
+    rows = list(open_operations.order_by().values_list(*CAPACITY_FIELDS).iterator(chunk_size=batch_size))
+    executors = {}
+    through = Operation.executors.through
+    for operation_id, executor_id in through.objects.filter(operation__actual_end__isnull=True)\
+            .order_by().values_list('operation_id', 'executor_id').iterator(chunk_size=batch_size):
+        executors.setdefault(operation_id, []).append(executor_id)
+
+    forecast = capacity_forecast(rows, executors, now)
+    by_id = {row[0]: row for row in rows}
+    updated_at = timezone.now()
+    changed = []
+    for op_id, begin, finish in forecast:
+        row = by_id[op_id]
+        predict_start, predict_end = _from_us(begin), _from_us(finish)
+        if predict_start != row[7] or predict_end != row[8]:
+            changed.append(Operation(
+                id=op_id, order_id=row[1], predict_start=predict_start, predict_end=predict_end, updated_at=updated_at,
+            ))
+
+    if changed and not dry_run:
+        with transaction.atomic():
+            Operation.objects.bulk_update(changed, PREDICT_FIELDS + ['updated_at'], batch_size=batch_size)
+            publish_forecast(changed)
+    return len(rows), len(changed)
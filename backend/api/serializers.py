@@ -1,7 +1,14 @@
+from collections import defaultdict
+
 from rest_framework import serializers
 from django.contrib.auth import get_user_model
-from api.models import Order, Operation, AssemblyShop, Executor, TehLog
-from .utils import sort_operations_chain 
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.utils import timezone
+from django.db.models import Case, When, Value, F, CharField, DurationField, ExpressionWrapper
+from api.models import Order, Operation, AssemblyShop, Executor, TehLog, CYCLE_ERROR
+from .graph import get_operation_graph
+from .utils import topological_order
+from .archive import decode_cursor
 
 User = get_user_model()
 
@@ -49,6 +56,14 @@ class OperationSerializer(serializers.ModelSerializer):
             'duration_minutes',
         ]
 
+    def update(self, instance, validated_data):
+        # Цикл проверяет Operation.save() под блокировкой цепочки - здесь его
+        # ошибка становится ответом 400
+        try:
+            return super().update(instance, validated_data)
+        except DjangoValidationError as error:
+            raise serializers.ValidationError(error.message_dict)
+
     def get_duration_minutes(self, obj):
         return int(obj.duration.total_seconds() / 60)
         
@@ -60,6 +75,63 @@ class OperationStartSerializer(serializers.Serializer):
         required=True
     )
 
+class OperationBatchStartItemSerializer(OperationStartSerializer):
+    id = serializers.IntegerField()
+
+class OperationBatchStartSerializer(serializers.Serializer):
+    operations = OperationBatchStartItemSerializer(many=True, allow_empty=False)
+
+    def validate_operations(self, items):
+        ids = [item['id'] for item in items]
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError("Операции в пакете повторяются")
+        return items
+
+class OperationBatchEndSerializer(serializers.Serializer):
+    operations = serializers.ListField(child=serializers.IntegerField(), allow_empty=False)
+
+    def validate_operations(self, ids):
+        if len(set(ids)) != len(ids):
+            raise serializers.ValidationError("Операции в пакете повторяются")
+        return ids
+
+class WindowParamsSerializer(serializers.Serializer):
+    """Окно времени из query-параметров ?from=&to=."""
+    date_from = serializers.DateTimeField(required=False)
+    date_to = serializers.DateTimeField(required=False)
+
+    def to_internal_value(self, data):
+        # from/to - зарезервированные слова Python, в query-параметрах оставляем короткие имена
+        data = {key: value for key, value in data.items()}
+        for param, field in (('from', 'date_from'), ('to', 'date_to')):
+            if param in data:
+                data[field] = data.pop(param)
+        return super().to_internal_value(data)
+
+    def validate(self, attrs):
+        if attrs.get('date_from') and attrs.get('date_to') and attrs['date_from'] > attrs['date_to']:
+            raise serializers.ValidationError({'to': "Конец окна раньше начала"})
+        return attrs
+
+class ExecutorAggregationParamsSerializer(WindowParamsSerializer):
+    active_only = serializers.BooleanField(required=False, default=False)
+    workshop = serializers.IntegerField(required=False)
+
+class GanttParamsSerializer(WindowParamsSerializer):
+    date_from = serializers.DateTimeField(required=True)
+    date_to = serializers.DateTimeField(required=True)
+    shop = serializers.IntegerField(required=False)
+    master = serializers.IntegerField(required=False)
+
+class TehLogArchiveParamsSerializer(WindowParamsSerializer):
+    """Параметры чтения архива логов: окно, поиск, размер страницы и курсор "мкс:id"."""
+    search = serializers.CharField(required=False, allow_blank=True)
+    limit = serializers.IntegerField(required=False, default=100, min_value=1, max_value=1000)
+    cursor = serializers.RegexField(r'^\d+:\d+$', required=False)
+
+    def validate_cursor(self, value):
+        return decode_cursor(value)
+
 class TehLogSerializer(serializers.ModelSerializer):
     master_name = serializers.CharField(source='master.username', read_only=True)
     operation_name = serializers.CharField(source='operation.name', read_only=True)
@@ -94,14 +166,91 @@ class OrderSerializer(serializers.ModelSerializer):
         ]
 
     def get_operations(self, obj):
-        # Получаем операции текущего заказа
-        ops = obj.operations.all()
-        # Сортируем их нашей функцией
-        sorted_ops = sort_operations_chain(ops)
+        # Получаем операции текущего заказа (из prefetch-кэша, если он есть)
+        ops = list(obj.operations.all())
+        # Порядок цепочки берём из кэша графа заказа
+        sorted_ops = get_operation_graph(obj.pk, obj.graph_version, ops).order_operations(ops)
         
         return OperationSerializer(sorted_ops, many=True, context=self.context).data
 
 
+class OperationRefField(serializers.Field):
+    """
+    Ссылка на операцию в пакетном сохранении заказа: число - id существующей
+    операции, строка - временный id новой операции, выданный клиентом.
+    """
+    default_error_messages = {
+        'invalid': "Ожидается id операции или временный id (строка).",
+    }
+
+    def to_internal_value(self, data):
+        if isinstance(data, bool):
+            self.fail('invalid')
+        if isinstance(data, int):
+            return data
+        if isinstance(data, str) and data.strip():
+            return int(data) if data.isdigit() else data
+        self.fail('invalid')
+
+    def to_representation(self, value):
+        return value
+
+
+class BulkOperationSerializer(serializers.Serializer):
+    id = OperationRefField(required=False)
+    name = serializers.CharField(max_length=255, required=False, default="Операция")
+    description = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    assembly_shop = serializers.IntegerField(allow_null=True, required=False)
+    master = serializers.IntegerField(allow_null=True, required=False)
+    executors = serializers.ListField(child=serializers.IntegerField(), required=False)
+    previous_operation = OperationRefField(allow_null=True, required=False)
+    planned_start = serializers.DateTimeField()
+    planned_end = serializers.DateTimeField()
+
+    def validate(self, attrs):
+        if attrs['planned_start'] >= attrs['planned_end']:
+            raise serializers.ValidationError({'planned_end': "Дата окончания должна быть позже даты начала"})
+        return attrs
+
+
+class OrderBulkSerializer(serializers.Serializer):
+    """
+    Заказ вместе с полным списком его операций (api.bulk.save_order_bulk).
+    Операции, которых нет в списке, удаляются. Связи previous_operation
+    могут ссылаться на временные id новых операций.
+    """
+    name = serializers.CharField(max_length=255)
+    description = serializers.CharField(allow_null=True, allow_blank=True, required=False)
+    default_master = serializers.IntegerField(allow_null=True, required=False)
+    deadline = serializers.DateTimeField()
+    operations = BulkOperationSerializer(many=True)
+
+    def validate_operations(self, operations):
+        refs = set()
+        for index, item in enumerate(operations):
+            # Операции без id получают временный id по позиции
+            item.setdefault('id', f'#{index}')
+            if item['id'] in refs:
+                raise serializers.ValidationError(f"Повторяющийся id операции: {item['id']}")
+            refs.add(item['id'])
+
+        parents = {}
+        for item in operations:
+            parent = item.get('previous_operation')
+            if parent == item['id']:
+                # Ссылку на саму себя сбрасываем, как и Operation.save()
+                parent = item['previous_operation'] = None
+            if parent is not None and parent not in refs:
+                raise serializers.ValidationError(
+                    f"Операция {item['id']}: previous_operation {parent} не входит в список операций заказа"
+                )
+            parents[item['id']] = parent
+
+        if topological_order(parents) is None:
+            raise serializers.ValidationError(CYCLE_ERROR)
+        return operations
+
+
 class LastOperationSerializer(serializers.ModelSerializer):
     class Meta:
         model = Operation
@@ -155,4 +304,139 @@ class ExecutorAggregationSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Executor
-        fields = ['id', 'full_name', 'total_tasks', 'active_tasks_count', 'tasks']
\ No newline at end of file
+        fields = ['id', 'full_name', 'total_tasks', 'active_tasks_count', 'tasks']
+
+# Быстрый путь чтения для списков. Строки берутся из .values() одним запросом,
+# статус и длительность считаются в SQL, исполнители - вторым запросом по
+# промежуточной таблице. Результат побайтно совпадает с выводом
+# OperationSerializer/OrderSerializer: тот же порядок ключей, те же форматы дат,
+# assembly_shop_name/master_name так же отсутствуют, если цеха/мастера нет.
+
+def datetime_formatter():
+    """
+    Формат дат, как у DateTimeField в ModelSerializer. Часовой пояс фиксируется
+    один раз на запрос, а не ищется для каждого значения.
+    """
+    return serializers.DateTimeField(default_timezone=timezone.get_current_timezone()).to_representation
+
+
+class _ChainItem:
+    """Строка операции для упорядочивания графом заказа (нужны id, previous_operation_id, planned_start)."""
+    __slots__ = ('id', 'previous_operation_id', 'planned_start', 'data')
+
+    def __init__(self, row, data):
+        self.id = row['id']
+        self.previous_operation_id = row['previous_operation_id']
+        self.planned_start = row['planned_start']
+        self.data = data
+
+
+class OperationReadSerializer:
+    """Сериализация операций только для чтения, без ModelSerializer."""
+    values = (
+        'id', 'order_id', 'name', 'description', 'assembly_shop_id', 'assembly_shop__name',
+        'master_id', 'master__username', 'previous_operation_id',
+        'planned_start', 'planned_end', 'predict_start', 'predict_end', 'actual_start', 'actual_end',
+        'status_value', 'duration_value',
+    )
+
+    def __init__(self):
+        self.format_datetime = datetime_formatter()
+
+    @classmethod
+    def values_queryset(cls, queryset):
+        return queryset.annotate(
+            status_value=Case(
+                When(actual_end__isnull=False, then=Value('completed')),
+                When(actual_start__isnull=False, then=Value('in_progress')),
+                default=Value('planned'),
+                output_field=CharField(),
+            ),
+            duration_value=ExpressionWrapper(F('planned_end') - F('planned_start'), output_field=DurationField()),
+        ).values(*cls.values)
+
+    def executors_map(self, operation_ids):
+        through = Operation.executors.through
+        executors = defaultdict(list)
+        if operation_ids:
+            rows = through.objects.filter(operation_id__in=operation_ids)\
+                .order_by('operation_id', 'executor_id')\
+                .values_list('operation_id', 'executor_id')
+            for operation_id, executor_id in rows:
+                executors[operation_id].append(executor_id)
+        return executors
+
+    def to_representation(self, row, executors):
+        fmt = self.format_datetime
+        data = {
+            'id': row['id'],
+            'order': row['order_id'],
+            'name': row['name'],
+            'description': row['description'],
+            'status': row['status_value'],
+            'assembly_shop': row['assembly_shop_id'],
+        }
+        if row['assembly_shop_id'] is not None:
+            data['assembly_shop_name'] = row['assembly_shop__name']
+        data['executors'] = executors.get(row['id'], [])
+        data['master'] = row['master_id']
+        if row['master_id'] is not None:
+            data['master_name'] = row['master__username']
+        data['previous_operation'] = row['previous_operation_id']
+        data['planned_start'] = fmt(row['planned_start'])
+        data['planned_end'] = fmt(row['planned_end'])
+        data['predict_start'] = row['predict_start']
+        data['predict_end'] = row['predict_end']
+        data['actual_start'] = row['actual_start']
+        data['actual_end'] = row['actual_end']
+        data['duration_minutes'] = int(row['duration_value'].total_seconds() / 60)
+        return data
+
+    def serialize(self, rows):
+        rows = list(rows)
+        executors = self.executors_map([row['id'] for row in rows])
+        return [self.to_representation(row, executors) for row in rows]
+
+    def chain_items(self, rows):
+        """Строки с данными для последующего упорядочивания graph.order_operations."""
+        rows = list(rows)
+        executors = self.executors_map([row['id'] for row in rows])
+        return [_ChainItem(row, self.to_representation(row, executors)) for row in rows]
+
+
+class OrderReadSerializer:
+    """Сериализация заказов с операциями только для чтения, без ModelSerializer."""
+    values = ('id', 'name', 'description', 'default_master_id', 'deadline', 'created_at', 'graph_version')
+
+    def __init__(self):
+        self.format_datetime = datetime_formatter()
+        self.operations = OperationReadSerializer()
+
+    @classmethod
+    def values_queryset(cls, queryset):
+        return queryset.values(*cls.values)
+
+    def serialize(self, rows):
+        rows = list(rows)
+        items_by_order = defaultdict(list)
+        operations = OperationReadSerializer.values_queryset(
+            Operation.objects.filter(order_id__in=[row['id'] for row in rows]).order_by()
+        )
+        for item in self.operations.chain_items(operations):
+            items_by_order[item.data['order']].append(item)
+
+        fmt = self.format_datetime
+        result = []
+        for row in rows:
+            items = items_by_order.get(row['id'], [])
+            ordered = get_operation_graph(row['id'], row['graph_version'], items).order_operations(items)
+            result.append({
+                'id': row['id'],
+                'name': row['name'],
+                'description': row['description'],
+                'default_master': row['default_master_id'],
+                'deadline': fmt(row['deadline']),
+                'created_at': fmt(row['created_at']),
+                'operations': [item.data for item in ordered],
+            })
+        return result
@@ -0,0 +1,66 @@
+from django.db.models.signals import post_save, post_delete, m2m_changed
+from django.dispatch import receiver
+
+from api.cache import bump_reference_version, WORKSHOPS, EXECUTORS, MASTERS
+from api.events import publish_event, Kind
+from api.graph import GRAPH_FIELDS, bump_graph_version
+from api.models import AssemblyShop, CustomUser, Executor, Operation, TehLog
+from api.reforecast import FORECAST_FIELDS, enqueue_forecast
+
+
+@receiver(post_save, sender=Operation)
+def operation_saved(sender, instance, created, update_fields=None, raw=False, **kwargs):
+    if raw:
+        return
+    # У новой операции ещё нет потомков
+    if not created and (update_fields is None or FORECAST_FIELDS.intersection(update_fields)):
+        enqueue_forecast([instance])
+    # Сохранение только прогнозов/фактов не меняет структуру графа
+    if not created and update_fields is not None and not GRAPH_FIELDS.intersection(update_fields):
+        return
+    bump_graph_version([instance.order_id])
+
+
+@receiver(post_delete, sender=Operation)
+def operation_deleted(sender, instance, **kwargs):
+    bump_graph_version([instance.order_id])
+
+
+@receiver(post_save, sender=TehLog)
+def tehlog_saved(sender, instance, created, raw=False, **kwargs):
+    if raw or not created:
+        return
+    from api.serializers import TehLogSerializer
+
+    publish_event(Kind.LOG_CREATED, TehLogSerializer(instance).data, order_id=instance.operation.order_id)
+
+
+@receiver([post_save, post_delete], sender=AssemblyShop)
+def assembly_shop_changed(sender, raw=False, **kwargs):
+    if raw:
+        return
+    # Удаление цеха каскадно чистит связи исполнителей без m2m_changed
+    bump_reference_version(WORKSHOPS, EXECUTORS)
+
+
+@receiver([post_save, post_delete], sender=Executor)
+def executor_changed(sender, raw=False, **kwargs):
+    if raw:
+        return
+    bump_reference_version(EXECUTORS)
+
+
+@receiver(m2m_changed, sender=Executor.assembly_shops.through)
+def executor_shops_changed(sender, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear'):
+        bump_reference_version(EXECUTORS)
+
+
+@receiver([post_save, post_delete], sender=CustomUser)
+def user_changed(sender, raw=False, update_fields=None, **kwargs):
+    if raw:
+        return
+    # Вход пользователя обновляет только last_login - список мастеров не меняется
+    if update_fields is not None and set(update_fields) <= {'last_login'}:
+        return
+    bump_reference_version(MASTERS)
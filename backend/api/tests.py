@@ -1,3 +1,1647 @@
-from django.test import TestCase
+import csv
+import gzip
+import io
+import json
+import random
+import re
+import tempfile
+import time
+import zipfile
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from types import SimpleNamespace
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+
+from django.core.exceptions import ValidationError
+from django.core.management import call_command
+from django.core.management.color import no_style
+from django.db import connection, router
+from django.db.models import Max
+from django.http import HttpResponse, StreamingHttpResponse
+from django.test import RequestFactory, SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+from api.archive import latest_archived_logs, write_archive
+from api.cache import WORKSHOPS, CacheStats, bump_reference_version, cached_response
+from api.graph import get_operation_graph, graph_index
+from api.events import events_after, hub
+from api.models import (
+    AssemblyShop, CustomUser, Executor, ForecastQueue, LiveEvent, Order, Operation, ReferenceCacheCounter, TehLog,
+    TehLogOutbox,
+)
+from api.outbox import drain_outbox
+from api.partitions import create_partition, month_start
+from api.reforecast import drain_forecast_queue, enqueue_forecast
+from api.replicas import ReplicaMiddleware, read_from_replica
+from api.schedule import capacity_forecast, critical_path, order_schedule, run_capacity_forecast
+from api.utils import _to_us, overdue_root_orders, recalculate_predict_chains, sort_operations_chain
+
+
+def make_chain(order, length, start=None, hours=2):
+    """Создаёт линейную цепочку операций заказа и возвращает её списком."""
+    start = start or timezone.now().replace(microsecond=0)
+    ops = []
+    previous = None
+    for i in range(length):
+        op_start = start + timedelta(hours=hours * i)
+        previous = Operation.objects.create(
+            order=order,
+            name=f"Операция {i}",
+            planned_start=op_start,
+            planned_end=op_start + timedelta(hours=hours),
+            previous_operation=previous,
+        )
+        ops.append(previous)
+    return ops
+
+
+# Зеркало default в TestCase - отдельное соединение, не видящее данных
+# незавершённой транзакции теста, поэтому API в тестах читает с default
+@override_settings(DATABASE_REPLICAS=[])
+class BaseAPITestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.technolog = CustomUser.objects.create_user('tech', password='pass', role='technolog')
+        cls.master = CustomUser.objects.create_user('master', password='pass', role='master')
+        cls.order = Order.objects.create(
+            name="Заказ",
+            deadline=timezone.now() + timedelta(days=30),
+            created_by=cls.technolog,
+            default_master=cls.master,
+        )
+
+
+class RecalculatePredictChainsTests(BaseAPITestCase):
+    def test_shifts_all_descendants(self):
+        ops = make_chain(self.order, 5)
+        # Ветка от второй операции
+        branch_start = ops[1].planned_end
+        branch = Operation.objects.create(
+            order=self.order, name="Ветка", previous_operation=ops[1],
+            planned_start=branch_start, planned_end=branch_start + timedelta(hours=1),
+        )
+
+        root = ops[0]
+        root.predict_end = root.planned_end + timedelta(hours=3)
+        root.save()
+        recalculate_predict_chains([root])
+
+        expected_start = root.predict_end
+        for op in ops[1:]:
+            op.refresh_from_db()
+            self.assertEqual(op.predict_start, expected_start)
+            self.assertEqual(op.predict_end, expected_start + op.duration)
+            expected_start = op.predict_end
+        branch.refresh_from_db()
+        self.assertEqual(branch.predict_start, Operation.objects.get(pk=ops[1].pk).predict_end)
+
+    def test_query_count_does_not_depend_on_chain_length(self):
+        ops = make_chain(self.order, 50)
+        root = ops[0]
+        root.predict_end = root.planned_end + timedelta(days=1)
+        root.save(update_fields=['predict_end'])
+        recalculate_predict_chains([ops[-1]])  # прогреваем кэш графа
+        # Версия графа, SELECT потомков и один UPDATE
+        with self.assertNumQueries(3):
+            changed = recalculate_predict_chains([root])
+        self.assertEqual(len(changed), 49)
+
+    def test_no_writes_when_nothing_changed(self):
+        ops = make_chain(self.order, 3)
+        recalculate_predict_chains([ops[-1]])
+        with self.assertNumQueries(2):
+            self.assertEqual(recalculate_predict_chains([ops[0]]), [])
+
+
+class OrderListQueryCountTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.shop = AssemblyShop.objects.create(name="Цех 1")
+        self.executors = [Executor.objects.create(full_name=f"Исполнитель {i}") for i in range(3)]
+        self.fill([self.order] + self.add_orders(4), 10)
+
+    def add_orders(self, count):
+        return [
+            Order.objects.create(name=f"Заказ {i}", deadline=self.order.deadline, created_by=self.technolog)
+            for i in range(count)
+        ]
+
+    def fill(self, orders, length):
+        for order in orders:
+            for op in make_chain(order, length):
+                op.assembly_shop = self.shop
+                op.master = self.master
+                op.save()
+                op.executors.set(self.executors)
+
+    def count_queries(self, path):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()
+
+    def test_order_list_query_count_is_constant(self):
+        # Два агрегата и версии справочников для ETag, заказы, операции
+        # (+цех, мастер), исполнители; COUNT(*) пагинации не выполняется
+        small, body = self.count_queries('/api/v1/order/')
+        self.assertEqual(small, 6)
+        results = body['results']
+        self.assertEqual(len(results), 5)
+        first = results[0]['operations']
+        self.assertEqual(len(first), 10)
+        self.assertEqual(first[0]['assembly_shop_name'], "Цех 1")
+        self.assertEqual(first[0]['master_name'], "master")
+        self.assertEqual(len(first[0]['executors']), 3)
+        # Порядок по цепочке previous_operation
+        for prev, op in zip(first, first[1:]):
+            self.assertEqual(op['previous_operation'], prev['id'])
+
+        # Втрое больше заказов, в новых - вдвое длиннее цепочки
+        self.fill(self.add_orders(10), 20)
+        large, body = self.count_queries('/api/v1/order/')
+        self.assertEqual(len(body['results']), 15)
+        self.assertEqual(sum(len(order['operations']) for order in body['results']), 250)
+        self.assertEqual(large, small)
+
+    def test_order_detail_query_count_is_constant(self):
+        # Состояние и версии справочников для ETag, заказ, операции, исполнители
+        small, body = self.count_queries(f'/api/v1/order/{self.order.pk}/')
+        self.assertEqual(small, 5)
+        self.assertEqual(len(body['operations']), 10)
+
+        self.fill([self.order], 20)
+        large, body = self.count_queries(f'/api/v1/order/{self.order.pk}/')
+        self.assertEqual(len(body['operations']), 30)
+        self.assertEqual(large, small)
+
+
+class UpdatePredictOperationsCommandTests(BaseAPITestCase):
+    def setUp(self):
+        self.ops = make_chain(self.order, 4, start=timezone.now() - timedelta(days=3))
+
+    def test_shifts_overdue_root_and_descendants(self):
+        out = StringIO()
+        call_command('update_predict_operations', '--workers', '2', '--chunk-size', '1', stdout=out)
+        self.assertIn("корней сдвинуто: 1", out.getvalue())
+
+        root = Operation.objects.get(pk=self.ops[0].pk)
+        self.assertEqual(timezone.localtime(root.predict_start).date(), timezone.localdate())
+        self.assertEqual(
+            timezone.localtime(root.predict_start).time(),
+            timezone.localtime(self.ops[0].predict_start).time(),
+        )
+        previous = root
+        for op in self.ops[1:]:
+            op.refresh_from_db()
+            self.assertEqual(op.predict_start, previous.predict_end)
+            self.assertEqual(op.predict_end, op.predict_start + op.duration)
+            previous = op
+
+    def test_publishes_forecast_of_changed_operations(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('update_predict_operations', stdout=StringIO())
+
+        event = LiveEvent.objects.get(kind=LiveEvent.Kind.OPERATION_FORECAST)
+        self.assertEqual(event.order_id, self.order.pk)
+        self.assertEqual(sorted(row[0] for row in event.payload['operations']), [op.pk for op in self.ops])
+
+    def test_dry_run_does_not_write(self):
+        out = StringIO()
+        call_command('update_predict_operations', '--dry-run', stdout=out)
+        self.assertIn("операций обновлено: 4", out.getvalue())
+        root = Operation.objects.get(pk=self.ops[0].pk)
+        self.assertEqual(root.predict_start, self.ops[0].predict_start)
+
+
+class OperationGraphIndexTests(BaseAPITestCase):
+    def setUp(self):
+        graph_index.clear()
+        self.ops = make_chain(self.order, 4)
+
+    def current_graph(self):
+        self.order.refresh_from_db()
+        return get_operation_graph(self.order.pk, self.order.graph_version)
+
+    def test_graph_is_cached_until_structure_changes(self):
+        graph = self.current_graph()
+        self.assertEqual(graph.chain, tuple(op.pk for op in self.ops))
+        self.assertEqual(graph.descendants([self.ops[1].pk]), [op.pk for op in self.ops[2:]])
+        with self.assertNumQueries(0):
+            self.assertIs(get_operation_graph(self.order.pk, graph.version), graph)
+
+        # Изменение прогноза не трогает структуру
+        self.ops[0].save(update_fields=['predict_start'])
+        self.assertIs(self.current_graph(), graph)
+
+        # Перецепляем последнюю операцию к первой
+        self.ops[3].previous_operation = self.ops[0]
+        self.ops[3].save()
+        graph = self.current_graph()
+        self.assertEqual(graph.children[self.ops[0].pk], (self.ops[1].pk, self.ops[3].pk))
+
+    def test_order_save_keeps_concurrent_graph_version(self):
+        stale = Order.objects.get(pk=self.order.pk)
+        self.ops[3].previous_operation = self.ops[0]
+        self.ops[3].save()
+        bumped = Order.objects.get(pk=self.order.pk).graph_version
+        self.assertNotEqual(bumped, stale.graph_version)
+
+        # Сохранение заказа, прочитанного до сброса, метку не откатывает
+        stale.name = "Переименованный заказ"
+        stale.save()
+        client = APIClient()
+        client.force_authenticate(self.technolog)
+        response = client.patch(f'/api/v1/order/{self.order.pk}/', {'description': "Чертёж"}, format='json')
+        self.assertEqual(response.status_code, 200)
+        order = Order.objects.get(pk=self.order.pk)
+        self.assertEqual((order.name, order.description), ("Переименованный заказ", "Чертёж"))
+        self.assertEqual(order.graph_version, bumped)
+
+    def test_delete_invalidates_graph(self):
+        version = self.current_graph().version
+        self.ops[2].delete()
+        graph = self.current_graph()
+        self.assertNotEqual(graph.version, version)
+        self.assertNotIn(self.ops[2].pk, graph.chain)
+
+
+class OperationChainQueryTests(BaseAPITestCase):
+    def setUp(self):
+        self.ops = make_chain(self.order, 5)
+
+    def test_descendants_and_ancestors_in_one_query(self):
+        with self.assertNumQueries(1):
+            descendants = set(Operation.objects.descendants_of(self.ops[1].pk).values_list('pk', flat=True))
+        self.assertEqual(descendants, {op.pk for op in self.ops[2:]})
+        with self.assertNumQueries(1):
+            ancestors = set(Operation.objects.ancestors_of([self.ops[3].pk]).values_list('pk', flat=True))
+        self.assertEqual(ancestors, {op.pk for op in self.ops[:3]})
+        self.assertFalse(Operation.objects.descendants_of([]).exists())
+
+    def test_api_checks_cycle_once(self):
+        client = APIClient()
+        client.force_authenticate(self.technolog)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.patch(
+                f'/api/v1/operation/{self.ops[3].pk}/',
+                {'previous_operation': self.ops[0].pk},
+                format='json',
+            )
+        self.assertEqual(response.status_code, 200)
+        sql = [query['sql'] for query in queries.captured_queries]
+        self.assertEqual(sum('WITH RECURSIVE' in query for query in sql), 1)
+        self.assertEqual(Operation.objects.get(pk=self.ops[3].pk).previous_operation_id, self.ops[0].pk)
+        # Цепочки заблокированы до проверки цикла, проверка и запись - в одной транзакции
+        if connection.features.has_select_for_update:
+            check = next(i for i, query in enumerate(sql) if 'WITH RECURSIVE' in query)
+            self.assertTrue(any('FOR UPDATE' in query for query in sql[:check]))
+            self.assertTrue(any(query.startswith('UPDATE "api_operation"') for query in sql[check:]))
+
+    def test_long_cycle_is_rejected(self):
+        first = self.ops[0]
+        first.previous_operation = self.ops[4]
+        with self.assertRaises(ValidationError):
+            first.save()
+        self.assertIsNone(Operation.objects.get(pk=first.pk).previous_operation_id)
+
+    def test_self_reference_is_dropped(self):
+        op = self.ops[2]
+        op.previous_operation = op
+        op.save()
+        self.assertIsNone(Operation.objects.get(pk=op.pk).previous_operation_id)
+
+    def test_api_rejects_cycle(self):
+        client = APIClient()
+        client.force_authenticate(self.technolog)
+        response = client.patch(
+            f'/api/v1/operation/{self.ops[1].pk}/',
+            {'previous_operation': self.ops[3].pk},
+            format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('previous_operation', response.json())
+
+
+class SortOperationsChainTests(SimpleTestCase):
+    base = timezone.now()
+
+    def node(self, op_id, parent=None, hours=0):
+        return SimpleNamespace(
+            id=op_id, previous_operation_id=parent,
+            planned_start=self.base + timedelta(hours=hours),
+        )
+
+    def test_long_linear_chain_has_no_recursion_limit(self):
+        ops = [self.node(i, i - 1 or None) for i in range(1, 20001)]
+        random.shuffle(ops)
+        self.assertEqual([op.id for op in sort_operations_chain(ops)], list(range(1, 20001)))
+
+    def test_ties_and_orphans_are_deterministic(self):
+        ops = [self.node(3), self.node(2, parent=99), self.node(1), self.node(4, parent=1)]
+        self.assertEqual([op.id for op in sort_operations_chain(ops)], [1, 4, 2, 3])
+        self.assertEqual([op.id for op in sort_operations_chain(reversed(ops))], [1, 4, 2, 3])
+
+    def test_cycle_is_broken_at_earliest_operation(self):
+        ops = [self.node(1, parent=3, hours=1), self.node(2, parent=1, hours=2),
+               self.node(3, parent=2, hours=3), self.node(4, hours=0)]
+        self.assertEqual([op.id for op in sort_operations_chain(ops)], [4, 1, 2, 3])
+
+    def test_many_chains_keep_parent_before_child(self):
+        # Время на 100k операций - manage.py benchmark_planning
+        ops = [
+            self.node(i, parent=(i - 1 if i % 50 else None), hours=i)
+            for i in range(1, 10001)
+        ]
+        random.shuffle(ops)
+        result = [op.id for op in sort_operations_chain(ops)]
+        self.assertEqual(result, list(range(1, 10001)))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Планы запросов проверяются на PostgreSQL")
+class HotQueryPlanTests(TransactionTestCase):
+    """
+    Горячие запросы идут по своим индексам. EXPLAIN получают те SQL, что
+    выполняют сами представления (и фильтр ежедневной команды). Объёмы как
+    в работающей базе: много коротких цепочек, большинство операций
+    завершено, открытых и неначатых - несколько процентов. Таблицы после
+    VACUUM, как у работающей базы: частичным индексам нужна карта
+    видимости, а VACUUM не выполняется внутри транзакции TestCase.
+    """
+    ORDERS = 500
+    PER_ORDER = 20
+
+    def setUp(self):
+        self.technolog = CustomUser.objects.create_user('tech', password='pass', role='technolog')
+        master = CustomUser.objects.create_user('master', password='pass', role='master')
+        start = timezone.now().replace(microsecond=0) - timedelta(days=400)
+        orders = Order.objects.bulk_create([
+            Order(name=f"Заказ {i}", deadline=timezone.now() + timedelta(days=30), created_by=self.technolog)
+            for i in range(self.ORDERS)
+        ])
+        # Операции вставляются заказ за заказом и сразу со ссылкой на
+        # родителя: id назначены заранее. Без bulk_update частичные индексы
+        # не раздуваются пустыми страницами, и размер индексов как у базы,
+        # которую наполняли обычной работой
+        next_id = (Operation.objects.aggregate(last=Max('pk'))['last'] or 0) + 1
+        operations = []
+        for i, order in enumerate(orders):
+            order_start = start + timedelta(hours=18 * i)
+            # Последние заказы ещё не начаты, в остальных открыт только хвост цепочки
+            done = 0 if i >= self.ORDERS - 5 else self.PER_ORDER - 2
+            for k in range(self.PER_ORDER):
+                op_start = order_start + timedelta(hours=k)
+                operations.append(Operation(
+                    pk=next_id, order=order, name=f"Операция {k}",
+                    previous_operation_id=next_id - 1 if k else None,
+                    planned_start=op_start, planned_end=op_start + timedelta(hours=1),
+                    predict_start=op_start, predict_end=op_start + timedelta(hours=1),
+                    actual_start=op_start if k < done else None,
+                    actual_end=op_start + timedelta(hours=1) if k < done else None,
+                ))
+                next_id += 1
+        Operation.objects.bulk_create(operations, batch_size=1000)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Operation]):
+                cursor.execute(sql)
+
+        executors = Executor.objects.bulk_create([Executor(full_name=f"Исполнитель {i}") for i in range(5)])
+        through = Operation.executors.through
+        through.objects.bulk_create([
+            through(operation_id=op.pk, executor_id=executors[i % len(executors)].pk)
+            for i, op in enumerate(operations)
+        ], batch_size=1000)
+        TehLog.objects.bulk_create([
+            TehLog(master=master, info="лог", type=TehLog.LogType.LATE_START, operation=op)
+            for op in operations
+        ], batch_size=1000)
+        with connection.cursor() as cursor:
+            cursor.execute("VACUUM ANALYZE")
+
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+
+    def view_plan(self, path, params, marker):
+        """План SQL, который представление выполнило при GET, - первого запроса с marker."""
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(path, params).status_code, 200)
+        sql = next(query['sql'] for query in queries.captured_queries if marker in query['sql'])
+        with connection.cursor() as cursor:
+            cursor.execute(f"EXPLAIN {sql}")
+            return "\n".join(row[0] for row in cursor.fetchall())
+
+    def index_family(self, *names):
+        """Индексы и их копии на секциях секционированной таблицы."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT relid::regclass::text FROM unnest(%s::text[]) name, pg_partition_tree(name::regclass)",
+                [list(names)],
+            )
+            return set(names) | {row[0] for row in cursor.fetchall()}
+
+    def order_id_indexes(self):
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = 'api_operation' AND indexdef ~ %s",
+                [r'\(order_id[,)]'],
+            )
+            return {row[0] for row in cursor.fetchall()}
+
+    def hot_queries(self):
+        day_start = timezone.now() - timedelta(days=1)
+        order_id = Order.objects.values_list('pk', flat=True).last()
+        return {
+            'operation list': (
+                self.view_plan('/api/v1/operation/', {}, 'FROM "api_operation"'),
+                {'operation_predict_idx'},
+            ),
+            # Цепочка заказа сортируется в памяти - подходит любой индекс по order_id
+            'operations by order': (
+                self.view_plan(f'/api/v1/operation/by_order/{order_id}/', {}, 'FROM "api_operation"'),
+                self.order_id_indexes(),
+            ),
+            'open operations of executors': (
+                self.view_plan(
+                    '/api/v1/executors/aggregated/', {'active_only': 'true'}, '_prefetch_related_val_executor_id',
+                ),
+                {'operation_open_idx'},
+            ),
+            'unstarted roots': (overdue_root_orders(day_start).explain(), {'operation_unstarted_root_idx'}),
+            'order list': (
+                self.view_plan('/api/v1/order/', {}, 'FROM "api_order" ORDER BY'),
+                {'order_created_idx'},
+            ),
+            'latest logs': (
+                self.view_plan('/api/v1/logs/', {'limit': 5}, 'FROM "api_tehlog"'),
+                self.index_family('tehlog_logged_idx'),
+            ),
+        }
+
+    def test_hot_queries_use_indexes(self):
+        for name, (plan, indexes) in self.hot_queries().items():
+            with self.subTest(name):
+                used = set(re.findall(r'(?:Scan using|Index Scan on) (\S+)', plan))
+                self.assertTrue(used & indexes, f"{name}: ожидался один из {sorted(indexes)}\n{plan}")
+
+
+class KeysetPaginationTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        ops = make_chain(self.order, 3)
+        TehLog.objects.bulk_create([
+            TehLog(master=self.master, info=f"лог {i}", type=TehLog.LogType.LATE_START, operation=ops[i % 3])
+            for i in range(12)
+        ])
+
+    def test_logs_are_paginated_by_cursor_without_count(self):
+        with self.assertNumQueries(1):
+            first = self.client.get('/api/v1/logs/?limit=5').json()
+        self.assertNotIn('count', first)
+        self.assertEqual(len(first['results']), 5)
+
+        ids = [log['id'] for log in first['results']]
+        page = first
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            ids.extend(log['id'] for log in page['results'])
+
+        expected = list(TehLog.objects.order_by('-logged_at', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+    def test_operation_list_is_cursor_paginated(self):
+        response = self.client.get('/api/v1/operation/?page_size=2').json()
+        self.assertEqual(len(response['results']), 2)
+        self.assertIsNotNone(response['next'])
+        self.assertIsNone(response['previous'])
+
+    def test_ordering_outside_cursor_columns_is_rejected(self):
+        for path, ordering in (
+            ('/api/v1/operation/', 'assembly_shop_name'),
+            ('/api/v1/operation/', 'assembly_shop__name'),
+            ('/api/v1/operation/', 'order'),
+            ('/api/v1/order/', 'created_by'),
+            ('/api/v1/executors/aggregated/', '-workshop'),
+        ):
+            with self.subTest(path=path, ordering=ordering):
+                response = self.client.get(path, {'ordering': ordering})
+                self.assertEqual(response.status_code, 400)
+                self.assertIn('ordering', response.json())
+
+    def test_descending_ordering_pages_through_ties_by_id(self):
+        # Вторая цепочка с тем же началом: равные predict_start
+        start = Operation.objects.order_by('predict_start').first().predict_start
+        make_chain(self.order, 3, start=start)
+        page = self.client.get('/api/v1/operation/', {'ordering': '-predict_start', 'page_size': 2}).json()
+        ids = [op['id'] for op in page['results']]
+        while page['next']:
+            page = self.client.get(page['next']).json()
+            ids.extend(op['id'] for op in page['results'])
+
+        expected = list(Operation.objects.order_by('-predict_start', '-id').values_list('id', flat=True))
+        self.assertEqual(ids, expected)
+
+
+class TehLogSearchTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        ops = make_chain(self.order, 2)
+        ops[1].name = "Сварка корпуса"
+        ops[1].save()
+        self.late = TehLog.objects.create(
+            master=self.master, operation=ops[0], type=TehLog.LogType.LATE_START, info="Начата позже плана",
+        )
+        self.weld = TehLog.objects.create(
+            master=self.master, operation=ops[1], type=TehLog.LogType.AHEAD_STOP, info="Завершена раньше плана",
+        )
+
+    def search(self, text):
+        response = self.client.get('/api/v1/logs/', {'search': text})
+        self.assertEqual(response.status_code, 200)
+        return [log['id'] for log in response.json()['results']]
+
+    def test_search_text_is_filled_on_insert(self):
+        self.assertIn("сварка корпуса", self.weld.search_text)
+        self.assertIn("заказ", self.weld.search_text)
+        self.assertIn("master", self.weld.search_text)
+
+    def test_search_by_partial_word_across_related_names(self):
+        self.assertEqual(self.search("СВАР"), [self.weld.pk])
+        self.assertEqual(self.search("позже"), [self.late.pk])
+        self.assertEqual(set(self.search("master заказ")), {self.late.pk, self.weld.pk})
+        self.assertEqual(self.search("нет такого"), [])
+
+
+class ExecutorAggregationTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.shop = AssemblyShop.objects.create(name="Цех")
+        self.executors = [Executor.objects.create(full_name=f"Исполнитель {i}") for i in range(3)]
+        self.executors[0].assembly_shops.add(self.shop)
+
+        now = timezone.now()
+        old = make_chain(self.order, 3, start=now - timedelta(days=90))
+        recent = make_chain(self.order, 3, start=now - timedelta(hours=12))
+        for op in old:
+            op.actual_start, op.actual_end = op.planned_start, op.planned_end
+            op.save(update_fields=['actual_start', 'actual_end'])
+        for op in old + recent:
+            op.executors.set(self.executors)
+        self.recent = recent
+
+    def test_default_window_hides_old_history(self):
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/v1/executors/aggregated/', {'active_only': 'false'})
+        results = response.json()['results']
+        self.assertEqual(len(results), 3)
+        first = results[0]
+        self.assertEqual(first['total_tasks'], 3)
+        self.assertEqual(first['active_tasks_count'], 3)
+        self.assertEqual([task['id'] for task in first['tasks']], [op.pk for op in self.recent])
+
+    def test_default_window_keeps_old_unfinished_tasks(self):
+        overdue = make_chain(self.order, 1, start=timezone.now() - timedelta(days=60))[0]
+        overdue.actual_start = overdue.planned_start
+        overdue.save(update_fields=['actual_start'])
+        overdue.executors.set(self.executors[:1])
+        response = self.client.get('/api/v1/executors/aggregated/', {'active_only': 'false'})
+        first = response.json()['results'][0]
+        self.assertEqual(first['total_tasks'], 4)
+        self.assertEqual(first['active_tasks_count'], 4)
+        self.assertIn(overdue.pk, [task['id'] for task in first['tasks']])
+
+    def test_explicit_window_workshop_and_pagination(self):
+        date_from = (timezone.now() - timedelta(days=100)).isoformat()
+        response = self.client.get('/api/v1/executors/aggregated/', {
+            'from': date_from, 'workshop': self.shop.pk,
+        })
+        results = response.json()['results']
+        self.assertEqual([row['id'] for row in results], [self.executors[0].pk])
+        self.assertEqual(results[0]['total_tasks'], 6)
+        self.assertEqual(len(results[0]['tasks']), 6)
+
+        response = self.client.get('/api/v1/executors/aggregated/', {'page_size': 2})
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertIsNotNone(response.json()['next'])
+
+    def test_invalid_window_is_rejected(self):
+        response = self.client.get('/api/v1/executors/aggregated/', {'from': 'вчера'})
+        self.assertEqual(response.status_code, 400)
+
+
+class GanttAPITests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.shop = AssemblyShop.objects.create(name="Цех")
+        self.now = timezone.now().replace(microsecond=0)
+        self.past = make_chain(self.order, 2, start=self.now - timedelta(days=60))
+        self.current = make_chain(self.order, 3, start=self.now)
+        self.current[0].assembly_shop = self.shop
+        self.current[0].master = self.master
+        self.current[0].save()
+
+    def get(self, **params):
+        params.setdefault('from', (self.now - timedelta(days=1)).isoformat())
+        params.setdefault('to', (self.now + timedelta(days=1)).isoformat())
+        return self.client.get('/api/v1/operation/gantt/', params)
+
+    def test_columnar_payload_for_window(self):
+        with self.assertNumQueries(1):
+            data = self.get().json()
+        columns = data['columns']
+        self.assertEqual(data['count'], 3)
+        self.assertEqual(columns['id'], [op.pk for op in self.current])
+        self.assertEqual(columns['planned_start'][0], int(self.current[0].planned_start.timestamp()))
+        self.assertEqual(columns['actual_start'], [None, None, None])
+        self.assertEqual(columns['previous_operation'][1], self.current[0].pk)
+        self.assertEqual(data['orders'], {str(self.order.pk): self.order.name})
+        self.assertEqual(data['shops'], {str(self.shop.pk): "Цех"})
+        self.assertEqual(data['masters'], {str(self.master.pk): "master"})
+
+    def test_shop_filter_and_required_window(self):
+        data = self.get(shop=self.shop.pk).json()
+        self.assertEqual(data['columns']['id'], [self.current[0].pk])
+        self.assertEqual(self.client.get('/api/v1/operation/gantt/').status_code, 400)
+
+
+class LiveEventTests(BaseAPITestCase):
+    def setUp(self):
+        self.ops = make_chain(self.order, 3)
+
+    def tearDown(self):
+        if hub._task is not None:
+            hub._task.cancel()
+        hub._task = None
+
+    def test_end_publishes_operation_and_forecast_events(self):
+        client = APIClient()
+        client.force_authenticate(self.master)
+        op = self.ops[0]
+        op.actual_start = timezone.now()
+        op.predict_end = op.actual_start + timedelta(hours=5)
+        op.save(update_fields=['actual_start', 'predict_end'])
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = client.patch(f'/api/v1/operation/{op.pk}/end/')
+        self.assertEqual(response.status_code, 200)
+
+        kinds = list(LiveEvent.objects.order_by('pk').values_list('kind', flat=True))
+        self.assertIn(LiveEvent.Kind.OPERATION_ENDED, kinds)
+        ended = LiveEvent.objects.get(kind=LiveEvent.Kind.OPERATION_ENDED)
+        self.assertEqual(ended.payload['id'], op.pk)
+        self.assertEqual(ended.payload['status'], 'completed')
+
+    def test_nothing_is_published_before_commit(self):
+        with self.captureOnCommitCallbacks(execute=False) as callbacks:
+            TehLog.objects.create(
+                master=self.master, operation=self.ops[0], info="лог", type=TehLog.LogType.LATE_START,
+            )
+        self.assertFalse(LiveEvent.objects.exists())
+        self.assertEqual(len(callbacks), 1)
+
+    async def test_stream_replays_after_last_event_id(self):
+        first = await LiveEvent.objects.acreate(kind=LiveEvent.Kind.OPERATION_STARTED, payload={'id': 1})
+        second = await LiveEvent.objects.acreate(kind=LiveEvent.Kind.OPERATION_ENDED, payload={'id': 1})
+        ticket = await sync_to_async(self.ticket)(self.technolog)
+
+        response = await self.async_client.get(
+            '/api/v1/events/stream/', {'ticket': ticket}, headers={'Last-Event-ID': str(first.pk)},
+        )
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        content = response.streaming_content
+        self.assertEqual(await anext(content), b"retry: 3000\n\n")
+        chunk = (await anext(content)).decode()
+        self.assertTrue(chunk.startswith(f"id: {second.pk}\nevent: operation.ended\n"))
+        await content.aclose()
+
+    async def test_stream_requires_authentication(self):
+        response = await self.async_client.get('/api/v1/events/stream/')
+        self.assertEqual(response.status_code, 401)
+
+    def ticket(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post('/api/v1/events/ticket/').json()['ticket']
+
+    async def test_ticket_is_single_use_and_token_is_not_accepted_in_url(self):
+        ticket = await sync_to_async(self.ticket)(self.technolog)
+        response = await self.async_client.get('/api/v1/events/stream/', {'ticket': ticket})
+        self.assertEqual(response.status_code, 200)
+        await response.streaming_content.aclose()
+        response = await self.async_client.get('/api/v1/events/stream/', {'ticket': ticket})
+        self.assertEqual(response.status_code, 401)
+
+        token = str(AccessToken.for_user(self.technolog))
+        response = await self.async_client.get('/api/v1/events/stream/', {'token': token})
+        self.assertEqual(response.status_code, 401)
+
+    def test_cursor_waits_for_late_commit_behind_gap(self):
+        first = LiveEvent.objects.create(kind=LiveEvent.Kind.OPERATION_STARTED, payload={'id': 1})
+        late = LiveEvent.objects.create(kind=LiveEvent.Kind.OPERATION_ENDED, payload={'id': 1})
+        third = LiveEvent.objects.create(kind=LiveEvent.Kind.OPERATION_STARTED, payload={'id': 2})
+        # late ещё не закоммичен: его id выдан, но строки не видно
+        late_row = LiveEvent.objects.filter(pk=late.pk)
+        late_row.delete()
+        self.assertEqual([event.pk for event in events_after(first.pk - 1)], [first.pk])
+
+        late.save(force_insert=True)
+        self.assertEqual([event.pk for event in events_after(first.pk)], [late.pk, third.pk])
+
+        # Дыра, которая так и не заполнилась, пропускается по таймауту
+        late_row.delete()
+        LiveEvent.objects.filter(pk=third.pk).update(created_at=timezone.now() - timedelta(minutes=1))
+        self.assertEqual([event.pk for event in events_after(first.pk)], [third.pk])
+
+
+class ConditionalGetTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.ops = make_chain(self.order, 3)
+
+    def assert_not_modified(self, url, queries=2):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        # Только состояние и версии справочников, без сериализации
+        with self.assertNumQueries(queries):
+            cached = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(cached.status_code, 304)
+        return etag
+
+    def test_order_detail_and_by_order_return_304(self):
+        for url in (f'/api/v1/order/{self.order.pk}/', f'/api/v1/operation/by_order/{self.order.pk}/'):
+            with self.subTest(url):
+                self.assert_not_modified(url)
+
+    def test_by_order_reads_order_state_once(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'/api/v1/operation/by_order/{self.order.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        # graph_version ответа берётся из запроса состояния для ETag
+        order_queries = [query['sql'] for query in queries.captured_queries if 'FROM "api_order"' in query['sql']]
+        self.assertEqual(len(order_queries), 1)
+
+    def test_etag_changes_on_forecast_and_delete(self):
+        url = f'/api/v1/order/{self.order.pk}/'
+        etag = self.assert_not_modified(url)
+
+        root = self.ops[0]
+        root.predict_end = root.predict_end + timedelta(hours=1)
+        root.save(update_fields=['predict_end', 'updated_at'])
+        recalculate_predict_chains([root])
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        etag = response['ETag']
+        self.ops[2].delete()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_order_list_returns_304(self):
+        etag = self.assert_not_modified('/api/v1/order/', queries=3)
+        Order.objects.create(name="Новый", deadline=self.order.deadline, created_by=self.technolog)
+        self.assertEqual(self.client.get('/api/v1/order/', HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_etag_changes_on_workshop_and_master_rename(self):
+        shop = AssemblyShop.objects.create(name="Цех")
+        self.ops[0].assembly_shop = shop
+        self.ops[0].save()
+        for url in (f'/api/v1/order/{self.order.pk}/', '/api/v1/order/'):
+            for rename in (shop, self.master):
+                with self.subTest(url=url, rename=rename):
+                    etag = self.client.get(url)['ETag']
+                    with self.captureOnCommitCallbacks(execute=True):
+                        if rename is shop:
+                            shop.name += " новый"
+                        else:
+                            rename.username += "-new"
+                        rename.save()
+                    self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_if_modified_since(self):
+        url = f'/api/v1/order/{self.order.pk}/'
+        last_modified = self.client.get(url)['Last-Modified']
+        self.assertEqual(self.client.get(url, HTTP_IF_MODIFIED_SINCE=last_modified).status_code, 304)
+
+
+class ReferenceCacheTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.shop = AssemblyShop.objects.create(name="Цех 1")
+        self.executor = Executor.objects.create(full_name="Иванов")
+        self.executor.assembly_shops.add(self.shop)
+
+    def get(self, url):
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response
+
+    def test_hit_is_single_cache_query(self):
+        for url in ('/api/v1/workshops/', '/api/v1/executors/', '/api/v1/masters/',
+                    f'/api/v1/executors/by-workshop/{self.shop.pk}/'):
+            with self.subTest(url):
+                miss = self.get(url)
+                self.assertEqual(miss['X-Cache'], 'MISS')
+                with self.assertNumQueries(1):
+                    hit = self.get(url)
+                self.assertEqual(hit['X-Cache'], 'HIT')
+                self.assertEqual(hit.json(), miss.json())
+
+    def test_invalidated_on_save_delete_and_m2m(self):
+        url = f'/api/v1/executors/by-workshop/{self.shop.pk}/'
+        self.get(url)
+        other = Executor.objects.create(full_name="Петров")
+        with self.captureOnCommitCallbacks(execute=True):
+            other.assembly_shops.add(self.shop)
+        response = self.get(url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(len(response.json()), 2)
+
+        self.get('/api/v1/workshops/')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.shop.delete()
+        self.assertEqual(self.get('/api/v1/workshops/')['X-Cache'], 'MISS')
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+        self.get('/api/v1/masters/')
+        with self.captureOnCommitCallbacks(execute=True):
+            CustomUser.objects.create_user('master2', password='pass', role='master')
+        response = self.get('/api/v1/masters/')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.json()['count'], 2)
+
+    def test_stats(self):
+        before = self.get('/api/v1/reference-cache/stats/').json()['workshops']
+        self.get('/api/v1/workshops/')
+        self.get('/api/v1/workshops/')
+        after = self.get('/api/v1/reference-cache/stats/').json()['workshops']
+        self.assertEqual(after['hits'] - before['hits'], 1)
+        self.assertEqual(after['misses'] - before['misses'], 1)
+        self.assertIsNotNone(after['version'])
+
+    def test_stats_from_workers_add_up(self):
+        workers = [CacheStats(), CacheStats()]
+        for worker in workers:
+            worker.record('workshops', 'hits')
+            worker.record('workshops', 'hits')
+        totals = [worker.snapshot()['workshops']['hits'] for worker in workers]
+        self.assertEqual(totals, [2, 4])
+        self.assertEqual(ReferenceCacheCounter.objects.get(namespace='workshops', name='hits').count, 4)
+
+
+class ReadSerializerTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        shop = AssemblyShop.objects.create(name="Цех")
+        executors = [Executor.objects.create(full_name=f"Исполнитель {i}") for i in range(3)]
+        self.ops = make_chain(self.order, 4)
+        branch = Operation.objects.create(
+            order=self.order, name="Ветка", previous_operation=self.ops[0], description="Описание",
+            planned_start=self.ops[0].planned_end, planned_end=self.ops[0].planned_end + timedelta(minutes=95),
+        )
+        self.ops[0].assembly_shop = shop
+        self.ops[0].actual_start = self.ops[0].planned_start
+        self.ops[0].actual_end = self.ops[0].planned_end
+        self.ops[0].save()
+        self.ops[1].master = None
+        self.ops[1].actual_start = self.ops[1].planned_start
+        self.ops[1].save()
+        # Исполнители добавлены не по порядку id
+        branch.executors.add(executors[2])
+        branch.executors.add(executors[0], executors[1])
+        other = Order.objects.create(name="Другой", deadline=self.order.deadline, created_by=self.technolog)
+        make_chain(other, 2)
+
+    def assert_same_bytes(self, view, url):
+        fast = self.client.get(url)
+        with mock.patch.object(view, 'read_serializer_class', None):
+            slow = self.client.get(url)
+        self.assertEqual(fast.status_code, 200)
+        self.assertEqual(fast.content, slow.content)
+
+    def test_output_is_byte_identical(self):
+        from api.views.operation_views import OperationAPIGetByOrder, OperationListCreateAPIView
+        from api.views.order_views import OrderListCreateAPIView
+
+        self.assert_same_bytes(OperationListCreateAPIView, '/api/v1/operation/?page_size=3')
+        self.assert_same_bytes(OperationListCreateAPIView, '/api/v1/operation/')
+        self.assert_same_bytes(OperationAPIGetByOrder, f'/api/v1/operation/by_order/{self.order.pk}/')
+        self.assert_same_bytes(OrderListCreateAPIView, '/api/v1/order/')
+
+    def test_benchmark_command(self):
+        count = Operation.objects.count()
+        out = StringIO()
+        call_command('benchmark_read_serializers', operations=120, per_order=30, repeat=1, stdout=out)
+        self.assertIn("быстрый путь", out.getvalue())
+        # Данные бенчмарка откатываются
+        self.assertEqual(Operation.objects.count(), count)
+
+
+class OrderBulkSaveTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.shop = AssemblyShop.objects.create(name="Цех")
+        self.executors = [Executor.objects.create(full_name=f"Исполнитель {i}") for i in range(3)]
+        self.start = timezone.now().replace(microsecond=0)
+
+    def item(self, ref, index, previous=None, **extra):
+        start = self.start + timedelta(hours=index)
+        return {
+            'id': ref, 'name': f"Операция {index}", 'previous_operation': previous,
+            'planned_start': start.isoformat(), 'planned_end': (start + timedelta(hours=1)).isoformat(),
+            **extra,
+        }
+
+    def payload(self, operations, **extra):
+        return {
+            'name': "Пакетный заказ", 'deadline': (self.start + timedelta(days=30)).isoformat(),
+            'default_master': self.master.pk, 'operations': operations, **extra,
+        }
+
+    def test_create_200_operations_in_few_queries(self):
+        operations = [
+            self.item(f'tmp-{i}', i, f'tmp-{i - 1}' if i else None,
+                      assembly_shop=self.shop.pk, executors=[self.executors[i % 3].pk])
+            for i in range(200)
+        ]
+        # Последнюю операцию сдвигаем: прогноз всё равно идёт от родителя
+        operations[-1]['planned_start'] = (self.start + timedelta(days=10)).isoformat()
+        operations[-1]['planned_end'] = (self.start + timedelta(days=10, hours=2)).isoformat()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/v1/order/bulk/', self.payload(operations), format='json')
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertLess(len(queries), 25)
+
+        ids = response.data['ids']
+        self.assertEqual(len(ids), 200)
+        order_data = response.data['order']
+        self.assertEqual([op['id'] for op in order_data['operations']], [ids[f'tmp-{i}'] for i in range(200)])
+
+        last = Operation.objects.get(pk=ids['tmp-199'])
+        parent = Operation.objects.get(pk=ids['tmp-198'])
+        self.assertEqual(last.previous_operation_id, parent.pk)
+        self.assertEqual(last.predict_start, parent.predict_end)
+        self.assertEqual(last.predict_end, parent.predict_end + timedelta(hours=2))
+        self.assertEqual(last.master_id, self.master.pk)
+        self.assertEqual(list(last.executors.values_list('pk', flat=True)), [self.executors[199 % 3].pk])
+
+    def test_update_relinks_deletes_and_updates_executors(self):
+        ops = make_chain(self.order, 3)
+        ops[1].executors.add(self.executors[0])
+        version = Order.objects.get(pk=self.order.pk).graph_version
+
+        operations = [
+            self.item(ops[0].pk, 0),
+            self.item('new', 1, ops[0].pk, executors=[self.executors[1].pk]),
+            self.item(ops[1].pk, 2, 'new', executors=[self.executors[0].pk, self.executors[2].pk]),
+        ]
+        response = self.client.put(f'/api/v1/order/{self.order.pk}/bulk/', self.payload(operations), format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+
+        self.assertFalse(Operation.objects.filter(pk=ops[2].pk).exists())
+        new = Operation.objects.get(pk=response.data['ids']['new'])
+        ops[1].refresh_from_db()
+        self.assertEqual(new.previous_operation_id, ops[0].pk)
+        self.assertEqual(ops[1].previous_operation_id, new.pk)
+        self.assertEqual(ops[1].predict_start, new.predict_end)
+        self.assertEqual(
+            set(ops[1].executors.values_list('pk', flat=True)),
+            {self.executors[0].pk, self.executors[2].pk},
+        )
+        self.assertNotEqual(Order.objects.get(pk=self.order.pk).graph_version, version)
+        self.assertEqual(
+            [op['id'] for op in response.data['order']['operations']],
+            [ops[0].pk, new.pk, ops[1].pk],
+        )
+
+    def test_rejects_cycles_and_foreign_operations(self):
+        cycle = [self.item('a', 0, 'b'), self.item('b', 1, 'a')]
+        response = self.client.post('/api/v1/order/bulk/', self.payload(cycle), format='json')
+        self.assertEqual(response.status_code, 400)
+
+        other = Order.objects.create(name="Чужой", deadline=self.order.deadline, created_by=self.technolog)
+        foreign = make_chain(other, 1)[0]
+        count = Operation.objects.count()
+        response = self.client.put(
+            f'/api/v1/order/{self.order.pk}/bulk/', self.payload([self.item(foreign.pk, 0)]), format='json',
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(Operation.objects.count(), count)
+        self.assertEqual(Order.objects.get(pk=self.order.pk).name, "Заказ")
+
+    def test_wrong_method_for_url_is_405(self):
+        payload = self.payload([self.item('a', 0)])
+        response = self.client.post(f'/api/v1/order/{self.order.pk}/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 405)
+        response = self.client.put('/api/v1/order/bulk/', payload, format='json')
+        self.assertEqual(response.status_code, 405)
+
+    def test_removed_operations_bump_graph_once(self):
+        ops = make_chain(self.order, 6)
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.put(
+                f'/api/v1/order/{self.order.pk}/bulk/', self.payload([self.item(ops[0].pk, 0)]), format='json',
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(Operation.objects.filter(order=self.order).count(), 1)
+        # bump_graph_version обновляет только graph_version и updated_at
+        bumps = [query for query in queries.captured_queries if 'SET "graph_version"' in query['sql']]
+        self.assertEqual(len(bumps), 1)
+
+
+class OperationBatchActionTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.master)
+        self.shop = AssemblyShop.objects.create(name="Цех")
+        self.executors = [Executor.objects.create(full_name=f"Исполнитель {i}") for i in range(2)]
+
+    def start_items(self, ops):
+        return {'operations': [
+            {'id': op.pk, 'assembly_shop_id': self.shop.pk, 'executor_ids': [e.pk for e in self.executors]}
+            for op in ops
+        ]}
+
+    def test_start_and_end_many_operations(self):
+        ops = make_chain(self.order, 4)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch('/api/v1/operation/batch/start/', self.start_items(ops[:2]), format='json')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual([op['id'] for op in response.json()], [ops[0].pk, ops[1].pk])
+        self.assertTrue(all(op['status'] == 'in_progress' for op in response.json()))
+
+        # Потомков пересчитывает воркер очереди прогнозов - от второй стартовавшей операции
+        self.assertEqual(ForecastQueue.objects.count(), 2)
+        drain_forecast_queue()
+        ops[1].refresh_from_db()
+        ops[2].refresh_from_db()
+        self.assertEqual(ops[2].predict_start, ops[1].predict_end)
+        self.assertEqual(set(ops[1].executors.values_list('pk', flat=True)), {e.pk for e in self.executors})
+
+        # Логи уходят в очередь и создаются воркером
+        self.assertFalse(TehLog.objects.exists())
+        self.assertEqual(TehLogOutbox.objects.count(), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            drain_outbox()
+        logs = TehLog.objects.filter(operation__in=ops[:2])
+        self.assertEqual(logs.count(), 2)
+        self.assertTrue(all(log.search_text for log in logs))
+        kinds = list(LiveEvent.objects.values_list('kind', flat=True))
+        self.assertEqual(kinds.count(LiveEvent.Kind.OPERATION_STARTED), 2)
+        self.assertEqual(kinds.count(LiveEvent.Kind.LOG_CREATED), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                '/api/v1/operation/batch/end/', {'operations': [ops[0].pk, ops[1].pk]}, format='json',
+            )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertTrue(all(op['status'] == 'completed' for op in response.json()))
+        drain_outbox()
+        self.assertEqual(TehLog.objects.count(), 4)
+
+    def test_query_count_does_not_depend_on_batch_size(self):
+        def count_queries(size):
+            order = Order.objects.create(
+                name=f"Заказ {size}", deadline=self.order.deadline,
+                created_by=self.technolog, default_master=self.master,
+            )
+            roots = [make_chain(order, 2)[0] for _ in range(size)]
+            get_operation_graph(order.pk, Order.objects.get(pk=order.pk).graph_version)
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.patch('/api/v1/operation/batch/start/', self.start_items(roots), format='json')
+            self.assertEqual(response.status_code, 200, response.content)
+            return len(queries)
+
+        self.assertEqual(count_queries(2), count_queries(8))
+
+    def test_all_or_nothing(self):
+        ops = make_chain(self.order, 2)
+        foreign = make_chain(self.order, 1)[0]
+        foreign.master = self.technolog
+        foreign.save()
+        response = self.client.patch('/api/v1/operation/batch/start/', self.start_items([ops[0], foreign]), format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Operation.objects.filter(actual_start__isnull=False).exists())
+
+        response = self.client.patch('/api/v1/operation/batch/end/', {'operations': [ops[0].pk]}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(TehLog.objects.exists())
+
+
+class TehLogOutboxTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.master)
+        self.shop = AssemblyShop.objects.create(name="Цех")
+        self.executor = Executor.objects.create(full_name="Исполнитель")
+        self.op = make_chain(self.order, 1)[0]
+
+    def test_start_and_end_enqueue_and_worker_drains(self):
+        response = self.client.patch(
+            f'/api/v1/operation/{self.op.pk}/start/',
+            {'assembly_shop_id': self.shop.pk, 'executor_ids': [self.executor.pk]}, format='json',
+        )
+        self.assertEqual(response.status_code, 200)
+        response = self.client.patch(f'/api/v1/operation/{self.op.pk}/end/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(TehLogOutbox.objects.count(), 2)
+
+        out = StringIO()
+        call_command('drain_tehlog_outbox', once=True, batch_size=1, stdout=out)
+        self.assertIn("2", out.getvalue())
+        self.assertFalse(TehLogOutbox.objects.exists())
+        types = set(TehLog.objects.values_list('type', flat=True))
+        self.assertEqual(len(types), 2)
+        self.assertTrue(TehLog.objects.filter(info__contains="начата").exists())
+        self.assertTrue(TehLog.objects.filter(info__contains="завершена").exists())
+
+    def test_redelivery_is_idempotent(self):
+        self.op.actual_start = timezone.now()
+        self.op.save()
+        entry = TehLogOutbox.objects.create(
+            kind=TehLogOutbox.Kind.START, operation=self.op, master=self.master,
+            actual_at=self.op.actual_start, planned_at=self.op.planned_start,
+        )
+        self.assertEqual(drain_outbox(), 1)
+        # Та же запись пришла повторно (например, воркер упал после вставки)
+        entry.pk = None
+        entry.save()
+        self.assertEqual(drain_outbox(), 1)
+        self.assertEqual(TehLog.objects.count(), 1)
+        self.assertFalse(TehLogOutbox.objects.exists())
+
+
+class TehLogArchiveTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.op = make_chain(self.order, 1)[0]
+        now = timezone.now()
+        self.old = []
+        for days in (400, 300, 299):
+            log = TehLog.objects.create(
+                master=self.master, operation=self.op, type=TehLog.LogType.LATE_START, info=f"Лог {days}",
+            )
+            # logged_at - auto_now_add, старую дату ставим отдельным UPDATE
+            log.logged_at = now - timedelta(days=days)
+            TehLog.objects.filter(pk=log.pk).update(logged_at=log.logged_at)
+            self.old.append(log)
+        self.fresh = TehLog.objects.create(
+            master=self.master, operation=self.op, type=TehLog.LogType.AHEAD_STOP, info="Свежий лог",
+        )
+
+    def archive(self, **options):
+        out = StringIO()
+        call_command('archive_tehlogs', retention_days=180, dir=self.directory.name, stdout=out, **options)
+        return out.getvalue()
+
+    def test_old_logs_move_to_compressed_archive(self):
+        self.assertIn("Будет выгружено логов: 3", self.archive(dry_run=True))
+        self.assertEqual(TehLog.objects.count(), 4)
+
+        self.assertIn("Выгружено в архив логов: 3", self.archive())
+        self.assertEqual(list(TehLog.objects.values_list('pk', flat=True)), [self.fresh.pk])
+
+        records = []
+        for path in sorted(Path(self.directory.name).glob('tehlog-*.jsonl.gz')):
+            with gzip.open(path, 'rt', encoding='utf-8') as lines:
+                records += [json.loads(line) for line in lines]
+        self.assertEqual(sorted(record['id'] for record in records), sorted(log.pk for log in self.old))
+        self.assertEqual(records[0]['order_name'], self.order.name)
+        self.assertEqual(records[0]['master_name'], self.master.username)
+
+        # Повторный запуск ничего не находит
+        self.assertIn("Выгружено в архив логов: 0", self.archive())
+
+    @skipUnless(connection.vendor == 'postgresql', "Месячные секции есть только на PostgreSQL")
+    def test_dry_run_counts_partitioned_months_once(self):
+        with connection.cursor() as cursor:
+            for start in sorted({month_start(log.logged_at) for log in self.old}):
+                create_partition(cursor, start)
+        self.assertIn("Будет выгружено логов: 3", self.archive(dry_run=True))
+        self.assertIn("Выгружено в архив логов: 3", self.archive())
+        self.assertEqual(list(TehLog.objects.values_list('pk', flat=True)), [self.fresh.pk])
+
+    def test_archive_endpoint_reads_newest_first_with_cursor(self):
+        self.archive()
+        with override_settings(TEHLOG_ARCHIVE_DIR=Path(self.directory.name)):
+            response = self.client.get('/api/v1/logs/archive/', {'limit': 2})
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            self.assertEqual([log['id'] for log in body['results']], [self.old[2].pk, self.old[1].pk])
+            self.assertEqual(body['results'][0]['operation_name'], self.op.name)
+
+            body = self.client.get('/api/v1/logs/archive/', {'limit': 2, 'cursor': body['next']}).json()
+            self.assertEqual([log['id'] for log in body['results']], [self.old[0].pk])
+            self.assertIsNone(body['next'])
+
+            body = self.client.get('/api/v1/logs/archive/', {'search': "лог 300"}).json()
+            self.assertEqual([log['id'] for log in body['results']], [self.old[1].pk])
+
+            window = {'from': (timezone.now() - timedelta(days=350)).isoformat()}
+            body = self.client.get('/api/v1/logs/archive/', window).json()
+            self.assertEqual(len(body['results']), 2)
+
+            self.assertEqual(self.client.get('/api/v1/logs/archive/', {'cursor': 'x'}).status_code, 400)
+
+    def test_overlapping_files_are_merged(self):
+        start = timezone.now().replace(microsecond=0) - timedelta(days=400)
+        end = start + timedelta(days=30)
+
+        def rows(ids):
+            return [
+                (pk, start + timedelta(hours=pk), None, None, "лог", 0, None, None, None, None, "лог")
+                for pk in ids
+            ]
+
+        # Месяц и его дозапись с суффиксом -1 вперемешку по времени
+        write_archive(rows([1, 3, 5]), start, end, self.directory.name)
+        path, _ = write_archive(rows([2, 4, 6]), start, end, self.directory.name)
+        self.assertTrue(path.name.endswith('-1.jsonl.gz'))
+
+        ids, before = [], None
+        while True:
+            page = latest_archived_logs(2, before=before, directory=self.directory.name)
+            if not page:
+                break
+            ids += [record['id'] for record in page]
+            before = (page[-1]['logged_at'], page[-1]['id'])
+        self.assertEqual(ids, [6, 5, 4, 3, 2, 1])
+
+
+class ExportTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.ops = make_chain(self.order, 3)
+        self.executor = Executor.objects.create(full_name="Иванов И.И.")
+        self.ops[0].executors.add(self.executor)
+        TehLog.objects.create(master=self.master, operation=self.ops[0], type=TehLog.LogType.LATE_START, info="Поздно")
+
+    def download(self, url, **params):
+        response = self.client.get(url, params)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['X-Accel-Buffering'], 'no')
+        return b''.join(response.streaming_content)
+
+    def read_csv(self, content):
+        return list(csv.reader(io.StringIO(content.decode('utf-8-sig'))))
+
+    def test_operations_csv_with_names(self):
+        rows = self.read_csv(self.download('/api/v1/operation/export/csv/'))
+        self.assertEqual(rows[0][:3], ["ID", "ID заказа", "Заказ"])
+        self.assertEqual([int(row[0]) for row in rows[1:]], [op.pk for op in self.ops])
+        self.assertEqual(rows[1][2], self.order.name)
+        self.assertEqual(rows[1][7], "Иванов И.И.")
+        self.assertEqual(rows[1][9], "planned")
+
+    def test_orders_and_logs_csv(self):
+        rows = self.read_csv(self.download('/api/v1/order/export/csv/'))
+        self.assertEqual(rows[1][1], self.order.name)
+        self.assertEqual(rows[1][-2:], ["3", "0"])
+
+        rows = self.read_csv(self.download('/api/v1/logs/export/csv/', search="поздно"))
+        self.assertEqual(len(rows), 2)
+        self.assertEqual(rows[1][3], "Поздно")
+        rows = self.read_csv(self.download('/api/v1/logs/export/csv/', search="нет такого"))
+        self.assertEqual(len(rows), 1)
+
+    def test_xlsx_is_valid_workbook(self):
+        content = self.download('/api/v1/operation/export/xlsx/', ordering='-id')
+        with zipfile.ZipFile(io.BytesIO(content)) as book:
+            self.assertIn('xl/workbook.xml', book.namelist())
+            sheet = book.read('xl/worksheets/sheet1.xml').decode('utf-8')
+        self.assertEqual(sheet.count('<row>'), 4)
+        # ?ordering= списка действует и на выгрузку
+        self.assertLess(sheet.index(f'<v>{self.ops[2].pk}</v>'), sheet.index(f'<v>{self.ops[0].pk}</v>'))
+
+    def test_unknown_format_and_anonymous(self):
+        self.assertEqual(self.client.get('/api/v1/operation/export/pdf/').status_code, 404)
+        self.client.force_authenticate(None)
+        self.assertEqual(self.client.get('/api/v1/order/export/csv/').status_code, 401)
+
+    def test_command_streams_in_chunks(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'operations.csv'
+            with CaptureQueriesContext(connection) as queries:
+                call_command('export_data', 'operations', output=str(path), chunk_size=2, stderr=StringIO())
+            rows = self.read_csv(path.read_bytes())
+        self.assertEqual(len(rows), 4)
+        # Исполнители - один запрос на пачку из двух строк
+        executor_queries = [q for q in queries.captured_queries if 'api_executor' in q['sql']]
+        self.assertEqual(len(executor_queries), 2)
+
+
+class CriticalPathTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.now = timezone.now().replace(microsecond=0)
+        # Ветвление: 0 -> 1 -> 2 (по 2 часа) и 0 -> 3 (1 час)
+        self.ops = make_chain(self.order, 3, start=self.now + timedelta(hours=1))
+        self.branch = Operation.objects.create(
+            order=self.order, name="Ветка", previous_operation=self.ops[0],
+            planned_start=self.now + timedelta(hours=3), planned_end=self.now + timedelta(hours=4),
+        )
+        self.order.deadline = self.now + timedelta(hours=10)
+        self.order.save()
+
+    def test_slack_and_critical_path(self):
+        data = order_schedule(self.order.pk, now=self.now)
+        by_id = {item['id']: item for item in data['operations']}
+        # Ранний финиш заказа: 1ч + 3 * 2ч = 7ч, запас до срока 3ч
+        self.assertEqual(data['slack_minutes'], 180)
+        self.assertEqual(data['critical_path'], [op.pk for op in self.ops])
+        self.assertEqual([by_id[op.pk]['slack_minutes'] for op in self.ops], [180, 180, 180])
+        # Ветка заканчивается к 4ч, а могла бы к сроку
+        self.assertEqual(by_id[self.branch.pk]['slack_minutes'], 360)
+        self.assertFalse(by_id[self.branch.pk]['critical'])
+
+    def test_started_late_operation_goes_negative(self):
+        self.ops[0].actual_start = self.now - timedelta(hours=5)
+        self.ops[0].save()
+        data = order_schedule(self.order.pk, now=self.now + timedelta(hours=9))
+        by_id = {item['id']: item for item in data['operations']}
+        # Первая ещё идёт (заканчивается не раньше now = 9ч), ещё 4ч цепочки - на час позже срока
+        self.assertEqual(by_id[self.ops[2].pk]['slack_minutes'], -180)
+        self.assertEqual(data['slack_minutes'], -180)
+
+    def test_endpoint_is_cached_by_order_state(self):
+        self.assertEqual(self.client.get('/api/v1/order/999999/schedule/').status_code, 404)
+        first = self.client.get(f'/api/v1/order/{self.order.pk}/schedule/').json()
+        with self.assertNumQueries(1):
+            second = self.client.get(f'/api/v1/order/{self.order.pk}/schedule/').json()
+        self.assertEqual(first, second)
+
+        self.ops[2].planned_end += timedelta(hours=5)
+        self.ops[2].save()
+        third = self.client.get(f'/api/v1/order/{self.order.pk}/schedule/').json()
+        self.assertLess(third['slack_minutes'], first['slack_minutes'])
+
+    def test_thousand_operations(self):
+        # Время на больших заказах - manage.py benchmark_planning
+        start = self.now
+        rows = []
+        for i in range(1000):
+            op_start = start + timedelta(hours=i)
+            rows.append((i + 1, i if i % 10 else None, op_start, op_start + timedelta(hours=1), None, None))
+        cpm = critical_path(rows, start + timedelta(days=60), start)
+        self.assertEqual(len(cpm.order), 1000)
+        self.assertEqual(cpm.finish, start + timedelta(hours=990 + 10))
+
+
+class CapacityForecastTests(BaseAPITestCase):
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.shop = AssemblyShop.objects.create(name="Цех")
+        self.executor = Executor.objects.create(full_name="Исполнитель")
+
+    def row(self, op_id, start_hours, hours=2, parent=None, shop=None, actual_start=None):
+        start = self.now + timedelta(hours=start_hours)
+        end = start + timedelta(hours=hours)
+        return (op_id, 1, parent, None, shop, start, end, start, end, actual_start)
+
+    def hours(self, value):
+        return (value - _to_us(self.now)) / 3_600_000_000
+
+    def test_shop_and_executor_contention(self):
+        rows = [
+            self.row(1, 0, shop=1),
+            self.row(2, 0, shop=1),
+            self.row(3, 1, parent=1),
+            self.row(4, 0, hours=1),
+        ]
+        # Исполнитель 7 нужен и третьей, и четвёртой операции
+        result = {op_id: (self.hours(start), self.hours(end)) for op_id, start, end in capacity_forecast(
+            rows, {3: [7], 4: [7]}, self.now,
+        )}
+        self.assertEqual(result[1], (0, 2))
+        self.assertEqual(result[2], (2, 4))
+        # Четвёртая готова раньше и занимает исполнителя до 1ч, третья ждёт родителя до 2ч
+        self.assertEqual(result[4], (0, 1))
+        self.assertEqual(result[3], (2, 4))
+
+    def test_started_operation_holds_resources(self):
+        rows = [
+            self.row(1, -1, hours=3, shop=1, actual_start=self.now - timedelta(hours=1)),
+            self.row(2, -5, shop=1),
+        ]
+        result = {op_id: (self.hours(start), self.hours(end)) for op_id, start, end in capacity_forecast(rows, {}, self.now)}
+        self.assertEqual(result[1], (-1, 2))
+        # Просроченная операция не начнётся раньше now и ждёт цех
+        self.assertEqual(result[2], (2, 4))
+
+    def test_run_writes_predictions(self):
+        first = Order.objects.create(name="Первый", deadline=self.order.deadline, created_by=self.technolog)
+        a = make_chain(first, 1, start=self.now + timedelta(hours=1))[0]
+        b = make_chain(self.order, 2, start=self.now + timedelta(hours=1))
+        for op in (a, b[0]):
+            op.assembly_shop = self.shop
+            op.save()
+        b[0].executors.add(self.executor)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            total, changed = run_capacity_forecast(now=self.now)
+        self.assertEqual(total, 3)
+        a.refresh_from_db()
+        b[0].refresh_from_db()
+        b[1].refresh_from_db()
+        # Обе корневые операции в одном цехе: одна ждёт другую, цепочка сдвигается следом
+        self.assertEqual(sorted([a.predict_start, b[0].predict_start]), [
+            self.now + timedelta(hours=1), self.now + timedelta(hours=3),
+        ])
+        self.assertEqual(b[1].predict_start, b[0].predict_end)
+        self.assertEqual(changed, 2)
+        self.assertTrue(LiveEvent.objects.filter(kind=LiveEvent.Kind.OPERATION_FORECAST).exists())
+
+    def test_queue_worker_leaves_capacity_engine_to_its_worker(self):
+        first, second = make_chain(self.order, 2, start=self.now + timedelta(hours=1))
+        first.predict_end += timedelta(hours=1)
+        first.save()
+        before = Operation.objects.get(pk=second.pk).predict_start
+        with override_settings(FORECAST_ENGINE='capacity'), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(drain_forecast_queue(), (1, 1, 0))
+        # Прогноз по цепочке не затирает прогноз с учётом загрузки, пересчёта нет
+        self.assertFalse([q for q in queries.captured_queries if q['sql'].startswith('UPDATE "api_operation"')])
+        self.assertEqual(Operation.objects.get(pk=second.pk).predict_start, before)
+        self.assertFalse(ForecastQueue.objects.exists())
+
+    def test_daily_command_uses_configured_engine(self):
+        op = make_chain(self.order, 1, start=self.now - timedelta(days=2))[0]
+        out = StringIO()
+        with override_settings(FORECAST_ENGINE='capacity'):
+            call_command('update_predict_operations', stdout=out)
+        self.assertIn("прогнозов изменено: 1", out.getvalue())
+        op.refresh_from_db()
+        self.assertGreaterEqual(op.predict_start, self.now)
+
+
+class ForecastQueueTests(BaseAPITestCase):
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.technolog)
+        self.ops = make_chain(self.order, 4)
+        ForecastQueue.objects.all().delete()
+
+    def test_start_returns_before_propagation(self):
+        shop = AssemblyShop.objects.create(name="Цех")
+        executor = Executor.objects.create(full_name="Исполнитель")
+        before = self.ops[1].predict_start
+        response = self.client.patch(
+            f'/api/v1/operation/{self.ops[0].pk}/start/',
+            {'assembly_shop_id': shop.pk, 'executor_ids': [executor.pk]}, format='json',
+        )
+        self.assertEqual(response.status_code, 200, response.content)
+        self.ops[1].refresh_from_db()
+        self.assertEqual(self.ops[1].predict_start, before)
+        self.assertEqual(ForecastQueue.objects.count(), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(drain_forecast_queue(), (1, 1, 3))
+        self.ops[0].refresh_from_db()
+        self.ops[3].refresh_from_db()
+        self.assertEqual(self.ops[3].predict_end, self.ops[0].predict_end + timedelta(hours=6))
+        self.assertTrue(LiveEvent.objects.filter(kind=LiveEvent.Kind.OPERATION_FORECAST).exists())
+
+    def test_burst_is_coalesced_and_lag_recorded(self):
+        for hours in (1, 2, 3):
+            self.ops[0].predict_end = self.ops[0].planned_end + timedelta(hours=hours)
+            self.ops[0].save(update_fields=['predict_end'])
+        self.ops[1].description = "Без влияния на прогноз"
+        self.ops[1].save(update_fields=['description'])
+        self.assertEqual(ForecastQueue.objects.count(), 3)
+
+        with CaptureQueriesContext(connection) as queries:
+            entries, roots, changed = drain_forecast_queue()
+        self.assertEqual((entries, roots, changed), (3, 1, 3))
+        # Один пересчёт: одно обновление прогнозов на всю пачку
+        updates = [q for q in queries.captured_queries if q['sql'].startswith('UPDATE "api_operation"')]
+        self.assertEqual(len(updates), 1)
+
+        stats = self.client.get('/api/v1/operation/forecast-queue/stats/').json()
+        self.assertEqual(stats['depth'], 0)
+        self.assertEqual(stats['processed'], {'entries': 3, 'roots': 1, 'changed': 3})
+        self.assertEqual(stats['last_batch']['entries'], 3)
+        self.assertGreaterEqual(stats['last_batch']['lag_max_seconds'], 0)
+
+    def test_worker_command_drains_queue(self):
+        self.ops[0].predict_end += timedelta(hours=1)
+        self.ops[0].save()
+        out = StringIO()
+        call_command('drain_forecast_queue', once=True, stdout=out)
+        self.assertIn("Записей очереди: 1", out.getvalue())
+        self.assertFalse(ForecastQueue.objects.exists())
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], REPLICA_PIN_SECONDS=5)
+class ReplicaRoutingTests(TestCase):
+    """Маршрутизация без обращения к реплике: view-заглушка запоминает, куда пошли бы чтения."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [CustomUser.objects.create_user(f'user{i}', password='pass') for i in range(2)]
+
+    def setUp(self):
+        self.factory = RequestFactory()
+        self.seen = []
+        self.a, self.b = (f'Bearer {AccessToken.for_user(user)}' for user in self.users)
+
+        def view(request):
+            self.seen.append(router.db_for_read(Order))
+            return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+        self.middleware = ReplicaMiddleware(view)
+
+    def request(self, method, path='/api/v1/order/', token=None):
+        return self.request_with(self.middleware, method, path, token)
+
+    def request_with(self, middleware, method, path='/api/v1/order/', token=None):
+        return middleware(getattr(self.factory, method)(path, HTTP_AUTHORIZATION=token or self.a))
+
+    def test_safe_api_reads_use_replica_writes_primary(self):
+        self.request('get')
+        self.request('post', '/api/v1/operation/1/start/', token=self.b)
+        self.request('get', '/admin/')
+        self.assertEqual(self.seen, ['replica', 'default', 'default'])
+        self.assertEqual(router.db_for_write(Order), 'default')
+        self.assertEqual(router.db_for_read(Order), 'default')
+
+    def test_user_is_pinned_to_primary_after_write(self):
+        self.request('post')
+        self.request('get')
+        # Новый токен того же пользователя (refresh) - та же метка
+        self.request('get', token=f'Bearer {AccessToken.for_user(self.users[0])}')
+        self.request('get', token=self.b)
+        # Поддельный токен и анонимный клиент не закрепляются
+        self.request('post', token='Bearer forged')
+        self.request('get', token='Bearer forged')
+        self.assertEqual(self.seen, ['default', 'default', 'default', 'replica', 'default', 'replica'])
+
+        with mock.patch('api.replicas.time.time', return_value=time.time() + 10):
+            self.request('get')
+        self.assertEqual(self.seen[-1], 'replica')
+
+    def test_async_middleware_routes_the_same(self):
+        async def view(request):
+            self.seen.append(router.db_for_read(Order))
+            return HttpResponse(status=201 if request.method == 'POST' else 200)
+
+        middleware = ReplicaMiddleware(view)
+        for method, token in (('get', self.a), ('post', self.a), ('get', self.a), ('get', self.b)):
+            async_to_sync(middleware)(getattr(self.factory, method)('/api/v1/order/', HTTP_AUTHORIZATION=token))
+        self.assertEqual(self.seen, ['replica', 'default', 'default', 'replica'])
+
+    def test_streaming_response_reads_from_replica(self):
+        def stream():
+            yield router.db_for_read(Order).encode()
+
+        middleware = ReplicaMiddleware(lambda request: StreamingHttpResponse(stream()))
+        response = middleware(self.factory.get('/api/v1/order/export/csv/'))
+        self.assertEqual(router.db_for_read(Order), 'default')
+        self.assertEqual(b''.join(response.streaming_content), b'replica')
+
+    def test_reference_cache_miss_is_built_from_primary(self):
+        # Реплика отстаёт: нового цеха на ней ещё нет
+        rows = {'default': ['Цех 1', 'Цех 2'], 'replica': ['Цех 1']}
+        middleware = ReplicaMiddleware(
+            lambda request: cached_response(request, WORKSHOPS, lambda: (200, rows[router.db_for_read(AssemblyShop)]))
+        )
+        # Запись другого пользователя сменила версию после коммита
+        with self.captureOnCommitCallbacks(execute=True):
+            bump_reference_version(WORKSHOPS)
+
+        for cache_status in ('MISS', 'HIT'):
+            response = self.request_with(middleware, 'get', '/api/v1/workshops/?lag=1', token=self.b)
+            self.assertEqual(response['X-Cache'], cache_status)
+            self.assertEqual(response.data, rows['default'])
+
+    def test_context_manager_and_migrations(self):
+        with read_from_replica():
+            self.assertEqual(router.db_for_read(Order), 'replica')
+            self.assertEqual(router.db_for_read(CustomUser), 'replica')
+        self.assertEqual(router.db_for_read(Order), 'default')
+        self.assertFalse(router.allow_migrate('replica', 'api'))
+        self.assertTrue(router.allow_migrate('default', 'api'))
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_without_replicas_everything_is_primary(self):
+        self.request('get')
+        with read_from_replica():
+            self.assertEqual(router.db_for_read(Order), 'default')
+        self.assertEqual(self.seen, ['default'])
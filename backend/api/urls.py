@@ -4,14 +4,27 @@ TokenObtainPairView,
 TokenRefreshView
 )
 from rest_framework.routers import DefaultRouter
-from .views.order_views import OrderListCreateAPIView, OrderDetailUpdateDeleteAPIView
+from .views.order_views import (
+    OrderListCreateAPIView,
+    OrderDetailUpdateDeleteAPIView,
+    OrderBulkCreateAPIView,
+    OrderBulkUpdateAPIView,
+    OrderExportAPIView,
+    OrderScheduleAPIView,
+)
 from .views.operation_views import (
     OperationListCreateAPIView,
     OperationDetailUpdateDeleteAPIView,
     OperationStartAPIView,
     OperationEndAPIView,
-    OperationAPIGetByOrder
+    OperationAPIGetByOrder,
+    OperationBatchStartAPIView,
+    OperationBatchEndAPIView,
+    OperationExportAPIView,
+    ForecastQueueStatsView,
 )
+from .views.event_views import EventTicketAPIView, event_stream
+from .views.gantt_views import OperationGanttAPIView
 from .views.log_views import TehLogViewSet
 from .views.workshop_views import AssemblyShopAPIList, AssemblyShopAPIUpdate
 from .views.executor_views import (
@@ -20,7 +33,7 @@ from .views.executor_views import (
     ExecutorAPIListByWorkshop,
     ExecutorTasksAggregationView
 )
-from .views.user_views import MasterListAPIView, CurrentUserView
+from .views.user_views import MasterListAPIView, CurrentUserView, ReferenceCacheStatsView
 
 router = DefaultRouter()
 router.register(r'logs', TehLogViewSet, basename='tehlog')
@@ -34,18 +47,31 @@ urlpatterns = [
     # Orders
     path('order/', OrderListCreateAPIView.as_view()),
     path('order/<int:pk>/', OrderDetailUpdateDeleteAPIView.as_view()),
+    path('order/bulk/', OrderBulkCreateAPIView.as_view()),
+    path('order/<int:pk>/bulk/', OrderBulkUpdateAPIView.as_view()),
+    path('order/export/<str:file_format>/', OrderExportAPIView.as_view()),
+    path('order/<int:pk>/schedule/', OrderScheduleAPIView.as_view()),
 
     # Logs
     path('', include(router.urls)),
 
+    # Live events (SSE, обслуживается ASGI-приложением)
+    path('events/stream/', event_stream),
+    path('events/ticket/', EventTicketAPIView.as_view()),
+
     # Operations
     path('operation/', OperationListCreateAPIView.as_view()),
     path('operation/<int:pk>/', OperationDetailUpdateDeleteAPIView.as_view()),
     path('operation/by_order/<int:order_pk>/', OperationAPIGetByOrder.as_view()),
+    path('operation/gantt/', OperationGanttAPIView.as_view()),
+    path('operation/export/<str:file_format>/', OperationExportAPIView.as_view()),
 
     # Operation Actions
     path('operation/<int:pk>/start/', OperationStartAPIView.as_view()),
     path('operation/<int:pk>/end/', OperationEndAPIView.as_view()),
+    path('operation/batch/start/', OperationBatchStartAPIView.as_view()),
+    path('operation/batch/end/', OperationBatchEndAPIView.as_view()),
+    path('operation/forecast-queue/stats/', ForecastQueueStatsView.as_view()),
     
 
     # Workshops (Старые Views оставлены, если они нужны для справочников)
@@ -60,4 +86,7 @@ urlpatterns = [
 
     # Masters
     path('masters/', MasterListAPIView.as_view()),
+
+    # Кэш справочников
+    path('reference-cache/stats/', ReferenceCacheStatsView.as_view()),
 ]
\ No newline at end of file
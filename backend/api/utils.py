@@ -1,89 +1,276 @@
-from datetime import datetime, timezone as dt_timezone
+from datetime import datetime, timedelta, timezone as dt_timezone
 from collections import defaultdict
+from operator import attrgetter
+
+from django.utils import timezone
 
 def sort_operations_chain(operations):
     """
     Сортирует операции на основе previous_operation.
-    1. Строит дерево: Родитель -> [Дети].
-    2. Находит корни (операции без previous_operation или чей родитель не в текущем списке).
-    3. Рекурсивно добавляет детей, сортируя их по времени.
+    1. Один раз сортирует все операции по (planned_start, id) - детей в дереве
+       и корни затем не нужно пересортировывать, порядок детерминирован.
+    2. Корни - операции без previous_operation или чей родитель не в текущем списке.
+    3. Обходит дерево итеративно (DFS без рекурсии), поэтому длина цепочки
+       не ограничена лимитом рекурсии.
+    4. Операции, попавшие в цикл, недостижимы от корней: цикл разрывается
+       на самой ранней из них, и она обходится как корень.
     """
-    # 1. Превращаем QuerySet в список и создаем мапу
     ops_list = list(operations)
     if not ops_list:
         return []
 
-    # Map: id -> operation
-    op_map = {op.id: op for op in ops_list}
-    
-    # Map: parent_id -> list[child_operations]
-    # Используем related_name логику вручную для списка в памяти
+    # Дата-заглушка для сортировки
+    min_date = datetime.min.replace(tzinfo=dt_timezone.utc)
+    # Две устойчивые сортировки быстрее одной по кортежу с datetime
+    ops_list.sort(key=attrgetter('id'))
+    ops_list.sort(key=lambda x: x.planned_start or min_date)
+
+    op_ids = {op.id for op in ops_list}
+
+    # Map: parent_id -> list[child_operations], дети уже отсортированы
     children_map = defaultdict(list)
-    
-    # Список операций, которые будут считаться корневыми в текущем наборе
     roots = []
 
-    # 2. Распределяем операции
     for op in ops_list:
         parent_id = op.previous_operation_id
-        
         # Если родитель есть и он находится в этом же списке -> добавляем в дети
-        if parent_id and parent_id in op_map:
+        if parent_id and parent_id in op_ids and parent_id != op.id:
             children_map[parent_id].append(op)
         else:
             # Если родителя нет вообще ИЛИ родитель остался "за кадром" (фильтрация)
             # считаем эту операцию корневой для текущего отображения
             roots.append(op)
 
-    # Дата-заглушка для сортировки
-    min_date = datetime.min.replace(tzinfo=dt_timezone.utc)
-
-    # 3. Сортируем корни по дате начала
-    roots.sort(key=lambda x: x.planned_start or min_date)
-
     sorted_ops = []
+    visited = set()
 
-    # 4. Рекурсивный обход (DFS) для построения плоского списка
-    def visit(node):
-        sorted_ops.append(node)
-        
-        # Получаем детей текущего узла
-        children = children_map.get(node.id, [])
-        
-        # Сортируем детей между собой (кто раньше встал, того и тапки)
-        children.sort(key=lambda x: x.planned_start or min_date)
-        
-        for child in children:
-            visit(child)
+    def visit(root):
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            if node.id in visited:
+                continue
+            visited.add(node.id)
+            sorted_ops.append(node)
+            children = children_map.get(node.id)
+            if children:
+                stack.extend(reversed(children))
 
     for root in roots:
         visit(root)
 
+    # Остались только операции из циклов
+    if len(sorted_ops) < len(ops_list):
+        for op in ops_list:
+            if op.id not in visited:
+                visit(op)
+
     return sorted_ops
 
-def recalculate_predict_chain(start_operation):
+PREDICT_FIELDS = ['predict_start', 'predict_end']
+
+
+def topological_order(parents):
     """
-    Рекурсивно обновляет predict_start/predict_end для всех зависимых операций
-    вниз по цепочке.
+    Порядок узлов "родитель раньше детей" для словаря {узел: родитель или None}.
+    Родитель, которого нет среди ключей, считается внешним (узел - корень).
+    Возвращает None, если в графе есть цикл.
     """
-    queue = list(start_operation.next_operations.all())
-    visited = set()
-    visited.add(start_operation.id)
+    children = defaultdict(list)
+    order = []
+    for node, parent in parents.items():
+        if parent is not None and parent in parents:
+            children[parent].append(node)
+        else:
+            order.append(node)
+    pos = 0
+    while pos < len(order):
+        order.extend(children.get(order[pos], ()))
+        pos += 1
+    # Узлы цикла недостижимы от корней
+    return order if len(order) == len(parents) else None
 
-    while queue:
-        current_op = queue.pop(0)
-        if current_op.id in visited:
-            continue
-        visited.add(current_op.id)
 
-        parent = current_op.previous_operation
-        if not parent:
+def operation_window_filters(date_from=None, date_to=None, prefix=''):
+    """
+    Условия "операция пересекается с окном [date_from, date_to]" для .filter(*...).
+    Интервал операции - фактический, а где его ещё нет - прогнозный.
+    prefix - путь до операции, например 'operation__' для through-таблицы.
+    """
+    from django.db.models.functions import Coalesce
+    from django.db.models.lookups import GreaterThanOrEqual, LessThanOrEqual
+
+    conditions = []
+    if date_from:
+        conditions.append(GreaterThanOrEqual(
+            Coalesce(f'{prefix}actual_end', f'{prefix}predict_end'), date_from,
+        ))
+    if date_to:
+        conditions.append(LessThanOrEqual(
+            Coalesce(f'{prefix}actual_start', f'{prefix}predict_start'), date_to,
+        ))
+    return conditions
+
+
+def recalculate_predict_chains(start_operations):
+    """
+    Пересчитывает predict_start/predict_end всех потомков переданных операций.
+    Потомки берутся из кэша графов заказов (api.graph), загружаются одним
+    запросом, новые прогнозы считаются в памяти в топологическом порядке
+    и записываются одним bulk_update.
+    Возвращает список изменённых операций.
+    """
+    from api.models import Operation
+    from api.graph import get_operation_graphs
+
+    start_operations = [op for op in start_operations if op is not None and op.pk]
+    if not start_operations:
+        return []
+
+    starts_by_order = defaultdict(list)
+    for op in start_operations:
+        starts_by_order[op.order_id].append(op.id)
+
+    graphs = get_operation_graphs(starts_by_order.keys())
+    descendant_ids = []
+    for order_id, graph in graphs.items():
+        descendant_ids.extend(graph.descendants(starts_by_order[order_id]))
+    if not descendant_ids:
+        return []
+
+    nodes = Operation.objects.filter(pk__in=descendant_ids).order_by().only(
+        'id', 'order_id', 'previous_operation_id',
+        'planned_start', 'planned_end',
+        'predict_start', 'predict_end', 'actual_end',
+    ).in_bulk()
+    # Стартовые операции берём из памяти: вызывающий код мог уже изменить их прогноз
+    for op in start_operations:
+        nodes[op.id] = op
+
+    changed = []
+    now = timezone.now()
+    # descendant_ids уже в топологическом порядке: родитель раньше детей
+    for op_id in descendant_ids:
+        child = nodes.get(op_id)
+        parent = nodes.get(child.previous_operation_id) if child else None
+        if parent is None:
             continue
 
         reference_end = parent.predict_end or parent.actual_end or parent.planned_end
         if reference_end:
-            current_op.predict_start = reference_end
-            current_op.predict_end = reference_end + current_op.duration
-            current_op.save(update_fields=['predict_start', 'predict_end'])
-            
-            queue.extend(current_op.next_operations.all())
\ No newline at end of file
+            new_start = reference_end
+            new_end = reference_end + child.duration
+            if child.predict_start != new_start or child.predict_end != new_end:
+                child.predict_start = new_start
+                child.predict_end = new_end
+                child.updated_at = now
+                changed.append(child)
+
+    if changed:
+        from api.events import publish_forecast
+
+        Operation.objects.bulk_update(changed, PREDICT_FIELDS + ['updated_at'], batch_size=500)
+        publish_forecast(changed)
+    return changed
+
+
+ROLL_FORWARD_FIELDS = (
+    'id', 'previous_operation_id', 'planned_start', 'planned_end',
+    'predict_start', 'predict_end', 'actual_start', 'order_id',
+)
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=dt_timezone.utc)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_us(value):
+    return (value - _EPOCH) // _MICROSECOND
+
+
+def _from_us(value):
+    return _EPOCH + timedelta(microseconds=value)
+
+
+def overdue_root_orders(day_start):
+    """
+    Id заказов, где есть неначатые корневые операции с прогнозом начала
+    раньше day_start (ежедневный update_predict_operations).
+    """
+    from api.models import Operation
+
+    return Operation.objects\
+        .filter(previous_operation__isnull=True, actual_start__isnull=True, predict_start__lt=day_start)\
+        .order_by('order_id')\
+        .values_list('order_id', flat=True)\
+        .distinct()
+
+
+def roll_forward_predictions(rows, today, tz):
+    """
+    Сдвигает просроченные неначатые корневые операции на сегодня и
+    распространяет сдвиг на их потомков.
+
+    rows - кортежи в порядке ROLL_FORWARD_FIELDS для целых заказов
+    (обычно из values_list). Граф хранится в параллельных массивах
+    (индекс родителя, длительность, прогноз в микросекундах), потомки
+    обходятся одним линейным проходом в топологическом порядке.
+    Возвращает (число сдвинутых корней, [(id, predict_start, predict_end)]).
+    """
+    n = len(rows)
+    if not n:
+        return 0, []
+
+    index = {row[0]: i for i, row in enumerate(rows)}
+    parent = [index.get(row[1], -1) for row in rows]
+    duration = [_to_us(row[3]) - _to_us(row[2]) for row in rows]
+    start = [_to_us(row[4]) for row in rows]
+    end = [_to_us(row[5]) for row in rows]
+    dirty = bytearray(n)
+
+    # Списки детей в виде "голова/следующий" без словаря списков
+    head = [-1] * n
+    sibling = [-1] * n
+    for i in range(n - 1, -1, -1):
+        p = parent[i]
+        if p >= 0:
+            sibling[i] = head[p]
+            head[p] = i
+
+    shifted = 0
+    for i, row in enumerate(rows):
+        if row[1] is not None or row[6] is not None:
+            continue
+        local_start = row[4].astimezone(tz)
+        if local_start.date() < today:
+            new_start = datetime.combine(today, local_start.time()).replace(tzinfo=tz)
+            start[i] = _to_us(new_start)
+            end[i] = start[i] + duration[i]
+            dirty[i] = 1
+            shifted += 1
+
+    if not shifted:
+        return 0, []
+
+    # Топологический порядок: корни, затем дети в порядке BFS
+    order = [i for i in range(n) if parent[i] < 0]
+    pos = 0
+    while pos < len(order):
+        child = head[order[pos]]
+        while child >= 0:
+            order.append(child)
+            child = sibling[child]
+        pos += 1
+
+    for i in order:
+        p = parent[i]
+        if p >= 0 and dirty[p]:
+            start[i] = end[p]
+            end[i] = start[i] + duration[i]
+            dirty[i] = 1
+
+    changes = [
+        (rows[i][0], _from_us(start[i]), _from_us(end[i]))
+        for i in range(n)
+        if dirty[i] and (start[i] != _to_us(rows[i][4]) or end[i] != _to_us(rows[i][5]))
+    ]
+    return shifted, changes
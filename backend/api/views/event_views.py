@@ -0,0 +1,101 @@
+import secrets
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from rest_framework.views import APIView
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, AuthenticationFailed
+from api.cache import reference_cache
+from api.events import hub, format_sse, Kind
+
+# Кто видит события логов - как у /logs/ (IsTechnologistOrAdmin для чтения)
+LOG_ROLES = ('technolog', 'admin')
+
+
+def _ticket_key(ticket):
+    return f'events-ticket:{ticket}'
+
+
+class EventTicketAPIView(APIView):
+    """
+    Одноразовый билет на подключение к /events/stream/?ticket=. EventSource
+    в браузере не умеет передавать заголовки, а JWT в адресе попал бы в
+    логи nginx; билет живёт LIVE_EVENTS_TICKET_SECONDS и гасится при входе.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        ticket = secrets.token_urlsafe(32)
+        timeout = getattr(settings, 'LIVE_EVENTS_TICKET_SECONDS', 30)
+        reference_cache().set(_ticket_key(ticket), request.user.pk, timeout)
+        return Response({'ticket': ticket, 'expires_in': timeout})
+
+
+def _redeem_ticket(ticket):
+    key = _ticket_key(ticket)
+    user_id = reference_cache().get(key)
+    # delete() удаляет строку ровно у одного из одновременных запросов
+    if user_id is None or not reference_cache().delete(key):
+        return None
+    return get_user_model().objects.filter(pk=user_id).first()
+
+
+def _authenticate(request):
+    """JWT из заголовка Authorization или одноразовый билет из ?ticket=."""
+    if request.GET.get('ticket'):
+        return _redeem_ticket(request.GET['ticket'])
+    auth = JWTAuthentication()
+    try:
+        result = auth.authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+def _parse_last_event_id(request):
+    raw = request.headers.get('Last-Event-ID') or request.GET.get('last_event_id')
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        return None
+
+
+async def event_stream(request):
+    """
+    Server-Sent Events: operation.started, operation.ended,
+    operation.forecast и log.created. После обрыва браузер сам
+    переподключается с Last-Event-ID и получает пропущенные события.
+    Обслуживается ASGI-приложением (mez/asgi.py).
+    """
+    user = await sync_to_async(_authenticate)(request)
+    if user is None or not user.is_active:
+        return JsonResponse({"detail": "Authentication credentials were not provided."}, status=401)
+
+    show_logs = getattr(user, 'role', None) in LOG_ROLES
+    last_id = _parse_last_event_id(request)
+    if last_id is None:
+        last_id = await hub.current_id()
+    heartbeat = getattr(settings, 'LIVE_EVENTS_HEARTBEAT', 15)
+
+    async def stream(last_id):
+        yield "retry: 3000\n\n"
+        while True:
+            events = await hub.wait_events(last_id, timeout=heartbeat)
+            if not events:
+                # Комментарий-пульс, чтобы прокси не закрыл соединение
+                yield ": ping\n\n"
+                continue
+            for event in events:
+                last_id = event.pk
+                if event.kind == Kind.LOG_CREATED and not show_logs:
+                    continue
+                yield format_sse(event)
+
+    response = StreamingHttpResponse(stream(last_id), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    response['X-Accel-Buffering'] = 'no'
+    return response
@@ -2,13 +2,26 @@ from rest_framework import generics
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from rest_framework.response import Response
+from datetime import timedelta
+from django.conf import settings
 from django.db.models import Prefetch, Count, Q
+from django.utils import timezone
 from api.models import Executor, Operation
-from api.serializers import ExecutorSerializer, ExecutorAggregationSerializer 
+from api.serializers import (
+    ExecutorSerializer,
+    ExecutorAggregationSerializer,
+    ExecutorAggregationParamsSerializer,
+)
+from api.filters import KeysetOrderingFilter
+from api.pagination import ExecutorCursorPagination
+from api.cache import ReferenceCacheMixin, cached_response, EXECUTORS
+from api.utils import operation_window_filters
 # Create your views here.
 
-class ExecutorAPIList(generics.ListCreateAPIView):
-    queryset = Executor.objects.all()
+class ExecutorAPIList(ReferenceCacheMixin, generics.ListCreateAPIView):
+    cache_namespace = EXECUTORS
+    # Стабильный порядок - страницы кэшируются
+    queryset = Executor.objects.order_by('id')
     serializer_class = ExecutorSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     
@@ -19,45 +32,95 @@ class ExecutorAPIUpdate(generics.RetrieveUpdateDestroyAPIView):
     
 class ExecutorAPIListByWorkshop(APIView):
     def get(self, request, *args, **kwargs):
+        return cached_response(request, EXECUTORS, self.build)
+
+    def build(self):
         workshop_pk = self.kwargs.get('workshop_pk')
         executors = Executor.objects\
             .filter(assembly_shops=workshop_pk)\
             .distinct()
         if not executors.exists():
-            return Response(status=404, data={"detail":"No executors in workshop or workshop_pk is invalid"})
+            return 404, {"detail":"No executors in workshop or workshop_pk is invalid"}
         serializer  = ExecutorSerializer(executors, many=True)
-        return Response(status=200, data=serializer .data)
+        return 200, serializer.data
     
 class ExecutorTasksAggregationView(generics.ListAPIView):
     """
     Возвращает список исполнителей со списком их задач.
-    Поддерживает фильтр ?active_only=true (по умолчанию false, если не передано).
+    Параметры:
+    ?active_only=true - только незавершённые задачи (по умолчанию false);
+    ?from=&to= - окно времени, задачи и счётчики ограничены им. Без from
+    завершённые задачи берутся за последние EXECUTOR_TASKS_DEFAULT_DAYS дней;
+    ?workshop=<id> - только исполнители цеха.
+    Счётчики считаются одним сгруппированным запросом по странице исполнителей.
     """
     serializer_class = ExecutorAggregationSerializer
+    pagination_class = ExecutorCursorPagination
+    filter_backends = [KeysetOrderingFilter]
+    ordering_fields = ('full_name', 'id')
+
+    def get_params(self):
+        if not hasattr(self, '_params'):
+            params = ExecutorAggregationParamsSerializer(data=self.request.query_params)
+            params.is_valid(raise_exception=True)
+            self._params = params.validated_data
+        return self._params
+
+    def get_task_filters(self, prefix=''):
+        params = self.get_params()
+        conditions = operation_window_filters(params.get('date_from'), params.get('date_to'), prefix)
+        if not params['active_only'] and not params.get('date_from'):
+            # Окно по умолчанию ограничивает только историю: незавершённые
+            # задачи, в т.ч. давно просроченные, видны всегда
+            days = getattr(settings, 'EXECUTOR_TASKS_DEFAULT_DAYS', 30)
+            conditions.append(
+                Q(**{f'{prefix}actual_end__isnull': True})
+                | Q(**{f'{prefix}actual_end__gte': timezone.now() - timedelta(days=days)})
+            )
+        filters = {f'{prefix}actual_end__isnull': True} if params['active_only'] else {}
+        return conditions, filters
 
     def get_queryset(self):
-        # Получаем параметры запроса
-        active_only = self.request.query_params.get('active_only', 'false').lower() == 'true'
-        
+        params = self.get_params()
+
         # Базовый QuerySet задач, которые мы хотим "подтянуть" к исполнителям
-        operations_qs = Operation.objects.select_related('order').all()
-        
-        if active_only:
-            # Если нужны только активные (не завершенные)
-            operations_qs = operations_qs.filter(actual_end__isnull=True)
+        conditions, filters = self.get_task_filters()
+        operations_qs = Operation.objects.select_related('order').filter(*conditions, **filters)
 
         # Формируем основной запрос к Исполнителям
-        queryset = Executor.objects.all().prefetch_related(
-            # Важнейшая часть: подгружаем связанные задачи, используя фильтрованный QuerySet
+        queryset = Executor.objects.prefetch_related(
+            # Подгружаем связанные задачи только в пределах окна
             Prefetch('operation_set', queryset=operations_qs)
-        ).annotate(
-            # Считаем общее кол-во задач
-            total_tasks=Count('operation_set'),
-            # Считаем кол-во активных задач (где actual_end is NULL)
-            active_tasks_count=Count('operation_set', filter=Q(operation_set__actual_end__isnull=True))
         )
-        
-        # Опционально: можно фильтровать самих исполнителей, у которых 0 задач,
-        # если добавить .filter(total_tasks__gt=0)
-        
-        return queryset.order_by('full_name')
\ No newline at end of file
+        if params.get('workshop'):
+            queryset = queryset.filter(assembly_shops=params['workshop']).distinct()
+        return queryset.order_by('full_name', 'id')
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        executors = page if page is not None else list(queryset)
+
+        # Оба счётчика - одним GROUP BY по through-таблице для исполнителей страницы
+        Through = Operation.executors.through
+        conditions, _ = self.get_task_filters(prefix='operation__')
+        counts = {
+            row['executor_id']: row
+            for row in Through.objects
+            .filter(*conditions, executor_id__in=[executor.pk for executor in executors])
+            .values('executor_id')
+            .annotate(
+                total_tasks=Count('id'),
+                active_tasks_count=Count('id', filter=Q(operation__actual_end__isnull=True)),
+            )
+            .order_by()
+        }
+        for executor in executors:
+            row = counts.get(executor.pk, {})
+            executor.total_tasks = row.get('total_tasks', 0)
+            executor.active_tasks_count = row.get('active_tasks_count', 0)
+
+        serializer = self.get_serializer(executors, many=True)
+        if page is not None:
+            return self.get_paginated_response(serializer.data)
+        return Response(serializer.data)
@@ -0,0 +1,88 @@
+from django.db.models import Q
+from rest_framework import views
+from rest_framework.response import Response
+from api.models import Operation
+from api.serializers import GanttParamsSerializer
+
+# Колонки ответа и соответствующие им поля операции
+GANTT_COLUMNS = (
+    'id', 'order', 'previous_operation', 'assembly_shop', 'master', 'name',
+    'planned_start', 'planned_end',
+    'predict_start', 'predict_end',
+    'actual_start', 'actual_end',
+)
+GANTT_TIME_COLUMNS = frozenset({
+    'planned_start', 'planned_end', 'predict_start', 'predict_end', 'actual_start', 'actual_end',
+})
+GANTT_VALUES = (
+    'id', 'order_id', 'previous_operation_id', 'assembly_shop_id', 'master_id', 'name',
+    'planned_start', 'planned_end',
+    'predict_start', 'predict_end',
+    'actual_start', 'actual_end',
+    'order__name', 'assembly_shop__name', 'master__username',
+)
+
+
+def _epoch(value):
+    return int(value.timestamp()) if value is not None else None
+
+
+class OperationGanttAPIView(views.APIView):
+    """
+    Операции для диаграммы Ганта в окне ?from=&to= (обязательно),
+    опционально ?shop=<id> и ?master=<id>.
+    Операция попадает в ответ, если с окном пересекается её плановый,
+    прогнозный или фактический интервал.
+
+    Ответ колоночный: в columns параллельные массивы (время - секунды epoch,
+    null - нет значения), названия заказов, цехов и мастеров - в словарях
+    orders/shops/masters по id.
+    """
+
+    def get(self, request):
+        params = GanttParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        date_from = params.validated_data['date_from']
+        date_to = params.validated_data['date_to']
+
+        overlaps = (
+            Q(planned_start__lte=date_to, planned_end__gte=date_from)
+            | Q(predict_start__lte=date_to, predict_end__gte=date_from)
+            | Q(actual_start__lte=date_to, actual_end__gte=date_from)
+            # Начатая и ещё не завершённая операция длится до сих пор
+            | Q(actual_start__lte=date_to, actual_end__isnull=True)
+        )
+        queryset = Operation.objects.filter(overlaps)
+        if params.validated_data.get('shop'):
+            queryset = queryset.filter(assembly_shop_id=params.validated_data['shop'])
+        if params.validated_data.get('master'):
+            queryset = queryset.filter(master_id=params.validated_data['master'])
+
+        rows = queryset.order_by('order_id', 'predict_start', 'id').values_list(*GANTT_VALUES)
+
+        columns = {name: [] for name in GANTT_COLUMNS}
+        appenders = [
+            (columns[name].append, name in GANTT_TIME_COLUMNS) for name in GANTT_COLUMNS
+        ]
+        orders, shops, masters = {}, {}, {}
+        count = 0
+        for row in rows:
+            count += 1
+            for (append, is_time), value in zip(appenders, row):
+                append(_epoch(value) if is_time else value)
+            order_id, shop_id, master_id = row[1], row[3], row[4]
+            orders[order_id] = row[12]
+            if shop_id is not None:
+                shops[shop_id] = row[13]
+            if master_id is not None:
+                masters[master_id] = row[14]
+
+        return Response({
+            'from': _epoch(date_from),
+            'to': _epoch(date_to),
+            'count': count,
+            'columns': columns,
+            'orders': orders,
+            'shops': shops,
+            'masters': masters,
+        })
@@ -1,16 +1,64 @@
-from rest_framework import viewsets, filters
+from rest_framework import viewsets
+from rest_framework.decorators import action
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.response import Response
+from api.archive import encode_cursor, latest_archived_logs
+from api.export import export_response
 from api.models import TehLog
-from api.serializers import TehLogSerializer
+from api.serializers import TehLogSerializer, TehLogArchiveParamsSerializer, datetime_formatter
 from api.permissions import IsTechnologistOrAdmin
+from api.pagination import TehLogCursorPagination
+from api.filters import TehLogSearchFilter
+
+# Поля записи архива в ответе - как у TehLogSerializer
+ARCHIVE_FIELDS = ('id', 'logged_at', 'master', 'master_name', 'info', 'type', 'operation', 'operation_name')
+
 
 class TehLogViewSet(viewsets.ReadOnlyModelViewSet):
     """
     API для просмотра логов (только чтение).
     Доступно только Технологам и Админам.
     """
-    queryset = TehLog.objects.all().order_by('-logged_at')
+    queryset = TehLog.objects.select_related('master', 'operation')
     serializer_class = TehLogSerializer
+    pagination_class = TehLogCursorPagination
     permission_classes = [IsAuthenticated, IsTechnologistOrAdmin]
-    filter_backends = [filters.SearchFilter]
-    search_fields = ['info', 'master__username', 'master__first_name', 'master__last_name', 'operation__name', 'operation__order__name']
\ No newline at end of file
+    # ?search= ищет по TehLog.search_text: info, мастер, операция и заказ
+    filter_backends = [TehLogSearchFilter]
+
+    @action(detail=False, url_path='archive')
+    def archive(self, request):
+        """
+        Логи, выгруженные командой archive_tehlogs, от новых к старым.
+        ?from=&to= - окно, ?search= - подстроки через пробел, ?limit= (до 1000),
+        ?cursor= - значение next из предыдущего ответа.
+        """
+        params = TehLogArchiveParamsSerializer(data=request.query_params)
+        params.is_valid(raise_exception=True)
+        data = params.validated_data
+        limit = data['limit']
+
+        # На одну запись больше - чтобы узнать, есть ли следующая страница
+        records = latest_archived_logs(
+            limit + 1,
+            date_from=data.get('date_from'),
+            date_to=data.get('date_to'),
+            search=data.get('search'),
+            before=data.get('cursor'),
+        )
+        page = records[:limit]
+        fmt = datetime_formatter()
+        results = []
+        for record in page:
+            item = {field: record[field] for field in ARCHIVE_FIELDS}
+            item['logged_at'] = fmt(record['logged_at'])
+            results.append(item)
+        return Response({
+            'results': results,
+            'next': encode_cursor(page[-1]) if len(records) > limit else None,
+        })
+
+    @action(detail=False, url_path=r'export/(?P<file_format>csv|xlsx)')
+    def export(self, request, file_format):
+        """Выгрузка логов в CSV/XLSX потоком, ?search= - как у списка."""
+        return export_response('logs', file_format, self.filter_queryset(TehLog.objects.all()))
@@ -1,30 +1,67 @@
 from django.db import transaction
+from django.db.models import Prefetch
 from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from rest_framework import generics, views, status, permissions
 from rest_framework.response import Response
-from rest_framework.pagination import PageNumberPagination
-from api.models import Operation, AssemblyShop, Executor, TehLog
-from api.serializers import OperationSerializer, OperationStartSerializer
+from api.filters import KeysetOrderingFilter
+from api.pagination import OperationCursorPagination
+from api.models import Operation, AssemblyShop, Executor, TehLogOutbox
+from api.serializers import (
+    OperationSerializer,
+    OperationStartSerializer,
+    OperationReadSerializer,
+    OperationBatchStartSerializer,
+    OperationBatchEndSerializer,
+)
+from api.bulk import start_operations, end_operations
+from api.outbox import enqueue_logs
+from api.reforecast import queue_stats
 from api.permissions import IsTechnologistOrAdmin, IsMasterOrTechnologist
-from api.utils import sort_operations_chain, recalculate_predict_chain
+from api.graph import get_operation_graph
+from api.events import publish_event, operation_event_payload, Kind
+from api.conditional import order_conditional, order_graph_version
+from api.export import export_response
 
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
-
 class OperationListCreateAPIView(generics.ListCreateAPIView):
     queryset = Operation.objects.all()
     serializer_class = OperationSerializer
-    pagination_class = StandardResultsSetPagination
+    pagination_class = OperationCursorPagination
+    filter_backends = [KeysetOrderingFilter]
+    ordering_fields = ('predict_start', 'id')
+    # Быстрый путь чтения списка; None - сериализация через OperationSerializer
+    read_serializer_class = OperationReadSerializer
     
     def get_permissions(self):
         if self.request.method == 'POST':
             return [IsTechnologistOrAdmin()]
         return [permissions.AllowAny()]
+
+    def list(self, request, *args, **kwargs):
+        if self.read_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+        reader = self.read_serializer_class()
+        queryset = reader.values_queryset(self.filter_queryset(self.get_queryset()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.serialize(page))
+        return Response(reader.serialize(queryset))
     
+class OperationExportAPIView(OperationListCreateAPIView):
+    """
+    Выгрузка операций в CSV/XLSX потоком: operation/export/csv/ или .../xlsx/.
+    Фильтры и ?ordering= - как у списка операций.
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    def get_permissions(self):
+        return [permissions.IsAuthenticated()]
+
+    def get(self, request, file_format):
+        queryset = self.filter_queryset(self.get_queryset())
+        return export_response('operations', file_format, queryset)
+
 class OperationDetailUpdateDeleteAPIView(generics.RetrieveUpdateDestroyAPIView):
     queryset = Operation.objects.all()
     serializer_class = OperationSerializer
@@ -71,23 +108,31 @@ class OperationDetailUpdateDeleteAPIView(generics.RetrieveUpdateDestroyAPIView):
             return Response(serializer.data)
 
         return Response(status=status.HTTP_403_FORBIDDEN)
-
-    def perform_update(self, serializer):
-        instance = serializer.save()
-        
-        if instance.next_operations.exists():
-            recalculate_predict_chain(instance)
     
+@order_conditional
 class OperationAPIGetByOrder(generics.ListAPIView):
     serializer_class = OperationSerializer
+    read_serializer_class = OperationReadSerializer
 
     def get_queryset(self):
         order_pk = self.kwargs.get('order_pk')
-        return Operation.objects.filter(order_id=order_pk)
+        return Operation.objects\
+            .filter(order_id=order_pk)\
+            .select_related('assembly_shop', 'master')\
+            .prefetch_related(Prefetch('executors', queryset=Executor.objects.order_by('id')))
 
     def list(self, request, *args, **kwargs):
-        queryset = self.get_queryset()
-        sorted_ops = sort_operations_chain(queryset)
+        order_pk = self.kwargs.get('order_pk')
+        version = order_graph_version(request, order_pk)
+        if version is None:
+            return Response([])
+        if self.read_serializer_class is not None:
+            reader = self.read_serializer_class()
+            items = reader.chain_items(reader.values_queryset(Operation.objects.filter(order_id=order_pk).order_by()))
+            sorted_items = get_operation_graph(order_pk, version, items).order_operations(items)
+            return Response([item.data for item in sorted_items])
+        queryset = list(self.get_queryset())
+        sorted_ops = get_operation_graph(order_pk, version, queryset).order_operations(queryset)
         serializer = self.get_serializer(sorted_ops, many=True)
         return Response(serializer.data)
 
@@ -127,31 +172,18 @@ class OperationStartAPIView(views.APIView):
                 operation.assembly_shop = shop
                 operation.actual_start = now
                 
-                # Обновляем прогнозы при старте
+                # Обновляем прогнозы при старте; потомков пересчитает воркер очереди
+                # прогнозов - сохранение ставит операцию в очередь (api.signals)
                 operation.predict_start = now
                 operation.predict_end = now + operation.duration
-                operation.save()
+                operation.save(update_fields=['assembly_shop', 'actual_start', 'predict_start', 'predict_end', 'updated_at'])
                 
                 operation.executors.set(executors)
-                
-                # Исправлено: next_operations.exists() и убран is_ended
-                if operation.next_operations.exists():
-                    recalculate_predict_chain(operation)
-            
-            if request.user.role == 'master':
-                log = TehLog()
-                log.master = operation.master
-                log.operation = operation
-                if operation.actual_start > operation.planned_start:
-                    log.type = TehLog.LogType.LATE_START
-                    diff = operation.actual_start - operation.planned_start
-                    log.info = f"Операция '{operation.name}' в заказе '{operation.order.name}' была начата на {diff.days} день(я) {round(diff.seconds/60/60, 1)} часа(ов) позже плана мастером {operation.master.username}"
-                else:
-                    log.type = TehLog.LogType.AHEAD_START
-                    diff = operation.planned_start - operation.actual_start
-                    log.info = f"Операция '{operation.name}' в заказе '{operation.order.name}' была начата на {diff.days} день(я) {round(diff.seconds/60/60, 1)} часа(ов) раньше плана мастером {operation.master.username}"
-                
-                log.save()
+                publish_event(Kind.OPERATION_STARTED, operation_event_payload(operation), order_id=operation.order_id)
+
+                # Лог мастера создаёт фоновый воркер (api.outbox)
+                if request.user.role == 'master':
+                    enqueue_logs(TehLogOutbox.Kind.START, [operation])
 
             return Response(OperationSerializer(operation).data)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
@@ -174,24 +206,52 @@ class OperationEndAPIView(views.APIView):
         with transaction.atomic():
             now = timezone.now()
             operation.actual_end = now
-            operation.save()
-            
-            if operation.next_operations.exists():
-                recalculate_predict_chain(operation)
+            operation.save(update_fields=['actual_end', 'updated_at'])
+            publish_event(Kind.OPERATION_ENDED, operation_event_payload(operation), order_id=operation.order_id)
                 
             if request.user.role == 'master':
-                log = TehLog()
-                log.master = operation.master
-                log.operation = operation
-                if operation.actual_end > operation.planned_end:
-                    log.type = TehLog.LogType.LATE_STOP
-                    diff = operation.actual_end - operation.planned_end
-                    log.info = f"Операция '{operation.name}' в заказе '{operation.order.name}' была завершена на {diff.days} день(я) {round(diff.seconds/60/60, 1)} часа(ов) позже плана мастером {operation.master.username}"
-                else:
-                    log.type = TehLog.LogType.AHEAD_STOP
-                    diff = operation.planned_end - operation.actual_end
-                    log.info = f"Операция '{operation.name}' в заказе '{operation.order.name}' была завершена на {diff.days} день(я) {round(diff.seconds/60/60, 1)} часа(ов) раньше плана мастером {operation.master.username}"
-                
-                log.save()
+                enqueue_logs(TehLogOutbox.Kind.END, [operation])
         
-        return Response(OperationSerializer(operation).data)
\ No newline at end of file
+        return Response(OperationSerializer(operation).data)
+
+
+class OperationBatchActionAPIView(views.APIView):
+    """
+    Старт или завершение нескольких операций одним запросом и одной транзакцией.
+    Если хотя бы одна операция не проходит проверку, не меняется ни одна.
+    Ответ - операции в порядке запроса.
+    """
+    permission_classes = [IsMasterOrTechnologist]
+    serializer_class = None
+    # Функция api.bulk: action(validated operations, user) -> список операций
+    action = None
+
+    def patch(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        operations = self.action(serializer.validated_data['operations'], request.user)
+
+        reader = OperationReadSerializer()
+        ids = [op.pk for op in operations]
+        rows = {row['id']: row for row in reader.serialize(reader.values_queryset(Operation.objects.filter(pk__in=ids)))}
+        return Response([rows[pk] for pk in ids])
+
+
+class OperationBatchStartAPIView(OperationBatchActionAPIView):
+    """PATCH {"operations": [{"id", "assembly_shop_id", "executor_ids"}, ...]}"""
+    serializer_class = OperationBatchStartSerializer
+    action = staticmethod(start_operations)
+
+
+class OperationBatchEndAPIView(OperationBatchActionAPIView):
+    """PATCH {"operations": [id, ...]}"""
+    serializer_class = OperationBatchEndSerializer
+    action = staticmethod(end_operations)
+
+
+class ForecastQueueStatsView(views.APIView):
+    """Очередь пересчёта прогнозов: глубина, возраст старейшей записи, счётчики и задержка последней пачки."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        return Response(queue_stats())
@@ -1,37 +1,82 @@
 from django.db import transaction
-from rest_framework import generics, permissions
-from api.models import Order
-from api.serializers import OrderSerializer
+from django.db.models import Prefetch
+from django.http import Http404
+from django.utils import timezone
+from django.shortcuts import get_object_or_404
+from rest_framework import generics, permissions, status, views
+from rest_framework.response import Response
+from api.bulk import save_order_bulk
+from api.models import Order, Operation, Executor
+from api.serializers import OrderSerializer, OrderReadSerializer, OrderBulkSerializer
 from api.permissions import IsTechnologistOrAdmin
+from api.filters import KeysetOrderingFilter
+from api.pagination import OrderCursorPagination
+from api.conditional import order_conditional, order_list_conditional
+from api.export import export_response
+from api.schedule import order_schedule
 
-from rest_framework.pagination import PageNumberPagination
 
-class StandardResultsSetPagination(PageNumberPagination):
-    page_size = 20
-    page_size_query_param = 'page_size'
-    max_page_size = 100
+def orders_with_operations():
+    """
+    Заказы с предзагруженными операциями, их цехом, мастером и исполнителями:
+    число запросов на страницу не зависит от количества операций.
+    """
+    operations_qs = Operation.objects\
+        .select_related('assembly_shop', 'master')\
+        .prefetch_related(Prefetch('executors', queryset=Executor.objects.order_by('id')))
+    return Order.objects.prefetch_related(Prefetch('operations', queryset=operations_qs))
 
+@order_list_conditional
 class OrderListCreateAPIView(generics.ListCreateAPIView):
     """
     GET: Список заказов (доступно всем авторизованным).
     POST: Создание заказа (только Технолог/Админ).
     """
-    queryset = Order.objects.all()
+    queryset = orders_with_operations()
     serializer_class = OrderSerializer
-    pagination_class = StandardResultsSetPagination
+    pagination_class = OrderCursorPagination
+    filter_backends = [KeysetOrderingFilter]
+    ordering_fields = ('created_at', 'id')
+    # Быстрый путь чтения списка; None - сериализация через OrderSerializer
+    read_serializer_class = OrderReadSerializer
     
     def get_permissions(self):
         if self.request.method == 'POST':
             return [IsTechnologistOrAdmin()]
         return [permissions.AllowAny()]
+
+    def list(self, request, *args, **kwargs):
+        if self.read_serializer_class is None:
+            return super().list(request, *args, **kwargs)
+        reader = self.read_serializer_class()
+        queryset = reader.values_queryset(self.filter_queryset(Order.objects.all()))
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            return self.get_paginated_response(reader.serialize(page))
+        return Response(reader.serialize(queryset))
     
+class OrderExportAPIView(OrderListCreateAPIView):
+    """
+    Выгрузка заказов в CSV/XLSX потоком: order/export/csv/ или .../xlsx/.
+    Фильтры и ?ordering= - как у списка заказов.
+    """
+    http_method_names = ['get', 'head', 'options']
+
+    def get_permissions(self):
+        return [permissions.IsAuthenticated()]
+
+    def get(self, request, file_format):
+        queryset = self.filter_queryset(Order.objects.all())
+        return export_response('orders', file_format, queryset)
+    
+@order_conditional
 class OrderDetailUpdateDeleteAPIView(generics.RetrieveUpdateDestroyAPIView):
     """
     GET: Получить заказ (всем).
     PUT/PATCH: Обновить заказ (Технолог/Админ).
     DELETE: Удалить заказ (Технолог/Админ).
     """
-    queryset = Order.objects.all()
+    queryset = orders_with_operations()
     serializer_class = OrderSerializer
     
     def get_permissions(self):
@@ -53,4 +98,50 @@ class OrderDetailUpdateDeleteAPIView(generics.RetrieveUpdateDestroyAPIView):
             # Если мастер изменился (неважно, на другого или на пустоту)
             if old_master != new_master:
                 # Обновляем всех наследников
-                updated_instance.operations.update(master=new_master)
\ No newline at end of file
+                updated_instance.operations.update(master=new_master, updated_at=timezone.now())
+
+class OrderBulkSaveAPIView(views.APIView):
+    """
+    Сохранение заказа вместе со всеми операциями одним запросом.
+    Новые операции передаются с временными строковыми id, на них можно
+    ссылаться в previous_operation. В ответе заказ и соответствие
+    временных id настоящим (ids).
+    """
+    permission_classes = [IsTechnologistOrAdmin]
+
+    def save(self, request, order, response_status):
+        serializer = OrderBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        order, ids = save_order_bulk(serializer.validated_data, request.user, order)
+
+        reader = OrderReadSerializer()
+        data = reader.serialize(reader.values_queryset(Order.objects.filter(pk=order.pk)))[0]
+        return Response({'order': data, 'ids': ids}, status=response_status)
+
+
+class OrderBulkCreateAPIView(OrderBulkSaveAPIView):
+    """POST order/bulk/ - новый заказ с операциями."""
+
+    def post(self, request):
+        return self.save(request, None, status.HTTP_201_CREATED)
+
+
+class OrderBulkUpdateAPIView(OrderBulkSaveAPIView):
+    """PUT order/<pk>/bulk/ - замена заказа и полного списка его операций."""
+
+    def put(self, request, pk):
+        return self.save(request, get_object_or_404(Order, pk=pk), status.HTTP_200_OK)
+
+
+class OrderScheduleAPIView(views.APIView):
+    """
+    Расчёт по методу критического пути для заказа: ранние/поздние даты и
+    резерв каждой операции, критический путь и запас до срока заказа.
+    Отрицательный резерв - операция уже не укладывается в срок.
+    """
+
+    def get(self, request, pk):
+        data = order_schedule(pk)
+        if data is None:
+            raise Http404
+        return Response(data)
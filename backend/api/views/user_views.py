@@ -4,16 +4,18 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from django.contrib.auth import get_user_model
 from api.serializers import MasterSerializer
+from api.cache import ReferenceCacheMixin, MASTERS, stats
 
 User = get_user_model()
 
-class MasterListAPIView(generics.ListAPIView):
+class MasterListAPIView(ReferenceCacheMixin, generics.ListAPIView):
+    cache_namespace = MASTERS
     serializer_class = MasterSerializer
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
         # Возвращаем пользователей с ролью 'master'
-        return User.objects.filter(role='master')
+        return User.objects.filter(role='master').order_by('id')
     
 class CurrentUserView(APIView):
     permission_classes = [IsAuthenticated]
@@ -21,4 +23,11 @@ class CurrentUserView(APIView):
     def get(self, request):
         serializer = MasterSerializer(request.user) # MasterSerializer содержит поле role?
         # Если нет, используйте UserSerializer из djoser или кастомный, где есть поле 'role'
-        return Response(serializer.data)
\ No newline at end of file
+        return Response(serializer.data)
+
+class ReferenceCacheStatsView(APIView):
+    """Попадания, промахи и текущие версии кэша справочников (всех воркеров)."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request):
+        return Response(stats.snapshot())
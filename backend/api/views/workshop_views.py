@@ -2,10 +2,13 @@ from rest_framework import generics
 from rest_framework.permissions import IsAuthenticatedOrReadOnly
 from api.models import AssemblyShop
 from api.serializers import AssemblyShopSerializer
+from api.cache import ReferenceCacheMixin, WORKSHOPS
 # Create your views here.
 
-class AssemblyShopAPIList(generics.ListCreateAPIView):
-    queryset = AssemblyShop.objects.all()
+class AssemblyShopAPIList(ReferenceCacheMixin, generics.ListCreateAPIView):
+    cache_namespace = WORKSHOPS
+    # Стабильный порядок - страницы кэшируются
+    queryset = AssemblyShop.objects.order_by('id')
     serializer_class = AssemblyShopSerializer
     permission_classes = [IsAuthenticatedOrReadOnly]
     
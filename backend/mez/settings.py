@@ -68,6 +68,7 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    "api.replicas.ReplicaMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -114,6 +115,24 @@ else:
         }
     }
 
+# Реплики для чтения (api.replicas): хосты через запятую, остальные параметры
+# как у default. В тестах реплика - зеркало default. SQLITE_REPLICA=true
+# добавляет реплику-псевдоним той же базы SQLite для локальной проверки.
+DATABASE_REPLICAS = []
+_replica_hosts = [host.strip() for host in os.getenv("DB_REPLICA_HOSTS", "").split(",") if host.strip()]
+if USE_SQLITE and os.getenv("SQLITE_REPLICA", "false").lower() == "true":
+    _replica_hosts = [None]
+for _number, _host in enumerate(_replica_hosts, start=1):
+    _alias = "replica" if _number == 1 else f"replica_{_number}"
+    DATABASES[_alias] = {**DATABASES["default"], "TEST": {"MIRROR": "default"}}
+    if _host:
+        DATABASES[_alias]["HOST"] = _host
+        DATABASES[_alias]["PORT"] = os.getenv("DB_REPLICA_PORT", DATABASES["default"]["PORT"])
+    DATABASE_REPLICAS.append(_alias)
+DATABASE_ROUTERS = ["api.replicas.ReplicaRouter"]
+# Сколько секунд после изменяющего запроса клиент читает с основной базы
+REPLICA_PIN_SECONDS = float(os.getenv("REPLICA_PIN_SECONDS", "5"))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -155,6 +174,65 @@ MEDIA_ROOT = BASE_DIR / 'media'
 
 AUTH_USER_MODEL = 'api.CustomUser'
 
+# Сколько графов операций заказов держит в памяти каждый процесс (api.graph)
+OPERATION_GRAPH_CACHE_SIZE = int(os.getenv("OPERATION_GRAPH_CACHE_SIZE", "512"))
+
+# За сколько дней /executors/aggregated/ отдаёт завершённые задачи, если окно ?from= не задано
+EXECUTOR_TASKS_DEFAULT_DAYS = int(os.getenv("EXECUTOR_TASKS_DEFAULT_DAYS", "30"))
+
+# Поток событий /api/v1/events/stream/ (api.events)
+LIVE_EVENTS_POLL_INTERVAL = float(os.getenv("LIVE_EVENTS_POLL_INTERVAL", "1.0"))
+LIVE_EVENTS_HEARTBEAT = int(os.getenv("LIVE_EVENTS_HEARTBEAT", "15"))
+LIVE_EVENTS_BUFFER_SIZE = int(os.getenv("LIVE_EVENTS_BUFFER_SIZE", "1000"))
+LIVE_EVENTS_RETENTION_HOURS = int(os.getenv("LIVE_EVENTS_RETENTION_HOURS", "24"))
+# Сколько секунд ждать событие с пропущенным id (транзакция ещё не закоммичена)
+LIVE_EVENTS_GAP_WAIT = int(os.getenv("LIVE_EVENTS_GAP_WAIT", "5"))
+# Время жизни одноразового билета на подключение к потоку
+LIVE_EVENTS_TICKET_SECONDS = int(os.getenv("LIVE_EVENTS_TICKET_SECONDS", "30"))
+
+# Очередь логов мастера (api.outbox, manage.py drain_tehlog_outbox)
+TEHLOG_OUTBOX_BATCH_SIZE = int(os.getenv("TEHLOG_OUTBOX_BATCH_SIZE", "500"))
+TEHLOG_OUTBOX_INTERVAL = float(os.getenv("TEHLOG_OUTBOX_INTERVAL", "1.0"))
+
+# Срок хранения логов в таблице и каталог архивов (manage.py archive_tehlogs)
+TEHLOG_RETENTION_DAYS = int(os.getenv("TEHLOG_RETENTION_DAYS", "180"))
+TEHLOG_ARCHIVE_DIR = Path(os.getenv("TEHLOG_ARCHIVE_DIR", str(BASE_DIR / "archive" / "tehlog")))
+
+# Выгрузки CSV/XLSX (api.export): строк за одно чтение курсора БД
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", "2000"))
+
+# Расчёт критического пути заказа (api.schedule): сколько секунд кэшируется результат
+SCHEDULE_CACHE_TIMEOUT = int(os.getenv("SCHEDULE_CACHE_TIMEOUT", "60"))
+
+# Движок прогнозов для ежедневного update_predict_operations и воркера очереди
+# drain_forecast_queue: chain - сдвиг цепочек без учёта загрузки, capacity -
+# планирование с учётом занятости исполнителей и цехов (manage.py
+# forecast_capacity --follow; воркер очереди в этом режиме только очищает очередь)
+FORECAST_ENGINE = os.getenv("FORECAST_ENGINE", "chain")
+CAPACITY_FORECAST_INTERVAL = float(os.getenv("CAPACITY_FORECAST_INTERVAL", "2.0"))
+CAPACITY_FORECAST_MAX_AGE = float(os.getenv("CAPACITY_FORECAST_MAX_AGE", "300"))
+
+# Очередь пересчёта прогнозов потомков (api.reforecast, manage.py drain_forecast_queue)
+FORECAST_QUEUE_BATCH_SIZE = int(os.getenv("FORECAST_QUEUE_BATCH_SIZE", "500"))
+FORECAST_QUEUE_INTERVAL = float(os.getenv("FORECAST_QUEUE_INTERVAL", "0.5"))
+FORECAST_OVERDUE_INTERVAL = float(os.getenv("FORECAST_OVERDUE_INTERVAL", "3600"))
+
+# Кэш справочников (api.cache): общий для всех воркеров gunicorn и процесса
+# событий, поэтому в БД. Таблица создаётся командой createcachetable.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "reference": {
+        "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+        "LOCATION": "reference_cache",
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 5000},
+    },
+}
+REFERENCE_CACHE_ALIAS = "reference"
+REFERENCE_CACHE_TIMEOUT = int(os.getenv("REFERENCE_CACHE_TIMEOUT", "86400"))
+
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
 
 